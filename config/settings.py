@@ -1,34 +1,99 @@
 import os
-from dotenv import load_dotenv
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Mapping, Optional
 
-load_dotenv()
+from dotenv import dotenv_values, find_dotenv
 
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
+# Флаг однократной загрузки .env — повторные импорты не перечитывают файл с диска
+_LOADED = False
 
-# Учетные данные для Copernicus CDS API
-# New API format (no UID prefix required)
-CDS_API_URL = os.getenv("CDS_API_URL", "https://cds.climate.copernicus.eu/api")
-CDS_API_KEY = os.getenv("CDS_API_KEY")
 
-# OpenRouter API для LLM рекомендаций
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
+def _load_env():
+    """
+    Загружает .env в os.environ один раз за процесс.
 
-# Database configuration
-DATABASE_URL = os.getenv("DATABASE_URL")
-DB_HOST = os.getenv("DB_HOST", "localhost")
-DB_PORT = int(os.getenv("DB_PORT", "5432"))
-DB_NAME = os.getenv("DB_NAME", "crop_forecast_bot")
-DB_USER = os.getenv("DB_USER", "postgres")
-DB_PASSWORD = os.getenv("DB_PASSWORD", "")
+    Файл читается и разбирается один раз (dotenv_values), затем одним update
+    добавляются только отсутствующие переменные — заданные окружением
+    контейнера значения не перезаписываются.
+    """
+    global _LOADED
+    if not _LOADED:
+        values = dotenv_values(find_dotenv(usecwd=True))
+        os.environ.update({
+            key: value for key, value in values.items()
+            if value is not None and key not in os.environ
+        })
+        _LOADED = True
 
 
+@dataclass(frozen=True)
+class Settings:
+    """Снимок переменных окружения, разрешённый один раз при первом обращении."""
+    TELEGRAM_BOT_TOKEN: str
+
+    # Учетные данные для Copernicus CDS API
+    # New API format (no UID prefix required)
+    CDS_API_URL: str
+    CDS_API_KEY: Optional[str]
+
+    # OpenRouter API для LLM рекомендаций
+    OPENROUTER_API_KEY: str
+
+    # Database configuration
+    DATABASE_URL: Optional[str]
+    DB_HOST: str
+    DB_PORT: int
+    DB_NAME: str
+    DB_USER: str
+    DB_PASSWORD: str
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Возвращает закэшированный снимок настроек (os.environ читается один раз)."""
+    _load_env()
+    env = os.environ
+    return Settings(
+        TELEGRAM_BOT_TOKEN=env.get("TELEGRAM_BOT_TOKEN", ""),
+        CDS_API_URL=env.get("CDS_API_URL", "https://cds.climate.copernicus.eu/api"),
+        CDS_API_KEY=env.get("CDS_API_KEY"),
+        OPENROUTER_API_KEY=env.get("OPENROUTER_API_KEY", ""),
+        DATABASE_URL=env.get("DATABASE_URL"),
+        DB_HOST=env.get("DB_HOST", "localhost"),
+        DB_PORT=int(env.get("DB_PORT", "5432")),
+        DB_NAME=env.get("DB_NAME", "crop_forecast_bot"),
+        DB_USER=env.get("DB_USER", "postgres"),
+        DB_PASSWORD=env.get("DB_PASSWORD", ""),
+    )
+
+
+@lru_cache(maxsize=1)
+def get_settings_mapping() -> Mapping[str, object]:
+    """Read-only словарь настроек (MappingProxyType) для передачи в сторонний код."""
+    return MappingProxyType(asdict(get_settings()))
+
+
+def __getattr__(name):
+    # PEP 562: `from config.settings import TELEGRAM_BOT_TOKEN` отдаёт поле из кэша
+    if name in Settings.__dataclass_fields__:
+        return getattr(get_settings(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@lru_cache(maxsize=1)
 def get_database_url() -> str:
-    """Get async database URL for PostgreSQL"""
+    """Get async database URL for PostgreSQL (computed once from cached settings)"""
+    settings = get_settings()
     # If DATABASE_URL is set, use it directly
-    if DATABASE_URL:
+    if settings.DATABASE_URL:
         # Convert postgresql:// to postgresql+asyncpg:// if needed
-        if DATABASE_URL.startswith("postgresql://"):
-            return DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
-        return DATABASE_URL
+        if settings.DATABASE_URL.startswith("postgresql://"):
+            return settings.DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+        return settings.DATABASE_URL
     # Otherwise, construct from individual components
-    return f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    return (
+        f"postgresql+asyncpg://{settings.DB_USER}:{settings.DB_PASSWORD}"
+        f"@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
+    )
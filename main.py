@@ -1,21 +1,35 @@
+import os
 import sys
 import time
+import threading
 import subprocess
 from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
 from watchdog.events import FileSystemEventHandler
 
 # Пути, за которыми нужно следить
 WATCH_PATHS = ['.', './src', './config']
 
+# Окно склейки событий: редакторы генерируют несколько событий на одно сохранение
+RESTART_DEBOUNCE_SECONDS = 0.3
+
+# Замороженные stdlib-модули ускоряют старт дочернего интерпретатора при перезапусках
+# (Python 3.11+; старые версии игнорируют неизвестные -X опции)
+CHILD_INTERPRETER_ARGS = ['-X', 'frozen_modules=on']
+
 def run_bot():
     """Запускает бота в дочернем процессе."""
     # Запускаем бота через subprocess, чтобы он работал в своем собственном процессе
-    process = subprocess.Popen([sys.executable, 'run_bot.py'])
+    process = subprocess.Popen([sys.executable, *CHILD_INTERPRETER_ARGS, 'run_bot.py'])
     return process
 
 class ChangeHandler(FileSystemEventHandler):
     """Обработчик событий файловой системы для перезапуска бота."""
     def __init__(self):
+        self._lock = threading.Lock()
+        # Момент (time.monotonic), после которого нужно перезапустить бота; None — перезапуск не нужен
+        self._pending_restart_at = None
+        self._last_changed_path = None
         self.process = run_bot()
 
     def on_any_event(self, event):
@@ -23,34 +37,54 @@ class ChangeHandler(FileSystemEventHandler):
         if event.is_directory or not event.src_path.endswith('.py'):
             return
 
-        print(f"Обнаружено изменение в {event.src_path}, перезапускаю бота...", flush=True)
-        self.process.terminate()
-        self.process.wait()
-        self.process = run_bot()
+        # Каждое новое событие сдвигает дедлайн — пачка событий даёт один перезапуск
+        with self._lock:
+            self._pending_restart_at = time.monotonic() + RESTART_DEBOUNCE_SECONDS
+            self._last_changed_path = event.src_path
+
+    def restart_if_due(self):
+        """Перезапускает бота, если после последнего события истекло окно склейки."""
+        with self._lock:
+            if self._pending_restart_at is None or time.monotonic() < self._pending_restart_at:
+                return
+            self._pending_restart_at = None
+            print(f"Обнаружено изменение в {self._last_changed_path}, перезапускаю бота...", flush=True)
+            self.process.terminate()
+            self.process.wait()
+            self.process = run_bot()
+
+    def stop(self):
+        """Останавливает дочерний процесс бота."""
+        with self._lock:
+            self.process.terminate()
+            self.process.wait()
+
+def create_observer():
+    """Создаёт нативный наблюдатель ФС; опрос диска — только если нативный недоступен."""
+    try:
+        return Observer()
+    except OSError:
+        return PollingObserver()
 
 if __name__ == "__main__":
     # Если запуск с флагом --dev, включаем автоперезагрузку
     if '--dev' in sys.argv:
         print("Запуск в режиме разработки с автоперезагрузкой...", flush=True)
         event_handler = ChangeHandler()
-        observer = Observer()
+        observer = create_observer()
         for path in WATCH_PATHS:
             observer.schedule(event_handler, path, recursive=True)
-        
+
         observer.start()
         try:
             while True:
-                time.sleep(1)
+                time.sleep(0.1)
+                event_handler.restart_if_due()
         except KeyboardInterrupt:
             observer.stop()
-            event_handler.process.terminate()
-            event_handler.process.wait()
+            event_handler.stop()
         observer.join()
     else:
-        # В обычном режиме просто запускаем run_bot.py
+        # В обычном режиме замещаем текущий процесс на run_bot.py (без промежуточного родителя)
         # Это основной способ запуска для production
-        try:
-            subprocess.run([sys.executable, 'run_bot.py'])
-        except KeyboardInterrupt:
-            print("\nБот остановлен.")
-
+        os.execv(sys.executable, [sys.executable, 'run_bot.py', *sys.argv[1:]])
@@ -1,122 +1,341 @@
-import telebot
+import os
+import sys
+import queue
+import atexit
 import time
+import random
 import socket
-import requests
-import asyncio
+import hashlib
+import argparse
+import tempfile
+import ipaddress
 import logging
+import logging.handlers
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
 from config.settings import TELEGRAM_BOT_TOKEN, get_database_url
-from src.bot.handlers import register_handlers
-from src.database import init_db
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def setup_logging():
+    """
+    Настраивает логирование через очередь.
+
+    Потоки-обработчики только кладут запись в очередь (QueueHandler), а запись
+    в stdout выполняет отдельный поток QueueListener — медленный вывод в Docker
+    не блокирует обработку сообщений.
+    """
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # Финальное оформление (время, уровень, имя) делает StreamHandler в потоке listener
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
+    listener.start()
+    # Дописываем оставшиеся в очереди записи при завершении процесса
+    atexit.register(listener.stop)
+
 
 # Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.StreamHandler()]
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=1)
+def get_http_session():
+    """
+    Возвращает общую HTTP-сессию с пулом соединений для клиента Telegram.
+
+    Одно TLS-соединение переиспользуется между getUpdates и отправкой сообщений,
+    а после переподключения не требуется заново открывать пул.
+    requests импортируется здесь, чтобы `import run_bot` оставался дешёвым.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection
+
+    class KeepAliveAdapter(HTTPAdapter):
+        """HTTPAdapter с TCP keep-alive поверх стандартных опций urllib3 (TCP_NODELAY)."""
+
+        def init_poolmanager(self, *args, **kwargs):
+            kwargs['socket_options'] = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+            ]
+            super().init_poolmanager(*args, **kwargs)
+
+    session = requests.Session()
+    session.mount('https://', KeepAliveAdapter(pool_connections=4, pool_maxsize=16, max_retries=0))
+    return session
+
+
+TELEGRAM_API_HOST = 'api.telegram.org'
+DNS_CACHE_TTL = 300  # секунд
+
+# Параметры повторных попыток
+NETWORK_CHECK_MAX_RETRIES = 5
+POLLING_MAX_RETRIES = 10
+BACKOFF_BASE = 1   # секунд
+BACKOFF_CAP = 60   # секунд
+
+# Отметка об успешной проверке схемы БД: при частых перезапусках DDL не повторяется
+SCHEMA_STAMP_FILE = os.path.join(tempfile.gettempdir(), 'crop_forecast_bot_schema.stamp')
+SCHEMA_STAMP_TTL = 24 * 3600  # секунд
+
+# Число потоков telebot, параллельно обрабатывающих апдейты (не больше pool_maxsize сессии)
+BOT_WORKER_THREADS = 8
+
+# Кэш разрешённых адресов: host -> (ip, момент истечения по time.monotonic())
+_dns_cache = {}
+
+
+def _resolve(host, ttl=DNS_CACHE_TTL):
+    """
+    Разрешает имя хоста в IP с кэшированием на ttl секунд.
+
+    Если host уже является IP-литералом, DNS не запрашивается.
+
+    Args:
+        host: имя хоста или IP-адрес
+        ttl: время жизни записи в кэше (сек)
+
+    Returns:
+        IP-адрес строкой
+    """
+    try:
+        return str(ipaddress.ip_address(host))
+    except ValueError:
+        pass
+
+    cached = _dns_cache.get(host)
+    now = time.monotonic()
+    if cached and cached[1] > now:
+        return cached[0]
+
+    ip = socket.gethostbyname(host)
+    _dns_cache[host] = (ip, now + ttl)
+    return ip
+
+
+def invalidate_dns_cache(host=None):
+    """Сбрасывает кэш DNS (целиком или для одного хоста) — следующая проверка заново разрешит имя."""
+    if host is None:
+        _dns_cache.clear()
+    else:
+        _dns_cache.pop(host, None)
+
+
+def _next_delay(prev, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """
+    Decorrelated jitter: следующая задержка случайна в [base, min(cap, prev * 3)].
+
+    В отличие от детерминированного удвоения, одновременно перезапущенные
+    экземпляры бота не переподключаются синхронно.
+
+    Args:
+        prev: предыдущая задержка (сек)
+        base: минимальная задержка (сек)
+        cap: верхняя граница задержки (сек)
+
+    Returns:
+        Задержка перед следующей попыткой (сек)
+    """
+    return random.uniform(base, min(cap, max(base, prev * 3)))
+
+
 def check_network_connectivity():
     """Проверяет доступность сети перед запуском бота."""
-    max_retries = 5
-    retry_delay = 2
+    max_retries = NETWORK_CHECK_MAX_RETRIES
+    retry_delay = BACKOFF_BASE
 
     for attempt in range(1, max_retries + 1):
         try:
-            # Проверка DNS
-            socket.gethostbyname('api.telegram.org')
+            # Проверка DNS (из кэша, если запись свежая)
+            ip = _resolve(TELEGRAM_API_HOST)
 
-            # Проверка HTTP подключения
-            response = requests.get('https://api.telegram.org', timeout=5)
-            print(f"✓ Сеть доступна (попытка {attempt}/{max_retries})", flush=True)
+            # Проверка TCP подключения к порту HTTPS без TLS-рукопожатия и HTTP-запроса
+            with socket.create_connection((ip, 443), timeout=2):
+                pass
+            logger.info("✓ Сеть доступна (попытка %d/%d)", attempt, max_retries)
             return True
         except Exception as e:
-            print(f"⚠ Сеть недоступна (попытка {attempt}/{max_retries}): {e}", flush=True)
+            # Адрес мог устареть — при следующей попытке разрешаем заново
+            invalidate_dns_cache(TELEGRAM_API_HOST)
+            logger.warning("⚠ Сеть недоступна (попытка %d/%d): %s", attempt, max_retries, e)
             if attempt < max_retries:
-                print(f"  Повторная попытка через {retry_delay} секунд...", flush=True)
+                retry_delay = _next_delay(retry_delay)
+                logger.info("  Повторная попытка через %.1f секунд...", retry_delay)
                 time.sleep(retry_delay)
-                retry_delay *= 2  # Экспоненциальная задержка
             else:
-                print("✗ Не удалось установить сетевое подключение после всех попыток", flush=True)
+                logger.error("✗ Не удалось установить сетевое подключение после всех попыток")
                 return False
 
 
+def _schema_stamp_key(database_url):
+    """Ключ отметки схемы — хэш URL, таблиц и колонок: смена БД или изменение модели сбрасывают отметку."""
+    from src.database.models import Base
+
+    schema = ';'.join(
+        f"{name}:{','.join(sorted(table.columns.keys()))}"
+        for name, table in sorted(Base.metadata.tables.items())
+    )
+    return hashlib.sha256(f"{database_url}|{schema}".encode()).hexdigest()
+
+
+def _schema_recently_checked(database_url):
+    """Проверяет, создавались ли таблицы для этой БД не раньше SCHEMA_STAMP_TTL секунд назад."""
+    try:
+        if time.time() - os.path.getmtime(SCHEMA_STAMP_FILE) > SCHEMA_STAMP_TTL:
+            return False
+        with open(SCHEMA_STAMP_FILE) as f:
+            return f.read().strip() == _schema_stamp_key(database_url)
+    except OSError:
+        return False
+
+
+def _mark_schema_checked(database_url):
+    """Записывает отметку об успешной проверке схемы; ошибки записи не критичны."""
+    try:
+        with open(SCHEMA_STAMP_FILE, 'w') as f:
+            f.write(_schema_stamp_key(database_url))
+    except OSError as e:
+        logger.debug("Не удалось записать отметку схемы БД: %s", e)
+
+
 def init_database():
     """Инициализирует базу данных."""
+    from src.database import init_db, run_sync
+
     try:
         database_url = get_database_url()
-        logger.info(f"🔧 Инициализация базы данных...")
+        logger.info("🔧 Инициализация базы данных...")
         db = init_db(database_url)
 
-        # Create tables if they don't exist
+        if _schema_recently_checked(database_url):
+            logger.info("✓ Таблицы проверялись недавно, DDL пропущен")
+            return True
+
+        # Create tables if they don't exist (legacy coordinate columns are migrated first)
         async def create_tables():
-            await db.create_tables()
+            if await db.create_tables():
+                logger.info("✓ Координаты пользователей переведены в latitude_e6/longitude_e6")
             logger.info("✓ Таблицы базы данных проверены/созданы")
 
-        asyncio.run(create_tables())
+        # Общий долгоживущий цикл событий — тот же, что используют обработчики
+        run_sync(create_tables())
+        _mark_schema_checked(database_url)
         logger.info("✓ База данных инициализирована успешно")
         return True
     except Exception as e:
-        logger.error(f"✗ Ошибка при инициализации базы данных: {e}", exc_info=True)
+        logger.error("✗ Ошибка при инициализации базы данных: %s", e, exc_info=True)
         return False
 
 
-def start_bot():
-    """Инициализирует и запускает бота."""
+def make_bot(token):
+    """Создаёт экземпляр TeleBot на общей HTTP-сессии и регистрирует обработчики."""
+    import telebot
+    from src.bot.handlers import register_handlers
+
+    # Все запросы telebot идут через общую сессию с пулом соединений
+    telebot.apihelper.session = get_http_session()
+    bot = telebot.TeleBot(token, threaded=True, num_threads=BOT_WORKER_THREADS)
+    register_handlers(bot)
+    return bot
+
+
+def start_bot(with_database=True, with_network_check=True, bot_factory=make_bot):
+    """
+    Инициализирует и запускает бота.
+
+    Args:
+        with_database: инициализировать базу данных перед запуском
+        with_network_check: проверять доступность Telegram API перед запуском
+        bot_factory: функция token -> bot, создающая бота с обработчиками
+    """
+    import requests
+
     if not TELEGRAM_BOT_TOKEN:
-        print("Ошибка: Токен для Telegram не найден. Проверьте ваш .env файл.", flush=True)
+        logger.error("Ошибка: Токен для Telegram не найден. Проверьте ваш .env файл.")
         return
 
-    # Initialize database
-    logger.info("Инициализация базы данных...")
-    if not init_database():
+    # Инициализация БД и проверка сети независимы — выполняем их параллельно
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        db_future = executor.submit(init_database) if with_database else None
+        if with_database:
+            logger.info("Инициализация базы данных...")
+        net_future = executor.submit(check_network_connectivity) if with_network_check else None
+        if with_network_check:
+            logger.info("Проверка сетевого подключения...")
+
+        db_ok = db_future.result() if db_future else True
+        net_ok = net_future.result() if net_future else True
+
+    if not db_ok:
         logger.error("Не удалось инициализировать базу данных. Проверьте настройки DATABASE_URL.")
         time.sleep(10)
         return
 
-    # Проверка сети перед запуском
-    print("Проверка сетевого подключения...", flush=True)
-    if not check_network_connectivity():
-        print("Ошибка: Не могу подключиться к Telegram API. Проверьте сетевые настройки.", flush=True)
+    if not net_ok:
+        logger.error("Ошибка: Не могу подключиться к Telegram API. Проверьте сетевые настройки.")
         time.sleep(10)  # Пауза перед выходом, чтобы увидеть ошибку в логах
         return
 
-    bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN)
-    register_handlers(bot)
+    bot = bot_factory(TELEGRAM_BOT_TOKEN)
 
-    print("Бот запущен и подключен к Telegram API...", flush=True)
+    logger.info("Бот запущен и подключен к Telegram API...")
 
     # Запуск с retry логикой
     retry_count = 0
-    max_retries = 10
+    max_retries = POLLING_MAX_RETRIES
+    retry_delay = BACKOFF_BASE
 
     while retry_count < max_retries:
         try:
             bot.infinity_polling(timeout=30, long_polling_timeout=25, skip_pending=True)
         except requests.exceptions.ReadTimeout:
-            print("⚠ Таймаут при чтении от Telegram API, переподключение...", flush=True)
-            time.sleep(5)
             retry_count += 1
+            retry_delay = _next_delay(retry_delay)
+            # Штатная ситуация при простое long polling — только на уровне DEBUG
+            logger.debug("Таймаут при чтении от Telegram API, переподключение через %.1f секунд", retry_delay)
+            time.sleep(retry_delay)
         except requests.exceptions.ConnectionError as e:
-            print(f"⚠ Ошибка подключения к Telegram API: {e}", flush=True)
+            logger.warning("⚠ Ошибка подключения к Telegram API: %s", e)
+            invalidate_dns_cache(TELEGRAM_API_HOST)
             retry_count += 1
-            wait_time = min(60, 5 * (2 ** retry_count))  # Экспоненциальная задержка, макс 60 сек
-            print(f"  Повторная попытка через {wait_time} секунд (попытка {retry_count}/{max_retries})...", flush=True)
-            time.sleep(wait_time)
+            retry_delay = _next_delay(retry_delay)
+            logger.info("  Повторная попытка через %.1f секунд (попытка %d/%d)...", retry_delay, retry_count, max_retries)
+            time.sleep(retry_delay)
         except KeyboardInterrupt:
-            print("\nБот остановлен пользователем.", flush=True)
+            logger.info("Бот остановлен пользователем.")
             break
         except Exception as e:
-            print(f"✗ Произошла ошибка: {e}", flush=True)
+            logger.error("✗ Произошла ошибка: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
             retry_count += 1
             if retry_count < max_retries:
-                print(f"  Перезапуск через 10 секунд...", flush=True)
-                time.sleep(10)
+                retry_delay = _next_delay(retry_delay)
+                logger.info("  Перезапуск через %.1f секунд...", retry_delay)
+                time.sleep(retry_delay)
             else:
-                print(f"✗ Превышено максимальное количество попыток ({max_retries}). Бот остановлен.", flush=True)
+                logger.error("✗ Превышено максимальное количество попыток (%d). Бот остановлен.", max_retries)
                 break
+        else:
+            # Polling завершился штатно — следующая ошибка снова начинает с базовой задержки
+            retry_delay = BACKOFF_BASE
+
+
+def parse_args(argv=None):
+    """Разбирает аргументы командной строки."""
+    parser = argparse.ArgumentParser(description="Запуск Telegram-бота Crop Forecast")
+    parser.add_argument(
+        '--skip-network-check', '--fast', dest='skip_network_check', action='store_true',
+        help="не проверять доступность Telegram API перед запуском (ошибки обработает цикл polling)"
+    )
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    start_bot()
+    args = parse_args(sys.argv[1:])
+    start_bot(with_network_check=not args.skip_network_check)
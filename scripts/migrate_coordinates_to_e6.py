@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Migration script to convert users.latitude/longitude (double precision)
+into integer micro-degree columns users.latitude_e6/longitude_e6.
+
+Safe to run more than once: already migrated tables are left untouched.
+The bot applies the same migration on startup (Database.create_tables).
+
+Usage:
+    python scripts/migrate_coordinates_to_e6.py
+"""
+import asyncio
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.settings import get_database_url
+from src.database import init_db
+from src.database.migrations import migrate_coordinates_to_e6 as apply_migration
+
+
+async def migrate_coordinates_to_e6():
+    """Convert float coordinate columns to integer micro-degrees in one transaction"""
+    db = init_db(get_database_url())
+
+    async with db.engine.begin() as conn:
+        migrated = await apply_migration(conn)
+
+    if migrated:
+        print("✓ Coordinates converted to integer micro-degrees")
+    else:
+        print("ℹ users table already uses latitude_e6/longitude_e6, nothing to migrate")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(migrate_coordinates_to_e6())
+    except Exception as e:
+        print(f"\n\n✗ Fatal error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -3,23 +3,29 @@
 Migration script to transfer user coordinates from JSON file to PostgreSQL database.
 
 Usage:
-    python scripts/migrate_json_to_db.py
+    python scripts/migrate_json_to_db.py [--verbose]
 """
+import argparse
 import json
 import asyncio
 import sys
 import os
 
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to stdlib json
+    orjson = None
+
 # Add parent directory to path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from config.settings import get_database_url
 from src.database import init_db
-from src.database.crud import save_coordinates
+from src.database.crud import bulk_save_coordinates
 
 
-async def migrate_json_to_db():
-    """Migrate coordinates from JSON file to database"""
+async def migrate_json_to_db(verbose: bool = False):
+    """Migrate coordinates from JSON file to database in a single transaction"""
 
     print("=" * 60)
     print("JSON to Database Migration Script")
@@ -43,8 +49,10 @@ async def migrate_json_to_db():
     print(f"\n📂 Reading JSON file: {json_file}")
 
     try:
-        with open(json_file, 'r') as f:
-            data = json.load(f)
+        with open(json_file, 'rb') as f:
+            raw = f.read()
+        # orjson.JSONDecodeError subclasses json.JSONDecodeError, so one except covers both
+        data = orjson.loads(raw) if orjson else json.loads(raw)
         print(f"✓ Found {len(data)} users in JSON file")
     except FileNotFoundError:
         print("✗ No coordinates.json file found, nothing to migrate")
@@ -57,25 +65,32 @@ async def migrate_json_to_db():
         print("ℹ No data to migrate")
         return
 
-    # Migrate each user
+    # Migrate all users with one bulk upsert
     print("\n🔄 Starting migration...")
     migrated = 0
     errors = 0
 
-    async with db.get_session() as session:
-        for user_id, coords in data.items():
-            try:
-                await save_coordinates(
-                    session=session,
-                    telegram_id=int(user_id),
-                    latitude=coords['latitude'],
-                    longitude=coords['longitude']
-                )
-                migrated += 1
-                print(f"  ✓ Migrated user {user_id}: ({coords['latitude']}, {coords['longitude']})")
-            except Exception as e:
-                errors += 1
-                print(f"  ✗ Error migrating user {user_id}: {e}")
+    rows = []
+    for user_id, coords in data.items():
+        try:
+            rows.append({
+                'telegram_id': int(user_id),
+                'latitude': coords['latitude'],
+                'longitude': coords['longitude']
+            })
+        except (KeyError, TypeError, ValueError) as e:
+            errors += 1
+            print(f"  ✗ Invalid record for user {user_id}: {e}")
+
+    try:
+        async with db.get_session() as session:
+            migrated = await bulk_save_coordinates(session, rows)
+        if verbose:
+            for row in rows:
+                print(f"  ✓ Migrated user {row['telegram_id']}: ({row['latitude']}, {row['longitude']})")
+    except Exception as e:
+        errors += len(rows)
+        print(f"  ✗ Error migrating users: {e}")
 
     print()
     print("=" * 60)
@@ -86,20 +101,29 @@ async def migrate_json_to_db():
     print(f"Errors: {errors}")
     print()
 
-    if migrated > 0:
+    if migrated > 0 and errors == 0:
+        # One-shot: archive the file so a repeated run finds nothing to migrate
+        backup_file = json_file + '.bak'
+        os.replace(json_file, backup_file)
         print("✓ Migration completed successfully!")
+        print(f"✓ JSON file archived as {backup_file}")
         print()
         print("Next steps:")
         print("1. Verify data in database")
-        print("2. Backup the JSON file: cp data/coordinates.json data/coordinates.json.backup")
-        print("3. Remove or archive the JSON file after verification")
+        print(f"2. Remove {backup_file} after verification")
+    elif migrated > 0:
+        print("⚠ Migration completed with errors, JSON file left in place")
     else:
         print("⚠ No users were migrated. Please check for errors above.")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate user coordinates from JSON to the database")
+    parser.add_argument("--verbose", action="store_true", help="print every migrated user")
+    args = parser.parse_args()
+
     try:
-        asyncio.run(migrate_json_to_db())
+        asyncio.run(migrate_json_to_db(verbose=args.verbose))
     except KeyboardInterrupt:
         print("\n\nMigration cancelled by user")
     except Exception as e:
@@ -7,10 +7,19 @@ import os
 import sys
 import numpy as np
 import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.inspection import permutation_importance
 from sklearn.model_selection import train_test_split
 import joblib
 
+# LZ4 распаковывается быстрее zlib — модель быстрее грузится при старте бота.
+# Если пакет lz4 не установлен, используем встроенный zlib.
+try:
+    import lz4  # noqa: F401
+    MODEL_COMPRESSION = ('lz4', 3)
+except ImportError:
+    MODEL_COMPRESSION = ('zlib', 3)
+
 # Создаем директории
 os.makedirs('models', exist_ok=True)
 os.makedirs('data/training', exist_ok=True)
@@ -40,7 +49,8 @@ print()
 # Генерируем синтетические данные
 print("📊 Генерация синтетических данных...")
 
-np.random.seed(42)
+# Генератор PCG64 вместо глобального MT19937 (np.random.seed)
+rng = np.random.default_rng(42)
 n_samples = 5000
 
 # Параметры каждой культуры (на основе crop_suitability.py)
@@ -79,43 +89,38 @@ CROP_PARAMS = {
     }
 }
 
-# Генерируем данные
-data = []
-labels = []
-
-for crop_name, crop_id in [('wheat', 0), ('corn', 1), ('sunflower', 2), ('soy', 3),
-                            ('barley', 4), ('rapeseed', 5), ('potato', 6), ('sugar_beet', 7)]:
-    params = CROP_PARAMS[crop_name]
-    samples_per_crop = n_samples // 8
-
-    for _ in range(samples_per_crop):
-        # Генерируем значения с небольшим шумом
-        T_avg = np.random.uniform(*params['T_avg']) + np.random.normal(0, 2)
-        precip = np.random.uniform(*params['precip']) + np.random.normal(0, 50)
-        gdd = np.random.uniform(*params['gdd']) + np.random.normal(0, 100)
-        lai = np.random.uniform(*params['lai']) + np.random.normal(0, 0.5)
-        ndvi = np.random.uniform(*params['ndvi']) + np.random.normal(0, 0.05)
-        ph = np.random.uniform(*params['ph']) + np.random.normal(0, 0.3)
-
-        # Дополнительные признаки
-        gtk = np.random.uniform(0.8, 1.8)
-        spi = np.random.uniform(-1.5, 1.5)
-        soil_moisture = np.random.uniform(0.3, 0.9)
-        frost_free_days = np.random.uniform(150, 250)
-
-        # Ограничиваем значения разумными пределами
-        T_avg = np.clip(T_avg, -10, 40)
-        precip = np.clip(precip, 200, 1200)
-        gdd = np.clip(gdd, 800, 3500)
-        lai = np.clip(lai, 1, 8)
-        ndvi = np.clip(ndvi, 0.3, 0.9)
-        ph = np.clip(ph, 4.0, 8.5)
-
-        data.append([
-            T_avg, precip, gdd, lai, ndvi, ph,
-            gtk, spi, soil_moisture, frost_free_days
-        ])
-        labels.append(crop_id)
+# Признаки с диапазонами, зависящими от культуры, и шум для каждого из них
+CROP_FEATURE_KEYS = ['T_avg', 'precip', 'gdd', 'lai', 'ndvi', 'ph']
+NOISE_SIGMAS = np.array([2, 50, 100, 0.5, 0.05, 0.3])
+
+# Дополнительные признаки — одинаковые диапазоны для всех культур
+# (gtk, spi, soil_moisture, frost_free_days)
+EXTRA_LOWS = np.array([0.8, -1.5, 0.3, 150])
+EXTRA_HIGHS = np.array([1.8, 1.5, 0.9, 250])
+
+# Разумные пределы для всех 10 признаков (доп. признаки не ограничиваются)
+CLIP_LOWS = np.array([-10, 200, 800, 1, 0.3, 4.0, -np.inf, -np.inf, -np.inf, -np.inf])
+CLIP_HIGHS = np.array([40, 1200, 3500, 8, 0.9, 8.5, np.inf, np.inf, np.inf, np.inf])
+
+# Матрицы границ (культура × признак) в порядке id из CROPS
+crop_order = [CROPS[crop_id] for crop_id in sorted(CROPS)]
+LOWS = np.array([[CROP_PARAMS[name][key][0] for key in CROP_FEATURE_KEYS] for name in crop_order])
+HIGHS = np.array([[CROP_PARAMS[name][key][1] for key in CROP_FEATURE_KEYS] for name in crop_order])
+
+# Генерируем данные — одним пакетом на культуру вместо поштучных вызовов генератора
+samples_per_crop = n_samples // len(crop_order)
+blocks = []
+
+for crop_id in range(len(crop_order)):
+    # Значения из диапазона культуры с небольшим нормальным шумом
+    base = rng.uniform(LOWS[crop_id], HIGHS[crop_id], size=(samples_per_crop, len(CROP_FEATURE_KEYS)))
+    noise = rng.standard_normal(base.shape) * NOISE_SIGMAS
+    extra = rng.uniform(EXTRA_LOWS, EXTRA_HIGHS, size=(samples_per_crop, len(EXTRA_LOWS)))
+    blocks.append(np.hstack([base + noise, extra]))
+
+# Ограничиваем значения разумными пределами одним вызовом
+data = np.clip(np.vstack(blocks), CLIP_LOWS, CLIP_HIGHS)
+labels = np.repeat(np.arange(len(crop_order)), samples_per_crop)
 
 # Создаем DataFrame
 feature_names = [
@@ -137,8 +142,9 @@ print("✓ Данные сохранены: data/training/synthetic_crop_data.cs
 print()
 
 # Разделяем на train/test
-X = df[feature_names]
-y = df['crop']
+# scikit-learn строит деревья на float32 — передаём готовый массив без внутренней копии
+X = df[feature_names].to_numpy(dtype=np.float32)
+y = df['crop'].to_numpy(dtype=np.int8)
 
 X_train, X_test, y_train, y_test = train_test_split(
     X, y, test_size=0.2, random_state=42, stratify=y
@@ -150,14 +156,15 @@ print(f"  Test:  {len(X_test)} образцов")
 print()
 
 # Обучаем модель
-print("🤖 Обучение Random Forest...")
-model = RandomForestClassifier(
-    n_estimators=100,
-    max_depth=15,
-    min_samples_split=5,
-    min_samples_leaf=2,
-    random_state=42,
-    n_jobs=-1
+# Гистограммный бустинг: признаки один раз биннингуются в uint8 (≤255 корзин),
+# разбиения ищутся по гистограммам без сортировки выборки
+print("🤖 Обучение Histogram Gradient Boosting...")
+model = HistGradientBoostingClassifier(
+    max_iter=100,
+    max_depth=None,
+    learning_rate=0.1,
+    early_stopping=True,
+    random_state=42
 )
 
 model.fit(X_train, y_train)
@@ -173,10 +180,11 @@ print(f"  Train accuracy: {train_score:.3f}")
 print(f"  Test accuracy:  {test_score:.3f}")
 print()
 
-# Важность признаков
+# Важность признаков (у бустинга нет feature_importances_ — считаем перестановочную на тесте)
+importance = permutation_importance(model, X_test, y_test, n_repeats=5, random_state=42, n_jobs=-1)
 feature_importance = pd.DataFrame({
     'feature': feature_names,
-    'importance': model.feature_importances_
+    'importance': importance.importances_mean
 }).sort_values('importance', ascending=False)
 
 print("🔍 Важность признаков:")
@@ -186,7 +194,7 @@ print()
 
 # Сохраняем модель
 model_path = 'models/crop_rf_model.pkl'
-joblib.dump(model, model_path)
+joblib.dump(model, model_path, compress=MODEL_COMPRESSION, protocol=5)
 print(f"✓ Модель сохранена: {model_path}")
 
 # Сохраняем метаданные
@@ -196,7 +204,9 @@ metadata = {
     'train_score': train_score,
     'test_score': test_score,
     'n_samples': len(df),
-    'model_type': 'RandomForestClassifier'
+    'model_type': 'HistGradientBoostingClassifier',
+    'input_dtype': 'float32',
+    'input_shape': (None, len(feature_names))
 }
 
 metadata_path = 'models/crop_model_metadata.pkl'
@@ -218,11 +228,11 @@ test_cases = [
 ]
 
 for test in test_cases:
-    features = [[
+    features = np.array([[
         test['T_avg'], test['precip'], test['gdd'], test['lai'],
         test['ndvi'], test['ph'], test['gtk'], test['spi'],
         test['soil_moisture'], test['frost_free_days']
-    ]]
+    ]], dtype=np.float32)
 
     prediction = model.predict(features)[0]
     probabilities = model.predict_proba(features)[0]
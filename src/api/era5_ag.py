@@ -1,21 +1,350 @@
 import cdsapi
+import requests
 from config.settings import CDS_API_URL, CDS_API_KEY
 import xarray as xr
 import pandas as pd
+import numpy as np
 import os
+import time
+import shutil
 import hashlib
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, timedelta
+from functools import lru_cache
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None
+
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+
+def _hash_key(key_string):
+    """Быстрый некриптографический хэш ключа кэша (xxh3, при отсутствии xxhash — blake2b)."""
+    if xxhash is not None:
+        return xxhash.xxh3_64_hexdigest(key_string.encode())
+    return hashlib.blake2b(key_string.encode(), digest_size=8).hexdigest()
+
 
 def generate_filename(latitude, longitude, start_date_str, end_date_str, variables):
     """
     Генерирует уникальное имя файла на основе параметров запроса.
+
+    Координаты округляются до 4 знаков (~10 м), чтобы близкие точки попадали в один кэш.
+    Если новый файл ещё не создан, но есть файл со старым MD5-именем — возвращается он,
+    чтобы не скачивать уже закэшированные данные повторно.
     """
-    key_string = f"{latitude}_{longitude}_{start_date_str}_{end_date_str}_{'_'.join(sorted(variables))}"
-    hash_key = hashlib.md5(key_string.encode()).hexdigest()
-    filename = f"data/era5/download_{hash_key}.nc"
+    variables_key = '_'.join(sorted(variables))
+    key_string = f"{round(latitude, 4)}_{round(longitude, 4)}_{start_date_str}_{end_date_str}_{variables_key}"
+    filename = f"data/era5/download_{_hash_key(key_string)}.nc"
+
+    if not os.path.exists(filename):
+        legacy_key = f"{latitude}_{longitude}_{start_date_str}_{end_date_str}_{variables_key}"
+        legacy_filename = f"data/era5/download_{hashlib.md5(legacy_key.encode()).hexdigest()}.nc"
+        if os.path.exists(legacy_filename):
+            return legacy_filename
+
     return filename
 
+@lru_cache(maxsize=16)
+def _detect_vars(var_names, dim_names):
+    """
+    Определяет имена переменных температуры, осадков и временной размерности по схеме файла.
+
+    Схема продукта CDS фиксирована, поэтому результат кэшируется по кортежу имён
+    и поиск по подстрокам выполняется один раз на схему.
+
+    Args:
+        var_names: кортеж имён всех переменных набора данных
+        dim_names: кортеж имён размерностей
+
+    Returns:
+        (t2m_var, tp_var, time_dim); time_dim = None, если по именам определить не удалось
+
+    Raises:
+        ValueError: если в файле нет переменных температуры или осадков
+    """
+    # Быстрый путь: стандартные имена ERA5
+    if 't2m' in var_names and 'tp' in var_names and 'valid_time' in dim_names:
+        return 't2m', 'tp', 'valid_time'
+
+    if 't2m' in var_names or '2m_temperature' in var_names:
+        t2m_var = 't2m' if 't2m' in var_names else '2m_temperature'
+    else:
+        t2m_var = next((v for v in var_names if 'temp' in v.lower() or 't2m' in v.lower()), None)
+        if t2m_var is None:
+            raise ValueError("Файл не содержит переменных температуры.")
+
+    if 'tp' in var_names or 'total_precipitation' in var_names:
+        tp_var = 'tp' if 'tp' in var_names else 'total_precipitation'
+    else:
+        tp_var = next((v for v in var_names if 'precip' in v.lower() or 'tp' in v.lower()), None)
+        if tp_var is None:
+            raise ValueError("Файл не содержит переменных осадков.")
+
+    time_dim = next((d for d in dim_names if d.lower() in ('time', 'valid_time')), None)
+    return t2m_var, tp_var, time_dim
+
+
+def _detect_time_dim_by_attrs(ds):
+    """Ищет временную размерность по атрибутам, если стандартных имён в файле нет."""
+    for dim in ds.dims:
+        if 'time' in str(ds[dim].attrs).lower():
+            return dim
+
+    # Пробуем найти координату с временными метками
+    for var in ds.variables:
+        if hasattr(ds[var], 'attrs') and 'units' in ds[var].attrs:
+            if 'since' in ds[var].attrs['units'].lower():
+                return var
+
+    # Если всё еще не нашли, берем первую координату как время
+    for coord in ds.coords:
+        if len(ds[coord].shape) <= 1:  # Обычно временная координата одномерная
+            print(f"Используем координату {coord} как временную")
+            return coord
+
+    return None
+
+
+# In-process кэш результатов get_climate_data поверх файлового NetCDF-кэша.
+# Недавние периоды ERA5 ещё дополняются (задержка ~5 дней), поэтому живут меньше.
+CLIMATE_CACHE_MAXSIZE = 512
+CLIMATE_CACHE_TTL_RECENT = 15 * 60
+CLIMATE_CACHE_TTL_HISTORICAL = 24 * 60 * 60
+ERA5_LAG_DAYS = 5
+
+_climate_cache = {}
+_climate_cache_lock = threading.Lock()
+
+
+def _climate_cache_ttl(end_date_str):
+    """TTL записи: короткий для периодов, задевающих последние дни, длинный для истории."""
+    try:
+        end_date = date.fromisoformat(end_date_str)
+    except ValueError:
+        return CLIMATE_CACHE_TTL_RECENT
+    if end_date >= date.today() - timedelta(days=2 * ERA5_LAG_DAYS):
+        return CLIMATE_CACHE_TTL_RECENT
+    return CLIMATE_CACHE_TTL_HISTORICAL
+
+
+def _clamp_period(start_date_str, end_date_str):
+    """
+    Приводит период к датам, уже опубликованным в ERA5 (до сегодня − ERA5_LAG_DAYS − 1).
+
+    Возвращает (start, end) в формате 'YYYY-MM-DD' или None, если после обрезки
+    период пуст — тогда запрос в CDS заведомо завершился бы ошибкой.
+    """
+    start_date = date.fromisoformat(start_date_str)
+    end_date = min(date.fromisoformat(end_date_str), date.today() - timedelta(days=ERA5_LAG_DAYS + 1))
+    if end_date < start_date:
+        return None
+    return start_date.isoformat(), end_date.isoformat()
+
+
 def get_climate_data(latitude, longitude, start_date_str, end_date_str):
+    """
+    Возвращает климатические данные ERA5 с кэшированием в памяти процесса.
+
+    Ключ — координаты, округлённые до 3 знаков (~100 м; запрос в CDS всё равно
+    округляется до 2 знаков), и период. Неудачные ответы (None) не кэшируются.
+    Возвращаемый словарь общий для всех попаданий в кэш — не изменяйте его.
+    Конец периода обрезается до последних опубликованных данных ERA5.
+    """
+    period = _clamp_period(start_date_str, end_date_str)
+    if period is None:
+        print(f"Период {start_date_str} — {end_date_str} ещё не доступен в ERA5")
+        return None
+    start_date_str, end_date_str = period
+
+    key = (round(latitude, 3), round(longitude, 3), start_date_str, end_date_str)
+    now = time.monotonic()
+    with _climate_cache_lock:
+        entry = _climate_cache.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+    climate_data = _fetch_climate_data(latitude, longitude, start_date_str, end_date_str)
+    if climate_data is None:
+        return None
+
+    with _climate_cache_lock:
+        if len(_climate_cache) >= CLIMATE_CACHE_MAXSIZE:
+            # Сначала выбрасываем просроченные записи, затем — самые старые по вставке
+            for stale_key in [k for k, (expires, _) in _climate_cache.items() if expires <= now]:
+                del _climate_cache[stale_key]
+            while len(_climate_cache) >= CLIMATE_CACHE_MAXSIZE:
+                del _climate_cache[next(iter(_climate_cache))]
+        _climate_cache[key] = (now + _climate_cache_ttl(end_date_str), climate_data)
+    return climate_data
+
+
+def _climate_dict(time_stamps, temperatures, precipitations):
+    """
+    Результат get_climate_data.
+
+    Ряды остаются массивами float32 (вдвое меньше памяти, чем списки float64,
+    и без поэлементных Python-объектов); для сериализации используйте
+    orjson.dumps(..., option=orjson.OPT_SERIALIZE_NUMPY). Массивы только для
+    чтения — словарь разделяется между попаданиями в кэш.
+    """
+    temperatures = np.ascontiguousarray(temperatures, dtype=np.float32)
+    precipitations = np.ascontiguousarray(precipitations, dtype=np.float32)
+    temperatures.setflags(write=False)
+    precipitations.setflags(write=False)
+    return {
+        'daily': {
+            'time': time_stamps,
+            'temperature_2m_mean': temperatures,
+            'precipitation_sum': precipitations
+        }
+    }
+
+
+def _read_point_netcdf(output_file):
+    """
+    Быстрое чтение одноточечного файла ERA5 напрямую через netCDF4, минуя xarray.
+
+    Для стандартной схемы (t2m, tp, valid_time/time) не строится граф переменных
+    xarray и не запускается CF-декодирование всего набора. Возвращает
+    (time_stamps, temperatures °C, precipitations мм) или None, если схема
+    нестандартная — тогда вызывающий код использует путь через xarray.
+    """
+    if netCDF4 is None:
+        return None
+
+    with netCDF4.Dataset(output_file, mode='r') as nc:
+        variables = nc.variables
+        time_name = next((name for name in ('valid_time', 'time') if name in variables), None)
+        if 't2m' not in variables or 'tp' not in variables or time_name is None:
+            return None
+
+        t2m = variables['t2m']
+        tp = variables['tp']
+        time_var = variables[time_name]
+
+        # Маскированные значения (_FillValue) превращаются в NaN
+        temperatures = np.ma.filled(t2m[:], np.nan).astype(np.float32).ravel()
+        precipitations = np.ma.filled(tp[:], np.nan).astype(np.float32).ravel()
+
+        if 'k' in getattr(t2m, 'units', 'K').lower():
+            np.subtract(temperatures, np.float32(273.15), out=temperatures)
+        tp_units = getattr(tp, 'units', 'm').lower()
+        if 'm' in tp_units and 'mm' not in tp_units:
+            np.multiply(precipitations, np.float32(1000.0), out=precipitations)
+
+        dates = netCDF4.num2date(
+            time_var[:], time_var.units,
+            calendar=getattr(time_var, 'calendar', 'standard'),
+            only_use_cftime_datetimes=False,
+            only_use_python_datetimes=True,
+        )
+        time_stamps = pd.DatetimeIndex(np.ravel(dates)).strftime('%Y-%m-%d').tolist()
+
+    return time_stamps, temperatures, precipitations
+
+
+def _zarr_path(output_file):
+    """Путь к Zarr-копии кэшированного NetCDF файла."""
+    return os.path.splitext(output_file)[0] + '.zarr'
+
+
+def _convert_to_zarr(output_file, zarr_path):
+    """
+    Однократно переписывает NetCDF из кэша CDS в Zarr-хранилище.
+
+    Zarr хранит метаданные в JSON отдельно от чанков, поэтому повторные открытия
+    не платят за разбор HDF5. Запись идёт во временный каталог с атомарным
+    переименованием. Ошибка конвертации не критична — чтение остаётся на NetCDF.
+    """
+    tmp_path = f"{zarr_path}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        with xr.open_dataset(output_file, engine="h5netcdf") as ds:
+            ds = ds.load()
+        # Кодировки NetCDF (zlib, chunksizes) несовместимы с Zarr — сбрасываем их
+        for var in ds.variables.values():
+            var.encoding = {}
+        ds.to_zarr(tmp_path, mode='w')
+        os.replace(tmp_path, zarr_path)
+    except Exception as e:
+        print(f"Не удалось сконвертировать {output_file} в Zarr: {e}")
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+# Конвертация в Zarr идёт в фоне, вне пути запроса; один поток — файлы
+# переписываются по очереди, а каждый файл ставится в очередь не больше раза
+_zarr_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="era5-zarr")
+_zarr_pending = set()
+_zarr_pending_lock = threading.Lock()
+
+
+def _schedule_zarr_conversion(output_file, zarr_path):
+    """Ставит фоновую конвертацию NetCDF → Zarr, если она ещё не запланирована."""
+    with _zarr_pending_lock:
+        if zarr_path in _zarr_pending:
+            return
+        _zarr_pending.add(zarr_path)
+
+    def _run():
+        try:
+            _convert_to_zarr(output_file, zarr_path)
+        finally:
+            with _zarr_pending_lock:
+                _zarr_pending.discard(zarr_path)
+
+    _zarr_executor.submit(_run)
+
+
+_cds_client = None
+_cds_client_lock = threading.Lock()
+
+
+def get_cds_client():
+    """
+    Единый cdsapi.Client на процесс.
+
+    Клиент и его requests.Session (TLS, заголовки авторизации, пул соединений)
+    создаются при первом запросе и переиспользуются всеми потоками бота.
+    """
+    global _cds_client
+    if _cds_client is None:
+        with _cds_client_lock:
+            if _cds_client is None:
+                _cds_client = cdsapi.Client(url=CDS_API_URL, key=CDS_API_KEY, session=requests.Session())
+    return _cds_client
+
+
+def _download_era5(dataset, request, output_file):
+    """
+    Скачивает ответ CDS во временный .part-файл и атомарно переименовывает его.
+
+    cdsapi пишет результат на диск потоково; при обрыве загрузки в кэше не
+    остаётся недописанного .nc, который затем открылся бы с ошибкой.
+    Имя .part уникально для потока, чтобы параллельные запросы не мешали друг другу.
+    """
+    tmp_file = f"{output_file}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        get_cds_client().retrieve(dataset, request, tmp_file)
+        os.replace(tmp_file, output_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def _fetch_climate_data(latitude, longitude, start_date_str, end_date_str):
     """
     Получает агрегированные суточные климатические данные из Copernicus Climate Data Store (CDS).
 
@@ -33,16 +362,17 @@ def get_climate_data(latitude, longitude, start_date_str, end_date_str):
     output_file = generate_filename(latitude, longitude, start_date_str, end_date_str, variables)
 
     # Генерируем полный диапазон дат для запроса
+    # np.unique возвращает уже отсортированные значения — без set/sorted в Python
     date_range = pd.date_range(start=start_date_str, end=end_date_str)
-    years = sorted(list(set([d.year for d in date_range])))
-    months = sorted(list(set([d.month for d in date_range])))
-    days = sorted(list(set([d.day for d in date_range])))
+    years = np.unique(date_range.year)
+    months = np.unique(date_range.month)
+    days = np.unique(date_range.day)
 
     try:
-        # Проверяем, существует ли уже кэшированный файл
-        if not os.path.exists(output_file):
-            c = cdsapi.Client(url=CDS_API_URL, key=CDS_API_KEY)
-            c.retrieve(
+        # Проверяем, существует ли уже кэшированный файл (NetCDF или его Zarr-копия)
+        zarr_path = _zarr_path(output_file)
+        if not os.path.exists(output_file) and not os.path.exists(zarr_path):
+            _download_era5(
                 'derived-era5-single-levels-daily-statistics',
                 {
                     'format': 'netcdf',
@@ -62,103 +392,77 @@ def get_climate_data(latitude, longitude, start_date_str, end_date_str):
                 },
                 output_file)
 
-        # Обработка загруженного файла с явным указанием движка
-        ds = xr.open_dataset(output_file, engine="netcdf4")
-        # Выводим информацию о структуре данных для отладки
-        print(f"Доступные переменные в наборе данных: {list(ds.variables)}")
-        print(f"Размерности набора данных: {list(ds.dims)}")
-        
-        # Проверяем наличие нужных переменных
-        if 't2m' not in ds and '2m_temperature' not in ds:
-            t2m_var = None
-            for var in ds.variables:
-                if 'temp' in var.lower() or 't2m' in var.lower():
-                    t2m_var = var
-                    break
-            if t2m_var is None:
-                raise ValueError("Файл не содержит переменных температуры.")
-        else:
-            t2m_var = 't2m' if 't2m' in ds else '2m_temperature'
-            
-        if 'tp' not in ds and 'total_precipitation' not in ds:
-            tp_var = None
-            for var in ds.variables:
-                if 'precip' in var.lower() or 'tp' in var.lower():
-                    tp_var = var
-                    break
-            if tp_var is None:
-                raise ValueError("Файл не содержит переменных осадков.")
-        else:
-            tp_var = 'tp' if 'tp' in ds else 'total_precipitation'
-            
-        print(f"Используем переменные: температура={t2m_var}, осадки={tp_var}")
-        
-        # Находим временную размерность
-        time_dim = None
-        for dim in ds.dims:
-            if dim.lower() == 'time' or 'time' in str(ds[dim].attrs).lower():
-                time_dim = dim
-                break
-                
-        if not time_dim:
-            # Если не нашли явную размерность времени, пробуем найти координату с временными метками
-            for var in ds.variables:
-                if hasattr(ds[var], 'attrs') and 'units' in ds[var].attrs:
-                    if 'since' in ds[var].attrs['units'].lower():
-                        time_dim = var
-                        break
-                        
-        if not time_dim:
-            # Если всё еще не нашли, берем первую координату как время
-            for coord in ds.coords:
-                if len(ds[coord].shape) <= 1:  # Обычно временная координата одномерная
-                    time_dim = coord
-                    print(f"Используем координату {coord} как временную")
-                    break
-        
-        print(f"Используем измерение времени: {time_dim}")
-        
-        # Получаем временные метки
-        if time_dim:
-            # Пытаемся преобразовать значения в datetime
-            try:
-                time_values = ds[time_dim].values
-                time_stamps = [pd.to_datetime(t).strftime('%Y-%m-%d') for t in time_values]
-            except (TypeError, ValueError):
-                # Если не удалось, используем индексы как дни начиная с start_date
-                time_stamps = [(start_date + pd.Timedelta(days=i)).strftime('%Y-%m-%d') 
-                               for i in range(len(ds[time_dim]))]                
-        else:
-            # Если не нашли временную размерность, используем диапазон дат из запроса
-            date_range = pd.date_range(start=start_date, end=end_date)
-            time_stamps = [d.strftime('%Y-%m-%d') for d in date_range]
-        
-        # Температура из Кельвинов в Цельсии
-        temps = ds[t2m_var]
-        if hasattr(temps, 'units') and 'k' in temps.units.lower():
-            # Если в Кельвинах, конвертируем в Цельсии
-            temperatures = (temps.values - 273.15).flatten().tolist()
-        else:
-            # Предполагаем, что уже в Цельсиях
-            temperatures = temps.values.flatten().tolist()
-            
-        # Осадки из метров в миллиметры, если необходимо
-        precips = ds[tp_var]
-        if hasattr(precips, 'units') and 'm' in precips.units.lower() and 'mm' not in precips.units.lower():
-            # Если в метрах, конвертируем в миллиметры
-            precipitations = (precips.values * 1000).flatten().tolist()
+        netcdf_exists = os.path.exists(output_file)
+
+        # Стандартный одноточечный файл читаем напрямую через netCDF4 —
+        # это быстрее, чем xarray поверх любого формата, Zarr здесь не нужен
+        if netcdf_exists:
+            point = _read_point_netcdf(output_file)
+            if point is not None:
+                return _climate_dict(*point)
+
+        # Нестандартная схема или сетка: Zarr-копия, если уже готова; иначе
+        # читаем NetCDF, а копию создаём в фоне для следующих запросов
+        if os.path.exists(zarr_path):
+            dataset = xr.open_dataset(zarr_path, engine="zarr", chunks="auto")
         else:
-            # Предполагаем, что уже в мм или правильных единицах
-            precipitations = precips.values.flatten().tolist()
-
-        climate_data = {
-            'daily': {
-                'time': time_stamps,
-                'temperature_2m_mean': temperatures,
-                'precipitation_sum': precipitations
-            }
-        }
-        return climate_data
+            if zarr is not None:
+                _schedule_zarr_conversion(output_file, zarr_path)
+            # Ленивое открытие через h5netcdf: переменные читаются dask-чанками только при обращении
+            dataset = xr.open_dataset(output_file, engine="h5netcdf", chunks={})
+
+        # Обработка данных (Zarr или NetCDF) через xarray
+        with dataset as ds:
+            # Выводим информацию о структуре данных для отладки
+            print(f"Доступные переменные в наборе данных: {list(ds.variables)}")
+            print(f"Размерности набора данных: {list(ds.dims)}")
+
+            # Имена переменных определяются по схеме файла (результат кэшируется)
+            t2m_var, tp_var, time_dim = _detect_vars(tuple(ds.variables), tuple(ds.dims))
+            print(f"Используем переменные: температура={t2m_var}, осадки={tp_var}")
+
+            if not time_dim:
+                # По именам не нашли — ищем по атрибутам (редкий случай нестандартной схемы)
+                time_dim = _detect_time_dim_by_attrs(ds)
+
+            print(f"Используем измерение времени: {time_dim}")
+
+            # Получаем временные метки (векторно, без поэлементного pd.to_datetime)
+            if time_dim:
+                # Пытаемся преобразовать значения в datetime
+                try:
+                    time_values = ds[time_dim].values
+                    if np.issubdtype(time_values.dtype, np.datetime64):
+                        time_stamps = np.datetime_as_string(time_values, unit='D').tolist()
+                    else:
+                        time_stamps = pd.DatetimeIndex(time_values).strftime('%Y-%m-%d').tolist()
+                except (TypeError, ValueError):
+                    # Если не удалось, используем индексы как дни начиная с начальной даты
+                    time_stamps = pd.date_range(start=start_date_str, periods=len(ds[time_dim])) \
+                        .strftime('%Y-%m-%d').tolist()
+            else:
+                # Если не нашли временную размерность, используем диапазон дат из запроса
+                time_stamps = date_range.strftime('%Y-%m-%d').tolist()
+
+            # Температура из Кельвинов в Цельсии (один проход ufunc с выводом сразу в float32)
+            temps = ds[t2m_var]
+            if hasattr(temps, 'units') and 'k' in temps.units.lower():
+                # Если в Кельвинах, конвертируем в Цельсии
+                temperatures = np.subtract(temps.values.ravel(), 273.15, dtype=np.float32)
+            else:
+                # Предполагаем, что уже в Цельсиях
+                temperatures = np.asarray(temps.values, dtype=np.float32).ravel()
+
+            # Осадки из метров в миллиметры, если необходимо
+            precips = ds[tp_var]
+            if hasattr(precips, 'units') and 'm' in precips.units.lower() and 'mm' not in precips.units.lower():
+                # Если в метрах, конвертируем в миллиметры
+                precipitations = np.multiply(precips.values.ravel(), 1000.0, dtype=np.float32)
+            else:
+                # Предполагаем, что уже в мм или правильных единицах
+                precipitations = np.asarray(precips.values, dtype=np.float32).ravel()
+
+            return _climate_dict(time_stamps, temperatures, precipitations)
 
     except Exception as e:
         print(f"Ошибка при обработке данных ERA5: {e}")
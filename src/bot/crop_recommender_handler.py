@@ -5,29 +5,160 @@
 Fallback: simple_recommender (только география) при недоступности сети.
 """
 import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from geopy.adapters import RequestsAdapter
+from geopy.extra.rate_limiter import RateLimiter
 from geopy.geocoders import Nominatim
 
-from src.api.open_meteo import fetch_agro_data
-from src.agro.indices import compute_all_indices
 from src.bot.simple_recommender import format_simple_recommendation
 
 logger = logging.getLogger(__name__)
-geolocator = Nominatim(user_agent="crop_recommendation_bot")
+# Keep-alive пул соединений к Nominatim, общий для всех потоков-обработчиков.
+# Хост один, а политика Nominatim — 1 запрос/с, поэтому хватает 4 соединений.
+geolocator = Nominatim(
+    user_agent="crop_recommendation_bot",
+    adapter_factory=partial(RequestsAdapter, pool_connections=1, pool_maxsize=4),
+)
+
+# Общий для всех обработчиков ограничитель: политика Nominatim — не более 1 запроса в секунду.
+# Через него идут только промахи кэша; ошибки пробрасываются, чтобы не попасть в lru_cache.
+_reverse_limited = RateLimiter(
+    geolocator.reverse, min_delay_seconds=1.0, max_retries=0, swallow_exceptions=False
+)
 
 # Культура по умолчанию для ГДД (в будущем — из профиля пользователя)
 DEFAULT_CROP = "wheat"
 
+# Пул для независимых сетевых запросов (метеоданные грузятся параллельно с геокодированием)
+_fetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="agro-fetch")
+
+
+# Дисковое зеркало кэша геокодирования (SQLite): переживает перезапуски и общее
+# для процессов — каждая запись сразу видна остальным, без перезаписи всего файла.
+# Политика Nominatim — не более 1 запроса в секунду, поэтому повторы особенно дороги.
+GEOCODE_CACHE_FILE = "data/geocode_cache.sqlite3"
+GEOCODE_CACHE_TTL = 24 * 60 * 60
+GEOCODE_CACHE_MAX_ENTRIES = 100_000
+# Чистка устаревших и лишних записей — раз в столько сохранений
+GEOCODE_CACHE_PRUNE_EVERY = 100
+
+_geocode_db = None
+_geocode_db_lock = threading.Lock()
+_geocode_puts = 0
+
+
+def _geocode_db_conn() -> sqlite3.Connection:
+    """Открывает базу кэша один раз за процесс (вызывается под _geocode_db_lock)."""
+    global _geocode_db
+    if _geocode_db is None:
+        os.makedirs(os.path.dirname(GEOCODE_CACHE_FILE), exist_ok=True)
+        conn = sqlite3.connect(
+            GEOCODE_CACHE_FILE, timeout=5, isolation_level=None, check_same_thread=False
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocode ("
+            "key TEXT PRIMARY KEY, address TEXT, ts REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_geocode_ts ON geocode (ts)")
+        _geocode_db = conn
+    return _geocode_db
+
+
+def _geocode_prune(conn: sqlite3.Connection) -> None:
+    """Удаляет записи старше TTL и самые старые сверх GEOCODE_CACHE_MAX_ENTRIES."""
+    conn.execute("DELETE FROM geocode WHERE ts <= ?", (time.time() - GEOCODE_CACHE_TTL,))
+    conn.execute(
+        "DELETE FROM geocode WHERE key IN "
+        "(SELECT key FROM geocode ORDER BY ts DESC LIMIT -1 OFFSET ?)",
+        (GEOCODE_CACHE_MAX_ENTRIES,),
+    )
+
+
+def _geocode_disk_get(key: str):
+    """Строка (address,) из кэша или None при промахе; address может быть None."""
+    try:
+        with _geocode_db_lock:
+            return _geocode_db_conn().execute(
+                "SELECT address FROM geocode WHERE key = ? AND ts > ?",
+                (key, time.time() - GEOCODE_CACHE_TTL),
+            ).fetchone()
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("Кэш геокодирования недоступен: %s", e)
+        return None
+
+
+def _geocode_disk_put(key: str, address) -> None:
+    """Сохраняет одну запись (O(log n)); периодически чистит устаревшие."""
+    global _geocode_puts
+    try:
+        with _geocode_db_lock:
+            conn = _geocode_db_conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO geocode (key, address, ts) VALUES (?, ?, ?)",
+                (key, address, time.time()),
+            )
+            _geocode_puts += 1
+            if _geocode_puts % GEOCODE_CACHE_PRUNE_EVERY == 1:
+                _geocode_prune(conn)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("Не удалось сохранить кэш геокодирования: %s", e)
+
+
+@lru_cache(maxsize=4096)
+def _reverse_cached(lat_r: float, lon_r: float):
+    """
+    Reverse-геокодирование по округлённым (до 4 знаков, ~11 м) координатам.
+
+    Порядок: память процесса (lru_cache) → дисковый кэш с TTL 24 ч → Nominatim.
+    Исключения не кэшируются — при сбое сети следующий вызов повторит запрос.
+    Возвращает строку адреса или None.
+    """
+    key = f"geo:{lat_r:.4f}:{lon_r:.4f}"
+    cached = _geocode_disk_get(key)
+    if cached is not None:
+        return cached[0]
+
+    # Нужен только display name — разбор адреса по полям не запрашиваем
+    loc = _reverse_limited((lat_r, lon_r), language="ru", timeout=10, addressdetails=False)
+    # В кэше хранится только строка, а не geopy.Location с полным raw-ответом.
+    # Точки без адреса (море, тундра) тоже кэшируем, чтобы не спрашивать Nominatim повторно
+    address = loc.address if loc else None
+    _geocode_disk_put(key, address)
+    return address
+
+
+def reverse_address(lat: float, lon: float):
+    """Адрес по координатам через общий кэш геокодера (None — адрес не найден)."""
+    return _reverse_cached(round(lat, 4), round(lon, 4))
+
 
 def _get_address(lat: float, lon: float) -> str:
     """Reverse-геокодирование координат. Возвращает строку адреса или координаты."""
     try:
-        loc = geolocator.reverse((lat, lon), language="ru", timeout=10)
-        return loc.address if loc else f"{lat:.4f}, {lon:.4f}"
+        address = reverse_address(lat, lon)
+        return address or f"{lat:.4f}, {lon:.4f}"
     except Exception as e:
         logger.warning(f"Геокодирование недоступно: {e}")
         return f"{lat:.4f}°N {lon:.4f}°E"
 
 
+def _fetch_weather(lat: float, lon: float) -> dict:
+    """
+    Загрузка метеоданных Open-Meteo.
+
+    Клиент Open-Meteo (openmeteo_requests, requests_cache, pandas) импортируется
+    при первом запросе, а не при старте бота; ошибка импорта уходит в fallback.
+    """
+    from src.api.open_meteo import fetch_agro_data
+    return fetch_agro_data(lat, lon)
+
+
 def _format_agro_report(address: str, data: dict, indices: dict) -> str:
     """
     Формирует текст агроотчёта для Telegram.
@@ -46,65 +177,61 @@ def _format_agro_report(address: str, data: dict, indices: dict) -> str:
     et0   = indices["et0_bal"]
     meta  = data["meta"]
 
-    lines = [
-        "🌾 АГРОМЕТЕОРОЛОГИЧЕСКИЙ АНАЛИЗ",
-        "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━",
-        f"📍 {address}",
-        f"🏔 Высота: {meta['elevation']:.0f} м н.у.м.",
-        "",
-    ]
+    header = (
+        "🌾 АГРОМЕТЕОРОЛОГИЧЕСКИЙ АНАЛИЗ\n"
+        "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+        f"📍 {address}\n"
+        f"🏔 Высота: {meta['elevation']:.0f} м н.у.м.\n"
+    )
 
     # ── Алерты заморозков ────────────────────────────────────────────────────
     if frost["alerts"]:
-        lines.append("🌡 РИСК ЗАМОРОЗКОВ (7 суток):")
-        for a in frost["alerts"]:
-            lines.append(
-                f"  {a['level']}  {a['date']}  Tмин={a['t_min']}°C  "
-                f"(через {a['lead_hours']}ч)"
-            )
-            lines.append(f"  💬 {a['action']}")
-        lines.append("")
+        alerts = "\n".join(
+            f"  {a['level']}  {a['date']}  Tмин={a['t_min']}°C  "
+            f"(через {a['lead_hours']}ч)\n"
+            f"  💬 {a['action']}"
+            for a in frost["alerts"]
+        )
+        frost_block = f"🌡 РИСК ЗАМОРОЗКОВ (7 суток):\n{alerts}\n"
     else:
-        lines.append("✅ Заморозков в ближайшие 7 суток не ожидается")
-        lines.append("")
+        frost_block = "✅ Заморозков в ближайшие 7 суток не ожидается\n"
 
     # ── ГТК ─────────────────────────────────────────────────────────────────
     htc_val = f"{htc['htc']:.2f}" if htc["htc"] is not None else "н/д"
-    lines += [
-        f"💧 УВЛАЖНЁННОСТЬ (ГТК Селянинова, {htc['window_days']} сут):",
-        f"  ГТК = {htc_val}   {htc['interpretation']}",
-        f"  Осадки: {htc['sum_precip_mm']} мм  |  ΣT>10°C: {htc['sum_t_above10']}°",
-        "",
-    ]
+    htc_block = (
+        f"💧 УВЛАЖНЁННОСТЬ (ГТК Селянинова, {htc['window_days']} сут):\n"
+        f"  ГТК = {htc_val}   {htc['interpretation']}\n"
+        f"  Осадки: {htc['sum_precip_mm']} мм  |  ΣT>10°C: {htc['sum_t_above10']}°\n"
+    )
 
     # ── ГДД ─────────────────────────────────────────────────────────────────
-    lines += [
-        f"🌱 ФЕНОЛОГИЯ ({gdd['crop']}, Tbase={gdd['t_base']}°C):",
-        f"  Накоплено ГДД: {gdd['gdd_past']}°  |  +7 сут прогноз: +{gdd['gdd_forecast_7d']}°",
-        f"  Текущая фаза: {gdd['current_phase']}",
-    ]
-    if gdd["next_phase"]:
-        lines.append(
-            f"  До фазы '{gdd['next_phase']['name']}': ещё {gdd['next_phase']['gdd_needed']}° ГДД"
-        )
-    lines.append("")
+    next_phase = (
+        f"  До фазы '{gdd['next_phase']['name']}': ещё {gdd['next_phase']['gdd_needed']}° ГДД\n"
+        if gdd["next_phase"] else ""
+    )
+    gdd_block = (
+        f"🌱 ФЕНОЛОГИЯ ({gdd['crop']}, Tbase={gdd['t_base']}°C):\n"
+        f"  Накоплено ГДД: {gdd['gdd_past']}°  |  +7 сут прогноз: +{gdd['gdd_forecast_7d']}°\n"
+        f"  Текущая фаза: {gdd['current_phase']}\n"
+        f"{next_phase}"
+    )
 
     # ── ЕТ0 баланс ──────────────────────────────────────────────────────────
-    lines += [
-        f"🚿 ВОДНЫЙ БАЛАНС (последние {et0['window_days']} сут):",
-        f"  Осадки: {et0['precip_sum_mm']} мм  |  ЕТ0 (FAO-56): {et0['et0_sum_mm']} мм",
-        f"  {et0['status']}",
-        "",
-    ]
+    et0_block = (
+        f"🚿 ВОДНЫЙ БАЛАНС (последние {et0['window_days']} сут):\n"
+        f"  Осадки: {et0['precip_sum_mm']} мм  |  ЕТ0 (FAO-56): {et0['et0_sum_mm']} мм\n"
+        f"  {et0['status']}\n"
+    )
 
     # ── Источник данных ──────────────────────────────────────────────────────
-    lines += [
-        "─────────────────────────────────",
-        "📡 Источник: Open-Meteo (GFS/ICON)",
-        "📅 Прогноз: 7 сут  |  Архив: 14 сут",
-    ]
+    source_block = (
+        "─────────────────────────────────\n"
+        "📡 Источник: Open-Meteo (GFS/ICON)\n"
+        "📅 Прогноз: 7 сут  |  Архив: 14 сут"
+    )
 
-    return "\n".join(lines)
+    # Каждая секция заканчивается переводом строки — join добавляет пустую строку-разделитель
+    return "\n".join((header, frost_block, htc_block, gdd_block, et0_block, source_block))
 
 
 def handle_crop_recommendation_request(bot, message):
@@ -123,6 +250,10 @@ def handle_crop_recommendation_request(bot, message):
 
     logger.info(f"🚀 Анализ для {user_id}: {lat:.4f}, {lon:.4f}")
 
+    # Запрос метеоданных не зависит от адреса — запускаем его сразу,
+    # а геокодирование и статусное сообщение выполняются параллельно с ним
+    weather_future = _fetch_executor.submit(_fetch_weather, lat, lon)
+
     address = _get_address(lat, lon)
 
     bot.send_message(
@@ -134,7 +265,9 @@ def handle_crop_recommendation_request(bot, message):
 
     try:
         # ── Первичный путь: Open-Meteo + агроиндексы ─────────────────────────
-        weather_data = fetch_agro_data(lat, lon)
+        from src.agro.indices import compute_all_indices
+
+        weather_data = weather_future.result()
         indices      = compute_all_indices(weather_data["daily"], crop=DEFAULT_CROP)
         report       = _format_agro_report(address, weather_data, indices)
 
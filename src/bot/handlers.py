@@ -1,13 +1,16 @@
 from src.bot.keyboards import create_main_keyboard
 from src.storage.coordinates import save_coordinates, load_coordinates
-from geopy.geocoders import Nominatim
 from telebot.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from src.api.era5_ag import get_climate_data
 from src.bot.plotting import plot_climate_data
-from src.bot.crop_recommender_handler import handle_crop_recommendation_request
-from datetime import datetime, timedelta
+from src.bot.crop_recommender_handler import handle_crop_recommendation_request, reverse_address
+from datetime import date, timedelta
 import re
+import time
 import logging
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 
 # Настройка логирования (только в stdout для Docker)
 logging.basicConfig(
@@ -19,27 +22,218 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Инициализация геокодера для получения адреса
-geolocator = Nominatim(user_agent="crop_recommendation_bot")
-
-# Словарь для хранения состояний пользователей
-user_states = {}
+__all__ = ["register_handlers", "get_address", "get_address_async"]
+
+# Состояние диалога живёт не дольше USER_STATE_TTL: брошенные сценарии не копятся в памяти
+USER_STATE_TTL = 600
+USER_STATE_MAXSIZE = 50_000
+
+
+class UserStates:
+    """
+    Словарь состояний пользователей с ограниченным размером и временем жизни записей.
+
+    Просроченные записи удаляются при чтении; при переполнении сначала
+    вычищаются просроченные, затем самые старые по времени установки.
+    """
+
+    def __init__(self, maxsize=USER_STATE_MAXSIZE, ttl=USER_STATE_TTL):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id, default=None):
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is None:
+                return default
+            if entry[0] <= time.monotonic():
+                del self._data[user_id]
+                return default
+            return entry[1]
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def __setitem__(self, user_id, state):
+        with self._lock:
+            now = time.monotonic()
+            self._data.pop(user_id, None)
+            if len(self._data) >= self._maxsize:
+                for stale in [k for k, (expires, _) in self._data.items() if expires <= now]:
+                    del self._data[stale]
+                while len(self._data) >= self._maxsize:
+                    del self._data[next(iter(self._data))]
+            self._data[user_id] = (now + self._ttl, state)
+
+    def pop(self, user_id, default=None):
+        with self._lock:
+            entry = self._data.pop(user_id, None)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+
+
+# Состояния пользователей (ожидание геолокации / ввода координат)
+user_states = UserStates()
+
+# Координаты текстом: "55.7558, 37.6173" или "55.7558 37.6173" (компилируется один раз)
+_COORDS_RE = re.compile(r'([-+]?\d+\.?\d*)[,\s]+([-+]?\d+\.?\d*)')
+
+
+def parse_coordinates(text):
+    """
+    Извлекает (широта, долгота) из текста или возвращает None.
+
+    Типичный ввод «55.7558, 37.6173» / «55.7558 37.6173» разбирается через split
+    без регулярного выражения; всё остальное — через _COORDS_RE.
+    """
+    parts = text.replace(',', ' ').split()
+    if len(parts) == 2:
+        try:
+            return float(parts[0]), float(parts[1])
+        except ValueError:
+            pass
+    match = _COORDS_RE.search(text)
+    if match:
+        return float(match.group(1)), float(match.group(2))
+    return None
+
+# Минимальный интервал между промежуточными правками статусного сообщения
+PROGRESS_EDIT_INTERVAL = 0.5
+
+
+class ProgressMessage:
+    """
+    Статусное сообщение, которое редактируется не чаще раза в PROGRESS_EDIT_INTERVAL.
+
+    Каждая правка — отдельный запрос к Telegram API, поэтому промежуточные
+    этапы пропускаются, если текст не изменился или предыдущая правка была
+    только что. Финальный текст (final=True) отправляется всегда.
+    """
+
+    def __init__(self, bot, chat_id, message_id):
+        self._bot = bot
+        self._chat_id = chat_id
+        self._message_id = message_id
+        self._lock = threading.Lock()
+        self._last_at = 0.0
+        self._last_text = None
+
+    def update(self, text, final=False):
+        with self._lock:
+            now = time.monotonic()
+            if text == self._last_text:
+                return
+            if not final and now - self._last_at < PROGRESS_EDIT_INTERVAL:
+                return
+            self._last_at = now
+            self._last_text = text
+        self._bot.edit_message_text(text, self._chat_id, self._message_id)
 
 # Функция для получения адреса по координатам
 def get_address(latitude, longitude):
-    """Получает адрес по координатам с помощью геокодера Nominatim."""
+    """Получает адрес по координатам с помощью геокодера Nominatim (с кэшем по ~11 м)."""
     try:
-        location = geolocator.reverse((latitude, longitude), language='ru')
-        if location:
-            return location.address
+        address = reverse_address(latitude, longitude)
+        if address:
+            return address
         return "Адрес не удалось определить."
     except Exception as e:
-        print(f"Ошибка при получении адреса: {e}")
+        logger.exception("Ошибка при получении адреса: %s", e)
         return "Не удалось получить адрес из-за технической ошибки."
 
+# Длительность периодов для кнопок климатических данных (в днях)
+CLIMATE_PERIOD_DAYS = {
+    'climate_last_month': 30,
+    'climate_last_year': 365,
+    'climate_5_years': 5 * 365,
+}
+
+# Готовые строки дат периодов на текущие сутки
+_DATE_CACHE = {"day": None, "ranges": {}}
+
+
+def get_climate_period(callback_data):
+    """Возвращает (start_date, end_date) в формате 'YYYY-MM-DD' или None для неизвестной кнопки."""
+    today = date.today()
+    if _DATE_CACHE["day"] != today:
+        end_date = today.isoformat()
+        # Новый словарь целиком подменяет старый — читатели из других потоков не видят полузаполненную таблицу
+        _DATE_CACHE["ranges"] = {
+            key: ((today - timedelta(days=days)).isoformat(), end_date)
+            for key, days in CLIMATE_PERIOD_DAYS.items()
+        }
+        _DATE_CACHE["day"] = today
+    return _DATE_CACHE["ranges"].get(callback_data)
+
+
+def _parse_climate_callback(data):
+    """Разбирает 'climate_<период>|lat|lon' в (ключ периода, координаты или None)."""
+    period_key, _, rest = data.partition('|')
+    if rest:
+        try:
+            lat, lon = rest.split('|')
+            return period_key, {"latitude": float(lat), "longitude": float(lon)}
+        except ValueError:
+            pass
+    return period_key, None
+
+
+# Пул для фонового I/O обработчиков: геокодирование и запись в БД идут параллельно
+# с отправкой сообщений в Telegram
+_io_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="handler-io")
+
+
+def get_address_async(latitude, longitude):
+    """Запускает get_address в фоне и возвращает Future (ошибки уже обработаны в get_address)."""
+    return _io_executor.submit(get_address, latitude, longitude)
+
+class _Chat:
+    __slots__ = ("id",)
+
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+
+class _User:
+    __slots__ = ("id",)
+
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class _FakeLocation:
+    __slots__ = ("latitude", "longitude")
+
+    def __init__(self, lat, lon):
+        self.latitude = lat
+        self.longitude = lon
+
+
+class _FakeMessage:
+    """Минимальное подобие telebot Message с геолокацией — для запуска анализа по сохранённым координатам."""
+    __slots__ = ("chat", "from_user", "location")
+
+    def __init__(self, chat_id, user_id, lat, lon):
+        self.chat = _Chat(chat_id)
+        self.from_user = _User(user_id)
+        self.location = _FakeLocation(lat, lon)
+
+
+# Боты, для которых обработчики уже зарегистрированы: повторная регистрация
+# заставила бы каждый апдейт обрабатываться (и отвечать) дважды
+_registered_bots = weakref.WeakSet()
+
+
 def register_handlers(bot):
-    """Регистрирует все обработчики для бота."""
-    
+    """Регистрирует все обработчики для бота (повторный вызов для того же бота игнорируется)."""
+    if bot in _registered_bots:
+        logger.warning("Обработчики уже зарегистрированы для этого бота — пропускаю повторную регистрацию")
+        return
+    _registered_bots.add(bot)
+
     @bot.message_handler(commands=['start'])
     def send_welcome(message):
         """Обработчик команды /start. Приветствует пользователя и показывает сохраненные координаты, если есть."""
@@ -56,19 +250,17 @@ def register_handlers(bot):
         if saved_coords:
             latitude = saved_coords['latitude']
             longitude = saved_coords['longitude']
+            address_future = get_address_async(latitude, longitude)
             welcome_text += (
                 f"У меня уже есть ваши координаты: широта {latitude}, долгота {longitude}. 🌍\n"
                 "Я покажу их на карте ниже. Если хотите обновить, отправьте новую геолокацию.\n"
             )
-            bot.send_message(message.chat.id, welcome_text, reply_markup=create_main_keyboard(user_id))
-            
-            # Отправляем карту с координатами
+            # Карта уходит, пока геокодер ещё отвечает; адрес — в том же сообщении, что и приветствие
             bot.send_location(message.chat.id, latitude, longitude)
-            
-            # Получаем и отправляем адрес
-            address = get_address(latitude, longitude)
-            address_text = f"Примерный адрес: {address} 🏡"
-            bot.send_message(message.chat.id, address_text, reply_markup=create_main_keyboard(user_id))
+
+            address = address_future.result()
+            welcome_text += f"Примерный адрес: {address} 🏡"
+            bot.send_message(message.chat.id, welcome_text, reply_markup=create_main_keyboard(user_id))
         else:
             welcome_text += "Нажмите на кнопку ниже, чтобы поделиться геолокацией."
             bot.send_message(message.chat.id, welcome_text, reply_markup=create_main_keyboard(user_id))
@@ -83,35 +275,41 @@ def register_handlers(bot):
         first_name = message.from_user.first_name
 
         logger.info(f"📍 Получена геолокация от пользователя {user_id}: {latitude}, {longitude}")
+        address_future = get_address_async(latitude, longitude)
 
-        # Сохранение координат
-        save_coordinates(user_id, latitude, longitude, username=username, first_name=first_name)
-
-        response_text = (
-            f"Спасибо! Я сохранил ваши координаты: широта {latitude}, долгота {longitude}. 🌍\n"
+        # Сохранение координат идёт в фоне, пока отправляется карта
+        save_future = _io_executor.submit(
+            save_coordinates, user_id, latitude, longitude, username=username, first_name=first_name
         )
-        bot.send_message(message.chat.id, response_text, reply_markup=create_main_keyboard(user_id))
 
         # Отправляем карту с координатами
         bot.send_location(message.chat.id, latitude, longitude)
 
-        # Получаем и отправляем адрес
-        address = get_address(latitude, longitude)
-        address_text = f"Примерный адрес: {address} 🏡"
-        bot.send_message(message.chat.id, address_text)
+        # Клавиатура зависит от сохранённых координат — дожидаемся записи (ошибка пробрасывается как раньше)
+        save_future.result()
+
+        # Адрес запрошен в начале обработчика — ждём только остаток времени Nominatim
+        # и отправляем его одним сообщением с подтверждением (меньше запросов к Bot API)
+        address = address_future.result()
+        response_text = (
+            f"Спасибо! Я сохранил ваши координаты: широта {latitude}, долгота {longitude}. 🌍\n"
+            f"Примерный адрес: {address} 🏡"
+        )
+        bot.send_message(message.chat.id, response_text, reply_markup=create_main_keyboard(user_id))
 
         # Проверяем, ждали ли мы геолокацию для анализа рекомендаций
         if user_states.get(user_id) == 'waiting_for_location_recommendation':
             logger.info(f"🚀 Запуск анализа рекомендаций для пользователя {user_id}")
-            user_states[user_id] = None  # Сбрасываем состояние
+            user_states.pop(user_id, None)  # Сбрасываем состояние
 
             # Запускаем анализ рекомендаций
             try:
-                bot.send_message(message.chat.id, "🔄 Начинаю анализ данных для рекомендаций...", reply_markup=create_main_keyboard(user_id))
+                # Клавиатура уже отправлена с подтверждением выше — повторно не строим и не шлём
+                bot.send_message(message.chat.id, "🔄 Начинаю анализ данных для рекомендаций...")
                 handle_crop_recommendation_request(bot, message)
             except Exception as e:
                 logger.error(f"❌ Ошибка при запуске анализа: {e}", exc_info=True)
-                bot.send_message(message.chat.id, f"Произошла ошибка: {str(e)}", reply_markup=create_main_keyboard(user_id))
+                bot.send_message(message.chat.id, f"Произошла ошибка: {str(e)}")
     
     @bot.message_handler(func=lambda message: message.text == "Помощь ℹ️")
     def send_help(message):
@@ -128,15 +326,18 @@ def register_handlers(bot):
     def handle_climate_data(message):
         """Обработчик кнопки 'Климатические данные 📊'. Предлагает выбрать период для анализа."""
         user_id = message.from_user.id
-        if not load_coordinates(user_id):
+        coords = load_coordinates(user_id)
+        if not coords:
             bot.send_message(message.chat.id, "Сначала отправьте свои координаты.", reply_markup=create_main_keyboard(user_id))
             return
 
+        # Координаты передаются в callback_data — обработчику кнопки не нужно снова читать хранилище
+        suffix = f"|{coords['latitude']:.4f}|{coords['longitude']:.4f}"
         keyboard = InlineKeyboardMarkup(row_width=1)
         keyboard.add(
-            InlineKeyboardButton("За последний месяц", callback_data="climate_last_month"),
-            InlineKeyboardButton("За последний год", callback_data="climate_last_year"),
-            InlineKeyboardButton("За последние 5 лет", callback_data="climate_5_years")
+            InlineKeyboardButton("За последний месяц", callback_data="climate_last_month" + suffix),
+            InlineKeyboardButton("За последний год", callback_data="climate_last_year" + suffix),
+            InlineKeyboardButton("За последние 5 лет", callback_data="climate_5_years" + suffix)
         )
         bot.send_message(message.chat.id, "Выберите период для анализа климатических данных:", reply_markup=keyboard)
 
@@ -147,35 +348,31 @@ def register_handlers(bot):
         Запрашивает данные, строит график и отправляет его пользователю.
         """
         user_id = call.from_user.id
-        coords = load_coordinates(user_id)
+        period_key, coords = _parse_climate_callback(call.data)
+        if coords is None:
+            # Кнопки из старых сообщений не содержат координат
+            coords = load_coordinates(user_id)
 
         if not coords:
             bot.answer_callback_query(call.id, "Координаты не найдены. Пожалуйста, отправьте их снова.")
             return
 
         bot.answer_callback_query(call.id, "Запрос принят! Загружаю данные... Это может занять некоторое время. ⏳")
-        bot.edit_message_text("Пожалуйста, подождите, я готовлю ваш график... ⏳", call.message.chat.id, call.message.message_id)
-
-        # Определяем период
-        today = datetime.now()
-        if call.data == 'climate_last_month':
-            start_date = (today - timedelta(days=30)).strftime('%Y-%m-%d')
-            end_date = today.strftime('%Y-%m-%d')
-        elif call.data == 'climate_last_year':
-            start_date = (today - timedelta(days=365)).strftime('%Y-%m-%d')
-            end_date = today.strftime('%Y-%m-%d')
-        elif call.data == 'climate_5_years':
-            start_date = (today - timedelta(days=5*365)).strftime('%Y-%m-%d')
-            end_date = today.strftime('%Y-%m-%d')
-        else:
+        progress = ProgressMessage(bot, call.message.chat.id, call.message.message_id)
+        progress.update("Пожалуйста, подождите, я готовлю ваш график... ⏳")
+
+        # Определяем период (таблица строк пересчитывается раз в сутки)
+        period = get_climate_period(period_key)
+        if period is None:
             return
+        start_date, end_date = period
 
         try:
             # Получаем путь к файлу с данными
             netcdf_file = get_climate_data(coords['latitude'], coords['longitude'], start_date, end_date)
 
             if netcdf_file:
-                bot.edit_message_text("Данные загружены. Создаю график... 🎨", call.message.chat.id, call.message.message_id)
+                progress.update("Данные загружены. Создаю график... 🎨")
                 # Строим график из файла
                 plot_image = plot_climate_data(netcdf_file)
 
@@ -183,12 +380,12 @@ def register_handlers(bot):
                     bot.delete_message(call.message.chat.id, call.message.message_id)
                     bot.send_photo(call.message.chat.id, plot_image, caption=f"Климатические данные за период с {start_date} по {end_date}")
                 else:
-                    bot.edit_message_text("Не удалось построить график. Проверьте данные.", call.message.chat.id, call.message.message_id)
+                    progress.update("Не удалось построить график. Проверьте данные.", final=True)
             else:
-                bot.edit_message_text("Не удалось получить климатические данные. Попробуйте позже.", call.message.chat.id, call.message.message_id)
+                progress.update("Не удалось получить климатические данные. Попробуйте позже.", final=True)
         except Exception as e:
-            print(f"Ошибка в handle_climate_callback: {e}")
-            bot.edit_message_text("Произошла ошибка при обработке вашего запроса.", call.message.chat.id, call.message.message_id)
+            logger.exception("Ошибка в handle_climate_callback: %s", e)
+            progress.update("Произошла ошибка при обработке вашего запроса.", final=True)
 
     @bot.message_handler(func=lambda message: message.text == "Рекомендации по культурам 🌾")
     def handle_crop_recommendations(message):
@@ -239,18 +436,7 @@ def register_handlers(bot):
             bot.delete_message(call.message.chat.id, call.message.message_id)
 
             # Создаем фейковый объект message с геолокацией
-            class FakeLocation:
-                def __init__(self, lat, lon):
-                    self.latitude = lat
-                    self.longitude = lon
-
-            class FakeMessage:
-                def __init__(self, chat_id, user_id, lat, lon):
-                    self.chat = type('obj', (object,), {'id': chat_id})
-                    self.from_user = type('obj', (object,), {'id': user_id})
-                    self.location = FakeLocation(lat, lon)
-
-            fake_msg = FakeMessage(call.message.chat.id, user_id, coords['latitude'], coords['longitude'])
+            fake_msg = _FakeMessage(call.message.chat.id, user_id, coords['latitude'], coords['longitude'])
 
             # Запускаем handler
             try:
@@ -320,7 +506,7 @@ def register_handlers(bot):
         user_id = message.from_user.id
         if user_id in user_states:
             logger.info(f"❌ Пользователь {user_id} отменил операцию")
-            user_states[user_id] = None
+            user_states.pop(user_id, None)
 
         bot.send_message(
             message.chat.id,
@@ -339,12 +525,10 @@ def register_handlers(bot):
         # Парсим координаты
         try:
             # Формат: 55.7558, 37.6173 или 55.7558 37.6173
-            coords_pattern = r'([-+]?\d+\.?\d*)[,\s]+([-+]?\d+\.?\d*)'
-            match = re.search(coords_pattern, text)
+            coords = parse_coordinates(text)
 
-            if match:
-                lat = float(match.group(1))
-                lon = float(match.group(2))
+            if coords:
+                lat, lon = coords
 
                 # Валидация
                 if not (-90 <= lat <= 90):
@@ -353,54 +537,46 @@ def register_handlers(bot):
                     raise ValueError(f"Долгота должна быть от -180 до 180, получено: {lon}")
 
                 logger.info(f"✅ Координаты распознаны: {lat}, {lon}")
+                address_future = get_address_async(lat, lon)
 
                 # Сохраняем координаты
                 username = message.from_user.username
                 first_name = message.from_user.first_name
-                save_coordinates(user_id, lat, lon, username=username, first_name=first_name)
+                save_future = _io_executor.submit(
+                    save_coordinates, user_id, lat, lon, username=username, first_name=first_name
+                )
 
                 # Сбрасываем состояние
-                user_states[user_id] = None
+                user_states.pop(user_id, None)
+
+                # Отправляем карту, пока координаты записываются в БД
+                bot.send_location(message.chat.id, lat, lon)
+                save_future.result()
 
+                # Адрес запрошен параллельно с сохранением и картой — отправляем одним сообщением
+                address = address_future.result()
                 bot.send_message(
                     message.chat.id,
                     f"✅ Координаты сохранены:\n"
                     f"Широта: {lat}\n"
-                    f"Долгота: {lon}\n\n"
+                    f"Долгота: {lon}\n"
+                    f"Примерный адрес: {address}\n\n"
                     f"🔄 Начинаю анализ...",
                     reply_markup=create_main_keyboard(user_id)
                 )
 
-                # Отправляем карту
-                bot.send_location(message.chat.id, lat, lon)
-
-                # Получаем адрес
-                address = get_address(lat, lon)
-                bot.send_message(message.chat.id, f"Примерный адрес: {address}")
-
                 # Создаем фейковое сообщение с локацией для обработчика
-                class FakeLocation:
-                    def __init__(self, lat, lon):
-                        self.latitude = lat
-                        self.longitude = lon
-
-                class FakeMessage:
-                    def __init__(self, chat_id, user_id, lat, lon):
-                        self.chat = type('obj', (object,), {'id': chat_id})
-                        self.from_user = type('obj', (object,), {'id': user_id})
-                        self.location = FakeLocation(lat, lon)
-
-                fake_msg = FakeMessage(message.chat.id, user_id, lat, lon)
+                fake_msg = _FakeMessage(message.chat.id, user_id, lat, lon)
 
                 # Запускаем анализ
                 try:
                     handle_crop_recommendation_request(bot, fake_msg)
                 except Exception as e:
                     logger.error(f"❌ Ошибка при анализе: {e}", exc_info=True)
+                    # Основная клавиатура уже показана сообщением о сохранении координат
                     bot.send_message(
                         message.chat.id,
-                        f"Произошла ошибка при анализе: {str(e)}",
-                        reply_markup=create_main_keyboard(user_id)
+                        f"Произошла ошибка при анализе: {str(e)}"
                     )
 
             else:
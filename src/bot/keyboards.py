@@ -1,6 +1,10 @@
+from functools import lru_cache
+
 from telebot.types import ReplyKeyboardMarkup, KeyboardButton
 from src.storage.coordinates import load_coordinates
 
+__all__ = ["create_main_keyboard"]
+
 
 def create_main_keyboard(user_id=None):
     """
@@ -15,9 +19,14 @@ def create_main_keyboard(user_id=None):
         - Отправить геолокацию 🌍
         - Справочник 📚
     """
-    keyboard = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+    has_coords = bool(user_id and load_coordinates(user_id))
+    return _build_keyboard(has_coords)
 
-    has_coords = user_id and load_coordinates(user_id)
+
+@lru_cache(maxsize=2)
+def _build_keyboard(has_coords: bool) -> ReplyKeyboardMarkup:
+    """Собирает клавиатуру один раз на каждый вариант (с координатами / без)."""
+    keyboard = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
 
     if has_coords:
         recommend_button = KeyboardButton("Рекомендации по культурам 🌾")
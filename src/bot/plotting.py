@@ -2,8 +2,66 @@ import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import io
+import threading
 
+import numpy as np
 import xarray as xr
+from PIL import Image
+
+# Ограничиваем число пикселей и разбиваем длинные линии на куски при растеризации
+plt.rcParams['figure.dpi'] = 90
+plt.rcParams['agg.path.chunksize'] = 10000
+
+# Больше этого числа суточных столбцов осадки агрегируются в окна по w дней
+MAX_PRECIP_BARS = 400
+
+# Фигура и оси создаются один раз и переиспользуются между вызовами.
+# Agg не потокобезопасен, поэтому рисование идёт под блокировкой.
+_FIG = None
+_AX1 = None
+_AX2 = None
+_LOCK = threading.Lock()
+
+
+def _get_axes():
+    """
+    Возвращает очищенные (fig, ax1, ax2); при первом вызове создаёт фигуру.
+
+    Вызывать только под _LOCK.
+    """
+    global _FIG, _AX1, _AX2
+    if _FIG is None:
+        _FIG, _AX1 = plt.subplots(figsize=(12, 7))
+        _AX2 = _AX1.twinx()
+        # Непрозрачный фон — альфа-канал в PNG не нужен
+        _FIG.patch.set_alpha(1.0)
+        _AX1.set_facecolor('white')
+    else:
+        _AX1.cla()
+        _AX2.cla()
+        # cla() сбрасывает настройки, выставленные twinx()
+        _AX1.yaxis.tick_left()
+        _AX2.yaxis.tick_right()
+        _AX2.yaxis.set_label_position('right')
+        _AX2.yaxis.set_offset_position('right')
+        _AX2.xaxis.set_visible(False)
+        _AX2.patch.set_visible(False)
+    return _FIG, _AX1, _AX2
+
+
+def _render_png(fig):
+    """
+    Рендерит фигуру в PNG без альфа-канала (RGB, 3 байта на пиксель).
+
+    Фон фигуры непрозрачный, поэтому отбрасывание альфы ничего не меняет в
+    картинке; zlib уровня 1 кодирует заметно быстрее при чуть большем файле.
+    """
+    fig.canvas.draw()
+    rgb = np.asarray(fig.canvas.buffer_rgba())[..., :3]
+    buf = io.BytesIO()
+    Image.fromarray(rgb).save(buf, format='PNG', compress_level=1, optimize=False)
+    return buf
+
 
 def plot_climate_data(netcdf_file_path):
     """
@@ -20,66 +78,85 @@ def plot_climate_data(netcdf_file_path):
     try:
         # Открываем NetCDF файл с помощью xarray
         with xr.open_dataset(netcdf_file_path) as ds:
-            # Конвертируем в pandas DataFrame для удобства
-            df = ds.to_dataframe()
-
             # Извлекаем данные. Названия переменных могут отличаться в зависимости от запроса.
-            # Проверяем наличие нужных колонок
+            # Проверяем наличие нужных переменных
             temp_mean_col = 'mean_2m_air_temperature_daily'
             temp_max_col = 'maximum_2m_air_temperature_daily'
             temp_min_col = 'minimum_2m_air_temperature_daily'
             precip_col = 'sum_total_precipitation_daily'
 
             required_cols = [temp_mean_col, temp_max_col, temp_min_col, precip_col]
-            if not all(col in df.columns for col in required_cols):
+            if not all(col in ds.data_vars for col in required_cols):
                 # Попытка использовать альтернативные имена, если стандартные не найдены
                 temp_mean_col = 't2m_mean'
                 temp_max_col = 't2m_max'
                 temp_min_col = 't2m_min'
                 precip_col = 'tp_sum'
                 required_cols = [temp_mean_col, temp_max_col, temp_min_col, precip_col]
-                if not all(col in df.columns for col in required_cols):
+                if not all(col in ds.data_vars for col in required_cols):
                     return None # Возвращаем None, если данные не найдены
 
-            # Конвертируем температуру из Кельвинов в Цельсии
-            df[temp_mean_col] -= 273.15
-            df[temp_max_col] -= 273.15
-            df[temp_min_col] -= 273.15
+            # Берём только четыре нужные переменные (без to_dataframe по всей сетке)
+            # и схлопываем пространственные измерения, если они есть
+            sub = ds[required_cols]
+            spatial_dims = [d for d in ('latitude', 'longitude') if d in sub.dims]
+            if spatial_dims:
+                sub = sub.mean(dim=spatial_dims)
+
+            # Ось X — оставшееся (временное) измерение
+            time_dim = sub[temp_mean_col].dims[0]
+            times = sub[time_dim].values
+
+            # Конвертируем температуру из Кельвинов в Цельсии одной операцией над стеком
+            temps = np.stack([sub[temp_mean_col].values,
+                              sub[temp_max_col].values,
+                              sub[temp_min_col].values]).astype(float)
+            temps -= 273.15
+            t_mean, t_max, t_min = temps
             # Конвертируем осадки из метров в миллиметры
-            df[precip_col] *= 1000
-
-            fig, ax1 = plt.subplots(figsize=(12, 7))
-
-            # График температуры
-            ax1.set_xlabel('Дата')
-            ax1.set_ylabel('Температура (°C)', color='tab:red')
-            ax1.plot(df.index, df[temp_mean_col], color='tab:red', lw=2, label='Средняя температура')
-            ax1.fill_between(df.index, df[temp_min_col], df[temp_max_col], color='tab:red', alpha=0.2, label='Диапазон (мин/макс)')
-            ax1.tick_params(axis='y', labelcolor='tab:red')
-            ax1.grid(axis='y', linestyle='--')
-
-            # График осадков на второй оси
-            ax2 = ax1.twinx()
-            ax2.set_ylabel('Осадки (мм)', color='tab:blue')
-            ax2.bar(df.index, df[precip_col], color='tab:blue', alpha=0.6, label='Осадки')
-            ax2.tick_params(axis='y', labelcolor='tab:blue')
-
-            # Настройка заголовка и легенды
-            plt.title('Суточные климатические данные за период', pad=20)
-            fig.tight_layout()
-            plt.xticks(rotation=45)
-
-            # Собираем легенду с обеих осей
-            lines, labels = ax1.get_legend_handles_labels()
-            bars, bar_labels = ax2.get_legend_handles_labels()
-            ax2.legend(lines + bars, labels + bar_labels, loc='upper left')
-
-            # Сохранение графика в байтовый объект
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png', bbox_inches='tight')
-            buf.seek(0)
+            precip = sub[precip_col].values * 1000.0
+
+            with _LOCK:
+                fig, ax1, ax2 = _get_axes()
 
-            plt.close(fig)
+                # График температуры
+                ax1.set_xlabel('Дата')
+                ax1.set_ylabel('Температура (°C)', color='tab:red')
+                ax1.plot(times, t_mean, color='tab:red', lw=2, label='Средняя температура')
+                ax1.fill_between(times, t_min, t_max, color='tab:red', alpha=0.2, label='Диапазон (мин/макс)')
+                ax1.tick_params(axis='y', labelcolor='tab:red')
+                ax1.tick_params(axis='x', labelrotation=45)
+                ax1.grid(axis='y', linestyle='--')
+
+                # График осадков на второй оси
+                ax2.set_ylabel('Осадки (мм)', color='tab:blue')
+                if len(times) > MAX_PRECIP_BARS:
+                    # Один прямоугольник на окно из w дней вместо тысяч патчей
+                    w = len(times) // MAX_PRECIP_BARS
+                    k = len(times) // w
+                    bar_times = times[:k * w:w]
+                    bar_precip = precip[:k * w].reshape(k, w).sum(axis=1)
+                    ax2.bar(bar_times, bar_precip, width=w * 0.8, color='tab:blue', alpha=0.6, label='Осадки')
+                else:
+                    ax2.bar(times, precip, color='tab:blue', alpha=0.6, label='Осадки')
+                ax2.tick_params(axis='y', labelcolor='tab:blue')
+
+                # Настройка заголовка и легенды
+                ax1.set_title('Суточные климатические данные за период', pad=20)
+
+                # Собираем легенду с обеих осей
+                lines, labels = ax1.get_legend_handles_labels()
+                bars, bar_labels = ax2.get_legend_handles_labels()
+                ax2.legend(lines + bars, labels + bar_labels, loc='upper left')
+
+                # Раскладка считается один раз после поворота подписей —
+                # bbox_inches='tight' не нужен и не вызывает повторную отрисовку
+                fig.tight_layout()
+
+                # Сохранение графика в байтовый объект напрямую из буфера Agg;
+                # фигура не закрывается — она будет переиспользована
+                buf = _render_png(fig)
+            buf.seek(0)
 
             return buf
     except Exception as e:
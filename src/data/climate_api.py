@@ -5,54 +5,225 @@
 import cdsapi
 from config.settings import CDS_API_URL, CDS_API_KEY
 import xarray as xr
+import dask
 import pandas as pd
 import numpy as np
 import os
 import hashlib
+import logging
+import shutil
+import threading
 from datetime import datetime, timedelta
+from functools import lru_cache
+
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=8)
+def _variables_key(variables):
+    """Отсортированный ключ списка переменных (кортеж → строка), считается один раз"""
+    return '_'.join(sorted(variables))
 
 
 def generate_filename(latitude, longitude, start_date_str, end_date_str, variables):
-    """Генерирует уникальное имя файла на основе параметров запроса"""
-    key_string = f"{latitude}_{longitude}_{start_date_str}_{end_date_str}_{'_'.join(sorted(variables))}"
-    hash_key = hashlib.md5(key_string.encode()).hexdigest()
-    filename = f"data/era5/climate_{hash_key}.nc"
+    """
+    Генерирует уникальное имя файла на основе параметров запроса
+
+    Ключ хэшируется BLAKE2b (быстрее MD5 и допустим в FIPS-сборках). Если файла
+    с новым именем ещё нет, но есть файл со старым MD5-именем — возвращается он.
+    """
+    key_string = f"{latitude}_{longitude}_{start_date_str}_{end_date_str}_{_variables_key(tuple(variables))}"
+    filename = f"data/era5/climate_{hashlib.blake2b(key_string.encode(), digest_size=16).hexdigest()}.nc"
+
+    if not os.path.exists(filename) and not os.path.exists(_zarr_path(filename)):
+        legacy_filename = f"data/era5/climate_{hashlib.md5(key_string.encode(), usedforsecurity=False).hexdigest()}.nc"
+        if os.path.exists(legacy_filename):
+            return legacy_filename
+
     return filename
 
 
+def _zarr_path(output_file):
+    """Путь к Zarr-копии загруженного NetCDF файла"""
+    return os.path.splitext(output_file)[0] + '.zarr'
+
+
+def _convert_to_zarr(output_file, zarr_path):
+    """
+    Переписывает загруженный NetCDF в Zarr с чанками под доступ к временному ряду ячейки
+
+    Чанки {time: весь ряд, latitude: 1, longitude: 1} — одна ячейка сетки читается
+    одним чанком. Запись идёт во временный каталог с атомарным переименованием,
+    после успешной конвертации исходный NetCDF удаляется. Ошибка не критична —
+    чтение остаётся на NetCDF.
+    """
+    tmp_path = f"{zarr_path}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        with xr.open_dataset(output_file, engine="h5netcdf") as ds:
+            chunks = {dim: size for dim, size in (('time', -1), ('latitude', 1), ('longitude', 1))
+                      if dim in ds.dims}
+            ds = ds.load().chunk(chunks)
+        # Кодировки NetCDF (zlib, chunksizes) несовместимы с Zarr — сбрасываем их
+        for var in ds.variables.values():
+            var.encoding = {}
+        ds.to_zarr(tmp_path, mode='w')
+        os.replace(tmp_path, zarr_path)
+        os.remove(output_file)
+    except Exception as e:
+        print(f"Не удалось сконвертировать {output_file} в Zarr: {e}")
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+# ── Вычислительные ядра ─────────────────────────────────────────────────────
+# С numba — компилируемый цикл по одномерному массиву float64 (cache=True сохраняет
+# код между запусками); без numba — эквивалентные выражения NumPy.
+# Без fastmath: пропуски ERA5-Land (море, нет данных) — NaN, и оба пути
+# одинаково пропускают их в результат как NaN.
+if njit is not None:
+    @njit(cache=True)
+    def _vapor_deficit_kernel(T, Td):
+        out = np.empty(T.shape[0], dtype=np.float64)
+        for i in range(T.shape[0]):
+            # Формула Магнуса: насыщающая минус фактическая упругость водяного пара
+            e_s = 6.112 * np.exp(17.67 * T[i] / (T[i] + 243.5))
+            e_a = 6.112 * np.exp(17.67 * Td[i] / (Td[i] + 243.5))
+            out[i] = e_s - e_a
+        return out
+
+    @njit(cache=True)
+    def _productive_moisture_kernel(theta, layer_depth, FC, PWP):
+        out = np.empty(theta.shape[0], dtype=np.float64)
+        scale = layer_depth / (FC - PWP)
+        for i in range(theta.shape[0]):
+            W = (theta[i] - PWP) * scale
+            # NaN < 0 ложно — пропуск остается NaN, как в np.clip
+            out[i] = 0.0 if W < 0.0 else W
+        return out
+else:
+    def _vapor_deficit_kernel(T, Td):
+        e_s = 6.112 * np.exp(17.67 * T / (T + 243.5))  # Насыщающая упругость
+        e_a = 6.112 * np.exp(17.67 * Td / (Td + 243.5))  # Фактическая упругость
+        return e_s - e_a
+
+    def _productive_moisture_kernel(theta, layer_depth, FC, PWP):
+        W = (theta - PWP) / (FC - PWP) * layer_depth
+        return np.clip(W, 0.0, None)
+
+
+def _as_float_array(x):
+    """Скаляр или массив → (одномерный float64 массив, исходная форма)"""
+    arr = np.asarray(x, dtype=np.float64)
+    return np.ascontiguousarray(arr.ravel()), arr.shape
+
+
 def calculate_vapor_deficit(T, Td):
     """
     Расчет дефицита влажности воздуха (гПа)
 
     Args:
-        T: температура воздуха (°C)
-        Td: точка росы (°C)
+        T: температура воздуха (°C), число или массив
+        Td: точка росы (°C), число или массив той же формы
 
     Returns:
         Дефицит влажности (гПа)
     """
-    # Формула Магнуса для насыщающей упругости водяного пара
-    e_s = 6.112 * np.exp(17.67 * T / (T + 243.5))  # Насыщающая упругость
-    e_a = 6.112 * np.exp(17.67 * Td / (Td + 243.5))  # Фактическая упругость
-    d = e_s - e_a
-    return d
+    T_arr, shape = _as_float_array(T)
+    Td_arr, _ = _as_float_array(Td)
+    d = _vapor_deficit_kernel(T_arr, Td_arr).reshape(shape)
+    return d if shape else float(d)
 
 
 def calculate_productive_moisture(theta, layer_depth, FC=0.35, PWP=0.15):
     """
     Расчет запасов продуктивной влаги (мм)
 
+    Векторизована: принимает скаляр или массив и обрабатывает весь ряд одним проходом.
+
     Args:
-        theta: объемная влажность почвы (м³/м³)
+        theta: объемная влажность почвы (м³/м³), число или массив
         layer_depth: глубина слоя (мм)
         FC: наименьшая влагоемкость (полевая влагоемкость)
         PWP: влажность завядания
 
     Returns:
-        Запасы продуктивной влаги (мм)
+        Запасы продуктивной влаги (мм), отрицательные значения обнуляются,
+        пропуски (NaN) во влажности остаются NaN
     """
-    W = (theta - PWP) / (FC - PWP) * layer_depth
-    return max(0, W)
+    theta_arr, shape = _as_float_array(theta)
+    W = _productive_moisture_kernel(theta_arr, float(layer_depth), float(FC), float(PWP)).reshape(shape)
+    return W if shape else float(W)
+
+
+# Сроки ERA5-Land, запрашиваемые на каждые сутки
+ERA5_TIMES = ['00:00', '06:00', '12:00', '18:00']
+ERA5_STEPS_PER_DAY = len(ERA5_TIMES)
+# Смещения сроков от полуночи (для проверки регулярности ряда)
+_ERA5_STEP_OFFSETS = pd.to_timedelta([f'{t}:00' for t in ERA5_TIMES]).values.astype('timedelta64[ns]')
+
+
+def _daily_aggregators(times):
+    """
+    Функции суточной агрегации для ряда сроков ERA5.
+
+    Если каждые сутки содержат все ERA5_TIMES по порядку, начиная с 00:00,
+    агрегация — reshape (дни × сроки) и редукция по оси 1; неполные последние
+    сутки отбрасываются (с предупреждением в лог). Иначе (пропущенный срок,
+    сдвиг) — группировка по календарной дате, как раньше, чтобы пропуск
+    не сдвигал значения всех последующих дней.
+
+    Returns:
+        (daily_mean, daily_sum, day_starts): функции от массива значений
+        по срокам и datetime64 начала каждых суток
+    """
+    times = np.asarray(times, dtype='datetime64[ns]')
+    n_days = len(times) // ERA5_STEPS_PER_DAY
+    n_steps = n_days * ERA5_STEPS_PER_DAY
+    grid = times[:n_steps].reshape(n_days, ERA5_STEPS_PER_DAY)
+    regular = (
+        n_days > 0
+        and (grid[:, 0] == grid[:, 0].astype('datetime64[D]')).all()
+        and ((grid - grid[:, :1]) == _ERA5_STEP_OFFSETS).all()
+    )
+
+    if regular:
+        if n_steps < len(times):
+            logger.warning(
+                "ERA5: отброшено %d сроков неполных последних суток (%s)",
+                len(times) - n_steps, times[n_steps],
+            )
+
+        def daily_mean(values):
+            return values[:n_steps].reshape(n_days, ERA5_STEPS_PER_DAY).mean(axis=1)
+
+        def daily_sum(values):
+            return values[:n_steps].reshape(n_days, ERA5_STEPS_PER_DAY).sum(axis=1)
+
+        return daily_mean, daily_sum, grid[:, 0]
+
+    logger.warning("ERA5: сроки нерегулярны, суточная агрегация группировкой по датам")
+    days, day_idx, counts = np.unique(
+        times.astype('datetime64[D]'), return_inverse=True, return_counts=True
+    )
+
+    def daily_sum(values):
+        return np.bincount(day_idx, weights=values, minlength=len(days))
+
+    def daily_mean(values):
+        return daily_sum(values) / counts
+
+    return daily_mean, daily_sum, days.astype('datetime64[ns]')
 
 
 async def fetch_era5_extended_data(lat, lon, start_date, end_date):
@@ -74,7 +245,8 @@ async def fetch_era5_extended_data(lat, lon, start_date, end_date):
         end_date: конечная дата (строка 'YYYY-MM-DD' или datetime)
 
     Returns:
-        Словарь с климатическими данными и расчетными параметрами
+        Словарь с климатическими данными и расчетными параметрами;
+        суточные ряды — массивы NumPy, даты — список строк 'YYYY-MM-DD'
     """
     # Преобразование дат
     if isinstance(start_date, str):
@@ -101,16 +273,17 @@ async def fetch_era5_extended_data(lat, lon, start_date, end_date):
 
     # Генерируем диапазон дат
     date_range = pd.date_range(start=start_date, end=end_date)
-    years = sorted(list(set([d.year for d in date_range])))
-    months = sorted(list(set([d.month for d in date_range])))
-    days = sorted(list(set([d.day for d in date_range])))
+    years = sorted(date_range.year.unique().tolist())
+    months = sorted(date_range.month.unique().tolist())
+    days = sorted(date_range.day.unique().tolist())
 
     try:
         # Создаем директорию если не существует
         os.makedirs('data/era5', exist_ok=True)
 
-        # Проверяем кэш
-        if not os.path.exists(output_file):
+        # Проверяем кэш (NetCDF или его Zarr-копия)
+        zarr_path = _zarr_path(output_file)
+        if not os.path.exists(output_file) and not os.path.exists(zarr_path):
             print(f"Загрузка данных ERA5 для координат {lat}, {lon}...")
             c = cdsapi.Client(url=CDS_API_URL, key=CDS_API_KEY)
 
@@ -123,7 +296,7 @@ async def fetch_era5_extended_data(lat, lon, start_date, end_date):
                     'year': [str(y) for y in years],
                     'month': [f'{m:02d}' for m in months],
                     'day': [f'{d:02d}' for d in days],
-                    'time': ['00:00', '06:00', '12:00', '18:00'],
+                    'time': ERA5_TIMES,
                     'area': [
                         round(lat + 0.25, 2), round(lon - 0.25, 2),
                         round(lat - 0.25, 2), round(lon + 0.25, 2),
@@ -133,85 +306,81 @@ async def fetch_era5_extended_data(lat, lon, start_date, end_date):
             )
             print(f"Данные сохранены в {output_file}")
 
-        # Обработка загруженного файла
-        ds = xr.open_dataset(output_file, engine="netcdf4")
+        # После первой загрузки (или для старого кэша) один раз создаём Zarr-копию
+        if zarr is not None and not os.path.exists(zarr_path):
+            _convert_to_zarr(output_file, zarr_path)
+
+        # Обработка данных: ленивое открытие (dask-чанки), чтение при compute
+        if os.path.exists(zarr_path):
+            ds = xr.open_zarr(zarr_path)
+        else:
+            ds = xr.open_dataset(output_file, engine="h5netcdf", chunks={})
+
+        # Все пространственные редукции собираются в один граф dask и считаются
+        # за один проход по файлу; в память попадают только ряды по точке
+        spatial_dims = ['latitude', 'longitude']
+        point = ds[['t2m', 'd2m', 'ssrd', 'stl1', 'stl2', 'swvl1', 'swvl2']].mean(dim=spatial_dims)
+        tp_point = ds['tp'].sum(dim=spatial_dims)
+        t2m_max_all = ds['t2m'].max(dim=['time', 'latitude', 'longitude'])
+        t2m_min_all = ds['t2m'].min(dim=['time', 'latitude', 'longitude'])
+        point, tp_point, t2m_max_all, t2m_min_all = dask.compute(
+            point, tp_point, t2m_max_all, t2m_min_all
+        )
+
+        # Суточная агрегация: reshape (дни × сроки) для регулярного ряда,
+        # иначе группировка по датам (см. _daily_aggregators)
+        daily_mean, daily_sum, day_starts = _daily_aggregators(point['time'].values)
 
-        # Извлечение данных
+        # Извлечение суточных рядов
         # Температура воздуха (конвертация из K в °C)
-        t2m = ds['t2m'].mean(dim=['latitude', 'longitude']).values - 273.15
-        t2m_max = ds['t2m'].max(dim=['time', 'latitude', 'longitude']).values - 273.15
-        t2m_min = ds['t2m'].min(dim=['time', 'latitude', 'longitude']).values - 273.15
+        t2m = daily_mean(point['t2m'].values) - 273.15
+        t2m_max = t2m_max_all.values - 273.15
+        t2m_min = t2m_min_all.values - 273.15
 
         # Точка росы (конвертация из K в °C)
-        td = ds['d2m'].mean(dim=['latitude', 'longitude']).values - 273.15
+        td = daily_mean(point['d2m'].values) - 273.15
 
         # Осадки (конвертация из м в мм)
-        tp = ds['tp'].sum(dim=['latitude', 'longitude']).values * 1000
+        tp = daily_sum(tp_point.values) * 1000
 
         # Радиация (Дж/м² → МДж/м²)
-        ssrd = ds['ssrd'].mean(dim=['latitude', 'longitude']).values / 1e6
+        ssrd = daily_sum(point['ssrd'].values) / 1e6
 
         # Температура почвы (конвертация из K в °C)
-        stl1 = ds['stl1'].mean(dim=['latitude', 'longitude']).values - 273.15
-        stl2 = ds['stl2'].mean(dim=['latitude', 'longitude']).values - 273.15
+        stl1 = daily_mean(point['stl1'].values) - 273.15
+        stl2 = daily_mean(point['stl2'].values) - 273.15
 
         # Влажность почвы (м³/м³)
-        swvl1 = ds['swvl1'].mean(dim=['latitude', 'longitude']).values
-        swvl2 = ds['swvl2'].mean(dim=['latitude', 'longitude']).values
-
-        # Временные метки
-        time_values = ds['time'].values
-        time_stamps = [pd.to_datetime(t).strftime('%Y-%m-%d') for t in time_values]
-
-        # Группировка по дням (агрегация)
-        df = pd.DataFrame({
-            'time': pd.to_datetime(time_stamps),
-            't2m': t2m,
-            'td': td,
-            'tp': tp,
-            'ssrd': ssrd,
-            'stl1': stl1,
-            'stl2': stl2,
-            'swvl1': swvl1,
-            'swvl2': swvl2
-        })
-
-        daily = df.groupby(df['time'].dt.date).agg({
-            't2m': 'mean',
-            'td': 'mean',
-            'tp': 'sum',
-            'ssrd': 'sum',
-            'stl1': 'mean',
-            'stl2': 'mean',
-            'swvl1': 'mean',
-            'swvl2': 'mean'
-        }).reset_index()
-
-        # Расчет дефицита влажности
-        daily['vapor_deficit'] = calculate_vapor_deficit(daily['t2m'], daily['td'])
-
-        # Расчет запасов продуктивной влаги (для слоя 0-7 см)
-        daily['productive_moisture'] = daily['swvl1'].apply(
-            lambda x: calculate_productive_moisture(x, layer_depth=70)  # 70 мм = 7 см
-        )
+        swvl1 = daily_mean(point['swvl1'].values)
+        swvl2 = daily_mean(point['swvl2'].values)
+
+        # Даты суток — по первому сроку каждого дня (дни в запросе CDS могут идти не подряд)
+        dates = pd.DatetimeIndex(day_starts).strftime('%Y-%m-%d').tolist()
+
+        # Расчет дефицита влажности (на массивах NumPy)
+        vapor_deficit = calculate_vapor_deficit(t2m, td)
+
+        # Расчет запасов продуктивной влаги (для слоя 0-7 см) одним векторным вызовом
+        productive_moisture = calculate_productive_moisture(swvl1, layer_depth=70)  # 70 мм = 7 см
 
-        # Формирование результата
+        # Формирование результата: суточные ряды остаются массивами NumPy
+        # (orjson сериализует их с OPT_SERIALIZE_NUMPY без поэлементного боксинга)
         climate_data = {
-            'dates': daily['time'].astype(str).tolist(),
-            'temperature_avg': daily['t2m'].tolist(),
+            'dates': dates,
+            'temperature_avg': t2m,
             'temperature_max': float(t2m_max),
             'temperature_min': float(t2m_min),
-            'dewpoint': daily['td'].tolist(),
-            'precipitation': daily['tp'].tolist(),
-            'precipitation_sum': float(daily['tp'].sum()),
-            'radiation': daily['ssrd'].tolist(),
-            'radiation_sum': float(daily['ssrd'].sum()),
-            'soil_temp_0_7cm': daily['stl1'].tolist(),
-            'soil_temp_7_28cm': daily['stl2'].tolist(),
-            'soil_moisture_0_7cm': daily['swvl1'].tolist(),
-            'soil_moisture_7_28cm': daily['swvl2'].tolist(),
-            'vapor_deficit': daily['vapor_deficit'].tolist(),
-            'productive_moisture': daily['productive_moisture'].tolist()
+            'dewpoint': td,
+            'precipitation': tp,
+            'precipitation_sum': float(tp.sum()),
+            'radiation': ssrd,
+            'radiation_sum': float(ssrd.sum()),
+            'soil_temp_0_7cm': stl1,
+            'soil_temp_7_28cm': stl2,
+            'soil_moisture_0_7cm': swvl1,
+            'soil_moisture_7_28cm': swvl2,
+            'vapor_deficit': vapor_deficit,
+            'productive_moisture': productive_moisture
         }
 
         ds.close()
@@ -2,15 +2,21 @@
 Модуль для работы со спутниковыми данными
 Использует Google Earth Engine для получения NDVI и LAI
 """
+import asyncio
+import hashlib
+import json
+import os
 import ee
-import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 
 # Флаг инициализации
 _ee_initialized = False
 
+# Каталог дискового кэша ответов Earth Engine
+EE_CACHE_DIR = "data/ee"
+
 
 def initialize_earth_engine():
     """Инициализация Google Earth Engine"""
@@ -26,6 +32,61 @@ def initialize_earth_engine():
             raise
 
 
+def _get_region_rows(collection, point, scale):
+    """
+    Значения всех изображений коллекции в точке одним запросом (getRegion)
+
+    Блокирующий вызов getInfo — из корутин запускать через asyncio.to_thread
+
+    Returns:
+        (индекс колонок {имя: позиция}, список строк)
+        Колонки: id, longitude, latitude, time (мс с эпохи) и выбранные каналы
+    """
+    table = collection.getRegion(point, scale).getInfo()
+    header, rows = table[0], table[1:]
+    return {name: i for i, name in enumerate(header)}, rows
+
+
+def _ee_cache_path(kind, lat, lon, start_date_str, end_date_str, extra=''):
+    """Путь к файлу кэша на основе параметров запроса (аналог generate_filename)"""
+    key_string = f"{kind}_{lat}_{lon}_{start_date_str}_{end_date_str}_{extra}"
+    hash_key = hashlib.md5(key_string.encode()).hexdigest()
+    return os.path.join(EE_CACHE_DIR, f"{kind}_{hash_key}.json")
+
+
+def _ee_cache_load(path):
+    """Результаты из кэша или None, если файла нет/он повреждён"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _ee_cache_save(path, results):
+    """Атомарная запись результатов в кэш (через временный файл)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.part'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _scaled_column(rows, index, factor=1.0):
+    """Колонка таблицы getRegion → float64 массив × factor (None → NaN)"""
+    return np.array([row[index] for row in rows], dtype=np.float64) * factor
+
+
+def _none_if_nan(value):
+    """NaN → None для отсутствующих значений в результатах"""
+    return None if np.isnan(value) else float(value)
+
+
+def _ms_to_date(ms):
+    """Метка времени Earth Engine (мс, UTC) → 'YYYY-MM-DD'"""
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+
+
 async def get_ndvi_timeseries(lat, lon, start_date, end_date):
     """
     Получение временного ряда NDVI из MODIS
@@ -44,8 +105,6 @@ async def get_ndvi_timeseries(lat, lon, start_date, end_date):
     Returns:
         Список словарей с NDVI данными
     """
-    initialize_earth_engine()
-
     # Преобразование дат
     if isinstance(start_date, str):
         start_date = datetime.strptime(start_date, '%Y-%m-%d')
@@ -55,6 +114,13 @@ async def get_ndvi_timeseries(lat, lon, start_date, end_date):
     start_date_str = start_date.strftime('%Y-%m-%d')
     end_date_str = end_date.strftime('%Y-%m-%d')
 
+    cache_path = _ee_cache_path('ndvi', lat, lon, start_date_str, end_date_str)
+    cached = _ee_cache_load(cache_path)
+    if cached is not None:
+        return cached
+
+    initialize_earth_engine()
+
     try:
         # Создание точки для анализа
         point = ee.Geometry.Point([lon, lat])
@@ -64,44 +130,25 @@ async def get_ndvi_timeseries(lat, lon, start_date, end_date):
             .filterDate(start_date_str, end_date_str) \
             .filterBounds(point)
 
-        def extract_ndvi(image):
-            """Извлечение NDVI для точки"""
-            ndvi = image.select('NDVI').multiply(0.0001)  # Scale factor
-            evi = image.select('EVI').multiply(0.0001)
-
-            # Редукция к одной точке
-            stats = ndvi.reduceRegion(
-                reducer=ee.Reducer.mean(),
-                geometry=point,
-                scale=250
-            )
-
-            evi_stats = evi.reduceRegion(
-                reducer=ee.Reducer.mean(),
-                geometry=point,
-                scale=250
-            )
-
-            return ee.Feature(None, {
-                'ndvi': stats.get('NDVI'),
-                'evi': evi_stats.get('EVI'),
-                'date': image.date().format('YYYY-MM-dd')
-            })
-
-        # Применение функции ко всем изображениям
-        ndvi_series = collection.map(extract_ndvi).getInfo()
+        # Плоская таблица значений в точке вместо reduceRegion по каждому изображению
+        cols, rows = await asyncio.to_thread(_get_region_rows, collection.select(['NDVI', 'EVI']), point, 250)
+        # Масштабный коэффициент MODIS (0.0001) применяется один раз ко всей колонке
+        ndvi = _scaled_column(rows, cols['NDVI'], 0.0001)
+        evi = _scaled_column(rows, cols['EVI'], 0.0001)
 
         # Обработка результатов
         results = []
-        for feature in ndvi_series['features']:
-            props = feature['properties']
-            if props['ndvi'] is not None:  # Пропускаем пустые значения
+        for row, n, e in zip(rows, ndvi, evi):
+            if not np.isnan(n):  # Пропускаем пустые значения
                 results.append({
-                    'date': props['date'],
-                    'ndvi': float(props['ndvi']),
-                    'evi': float(props['evi']) if props['evi'] is not None else None
+                    'date': _ms_to_date(row[cols['time']]),
+                    'ndvi': float(n),
+                    'evi': _none_if_nan(e)
                 })
 
+        if results:
+            _ee_cache_save(cache_path, results)
+
         print(f"Получено {len(results)} значений NDVI")
         return results
 
@@ -131,8 +178,6 @@ async def get_sentinel2_ndvi(lat, lon, start_date, end_date, cloud_threshold=20)
     Returns:
         Список словарей с NDVI данными
     """
-    initialize_earth_engine()
-
     # Преобразование дат
     if isinstance(start_date, str):
         start_date = datetime.strptime(start_date, '%Y-%m-%d')
@@ -142,6 +187,13 @@ async def get_sentinel2_ndvi(lat, lon, start_date, end_date, cloud_threshold=20)
     start_date_str = start_date.strftime('%Y-%m-%d')
     end_date_str = end_date.strftime('%Y-%m-%d')
 
+    cache_path = _ee_cache_path('s2ndvi', lat, lon, start_date_str, end_date_str, cloud_threshold)
+    cached = _ee_cache_load(cache_path)
+    if cached is not None:
+        return cached
+
+    initialize_earth_engine()
+
     try:
         point = ee.Geometry.Point([lon, lat])
 
@@ -149,37 +201,31 @@ async def get_sentinel2_ndvi(lat, lon, start_date, end_date, cloud_threshold=20)
         collection = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED') \
             .filterDate(start_date_str, end_date_str) \
             .filterBounds(point) \
-            .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', cloud_threshold))
+            .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', cloud_threshold)) \
+            .select(['B4', 'B8'])  # Только каналы для NDVI (свойства сцены сохраняются)
 
         def calculate_ndvi(image):
-            """Расчет NDVI для Sentinel-2"""
-            # NDVI = (NIR - Red) / (NIR + Red)
+            """NDVI = (NIR - Red) / (NIR + Red) и облачность сцены отдельным каналом"""
             ndvi = image.normalizedDifference(['B8', 'B4']).rename('NDVI')
+            clouds = ee.Image.constant(image.get('CLOUDY_PIXEL_PERCENTAGE')).toFloat().rename('clouds')
+            return ndvi.addBands(clouds).copyProperties(image, ['system:time_start'])
 
-            stats = ndvi.reduceRegion(
-                reducer=ee.Reducer.mean(),
-                geometry=point,
-                scale=10
-            )
-
-            return ee.Feature(None, {
-                'ndvi': stats.get('NDVI'),
-                'date': image.date().format('YYYY-MM-dd'),
-                'clouds': image.get('CLOUDY_PIXEL_PERCENTAGE')
-            })
-
-        ndvi_series = collection.map(calculate_ndvi).getInfo()
+        # Одна плоская таблица по всем сценам вместо reduceRegion для каждой
+        cols, rows = await asyncio.to_thread(_get_region_rows, collection.map(calculate_ndvi), point, 10)
+        i_time, i_ndvi, i_clouds = cols['time'], cols['NDVI'], cols['clouds']
 
         results = []
-        for feature in ndvi_series['features']:
-            props = feature['properties']
-            if props['ndvi'] is not None:
+        for row in rows:
+            if row[i_ndvi] is not None:
                 results.append({
-                    'date': props['date'],
-                    'ndvi': float(props['ndvi']),
-                    'cloud_cover': float(props['clouds'])
+                    'date': _ms_to_date(row[i_time]),
+                    'ndvi': float(row[i_ndvi]),
+                    'cloud_cover': float(row[i_clouds])
                 })
 
+        if results:
+            _ee_cache_save(cache_path, results)
+
         print(f"Получено {len(results)} значений NDVI из Sentinel-2")
         return results
 
@@ -207,8 +253,6 @@ async def get_lai_data(lat, lon, start_date, end_date):
     Returns:
         Список словарей с LAI данными
     """
-    initialize_earth_engine()
-
     # Преобразование дат
     if isinstance(start_date, str):
         start_date = datetime.strptime(start_date, '%Y-%m-%d')
@@ -218,6 +262,13 @@ async def get_lai_data(lat, lon, start_date, end_date):
     start_date_str = start_date.strftime('%Y-%m-%d')
     end_date_str = end_date.strftime('%Y-%m-%d')
 
+    cache_path = _ee_cache_path('lai', lat, lon, start_date_str, end_date_str)
+    cached = _ee_cache_load(cache_path)
+    if cached is not None:
+        return cached
+
+    initialize_earth_engine()
+
     try:
         point = ee.Geometry.Point([lon, lat])
 
@@ -226,41 +277,24 @@ async def get_lai_data(lat, lon, start_date, end_date):
             .filterDate(start_date_str, end_date_str) \
             .filterBounds(point)
 
-        def extract_lai(image):
-            """Извлечение LAI"""
-            lai = image.select('Lai').multiply(0.1)  # Scale factor
-            fpar = image.select('Fpar').multiply(0.01)  # Scale factor
-
-            lai_stats = lai.reduceRegion(
-                reducer=ee.Reducer.mean(),
-                geometry=point,
-                scale=500
-            )
-
-            fpar_stats = fpar.reduceRegion(
-                reducer=ee.Reducer.mean(),
-                geometry=point,
-                scale=500
-            )
-
-            return ee.Feature(None, {
-                'lai': lai_stats.get('Lai'),
-                'fpar': fpar_stats.get('Fpar'),
-                'date': image.date().format('YYYY-MM-dd')
-            })
-
-        lai_series = collection.map(extract_lai).getInfo()
+        # Плоская таблица значений в точке одним запросом
+        cols, rows = await asyncio.to_thread(_get_region_rows, collection.select(['Lai', 'Fpar']), point, 500)
+        # Масштабные коэффициенты MCD15A2H (Lai × 0.1, Fpar × 0.01) — один раз на колонку
+        lai = _scaled_column(rows, cols['Lai'], 0.1)
+        fpar = _scaled_column(rows, cols['Fpar'], 0.01)
 
         results = []
-        for feature in lai_series['features']:
-            props = feature['properties']
-            if props['lai'] is not None:
+        for row, l, f in zip(rows, lai, fpar):
+            if not np.isnan(l):
                 results.append({
-                    'date': props['date'],
-                    'lai': float(props['lai']),
-                    'fpar': float(props['fpar']) if props['fpar'] is not None else None
+                    'date': _ms_to_date(row[cols['time']]),
+                    'lai': float(l),
+                    'fpar': _none_if_nan(f)
                 })
 
+        if results:
+            _ee_cache_save(cache_path, results)
+
         print(f"Получено {len(results)} значений LAI")
         return results
 
@@ -271,6 +305,20 @@ async def get_lai_data(lat, lon, start_date, end_date):
         return []
 
 
+def _linear_slope(y):
+    """
+    Наклон линейного тренда по индексу наблюдения (МНК в замкнутой форме)
+
+    Эквивалент np.polyfit(range(n), y, 1)[0] без вызова LAPACK
+    """
+    x = np.arange(len(y), dtype=float)
+    dx = x - x.mean()
+    denom = (dx * dx).sum()
+    if denom == 0:
+        return 0.0
+    return float((dx * (y - y.mean())).sum() / denom)
+
+
 async def get_satellite_summary(lat, lon, start_date, end_date):
     """
     Получение сводки спутниковых данных
@@ -286,34 +334,36 @@ async def get_satellite_summary(lat, lon, start_date, end_date):
     Returns:
         Словарь со статистикой
     """
-    # Получение данных
-    ndvi_data = await get_ndvi_timeseries(lat, lon, start_date, end_date)
-    lai_data = await get_lai_data(lat, lon, start_date, end_date)
+    # Получение данных: запросы к Earth Engine независимы и выполняются параллельно
+    ndvi_data, lai_data = await asyncio.gather(
+        get_ndvi_timeseries(lat, lon, start_date, end_date),
+        get_lai_data(lat, lon, start_date, end_date),
+    )
 
     if not ndvi_data:
         print("Предупреждение: NDVI данные недоступны")
         return None
 
-    # Преобразование в DataFrame для анализа
-    df_ndvi = pd.DataFrame(ndvi_data)
-    df_lai = pd.DataFrame(lai_data) if lai_data else None
+    # Типизированные массивы значений для статистики (без промежуточного DataFrame)
+    ndvi = np.fromiter((r['ndvi'] for r in ndvi_data), dtype=np.float64, count=len(ndvi_data))
 
     # Статистика NDVI
     ndvi_stats = {
-        'ndvi_mean': float(df_ndvi['ndvi'].mean()),
-        'ndvi_max': float(df_ndvi['ndvi'].max()),
-        'ndvi_min': float(df_ndvi['ndvi'].min()),
-        'ndvi_std': float(df_ndvi['ndvi'].std()),
-        'ndvi_trend': float(np.polyfit(range(len(df_ndvi)), df_ndvi['ndvi'], 1)[0]),
+        'ndvi_mean': float(ndvi.mean()),
+        'ndvi_max': float(ndvi.max()),
+        'ndvi_min': float(ndvi.min()),
+        'ndvi_std': float(ndvi.std(ddof=1)) if len(ndvi) > 1 else float('nan'),
+        'ndvi_trend': _linear_slope(ndvi),
         'ndvi_timeseries': ndvi_data
     }
 
     # Статистика LAI
-    if df_lai is not None and len(df_lai) > 0:
+    if lai_data:
+        lai = np.fromiter((r['lai'] for r in lai_data), dtype=np.float64, count=len(lai_data))
         lai_stats = {
-            'lai_mean': float(df_lai['lai'].mean()),
-            'lai_max': float(df_lai['lai'].max()),
-            'lai_min': float(df_lai['lai'].min()),
+            'lai_mean': float(lai.mean()),
+            'lai_max': float(lai.max()),
+            'lai_min': float(lai.min()),
             'lai_timeseries': lai_data
         }
     else:
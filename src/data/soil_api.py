@@ -4,7 +4,107 @@
 """
 import aiohttp
 import asyncio
+import json
+import logging
 import numpy as np
+from bisect import bisect_right
+from datetime import timedelta
+from functools import lru_cache
+from operator import mul
+from typing import Optional
+
+try:
+    from math import sumprod  # Python 3.12+
+except ImportError:
+    def sumprod(p, q):
+        return sum(map(mul, p, q))
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to stdlib json
+    orjson = None
+
+from src.database import get_db, on_shared_loop
+from src.database.crud import get_soil_cache, save_soil_cache
+
+logger = logging.getLogger(__name__)
+
+
+# Кэш профилей в БД: почвенные свойства практически не меняются,
+# сетка ~110 м (координаты округляются до 3 знаков)
+SOIL_CACHE_PRECISION = 3
+SOIL_CACHE_MAX_AGE = timedelta(days=365)
+
+# Не больше стольких одновременных запросов к SoilGrids (пакетная загрузка)
+SOILGRIDS_MAX_CONCURRENCY = 8
+
+# Общая HTTP-сессия SoilGrids: пул соединений и keep-alive между запросами.
+# Сессия привязана к циклу событий, в котором создана, поэтому запоминаем и его.
+_session: Optional[aiohttp.ClientSession] = None
+_session_loop = None
+
+
+async def _get_session():
+    """Возвращает общую сессию, создавая её при первом вызове (или в новом цикле событий)"""
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        _session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=30),
+            # Один хост (rest.isric.org): DNS кэшируется на час, соединения живут
+            # между редкими запросами, закрытые сервером TLS-сокеты вычищаются
+            connector=aiohttp.TCPConnector(
+                limit=16, limit_per_host=SOILGRIDS_MAX_CONCURRENCY,
+                use_dns_cache=True, ttl_dns_cache=3600,
+                keepalive_timeout=75.0, enable_cleanup_closed=True,
+            ),
+        )
+        _session_loop = loop
+    return _session
+
+
+async def close_soil_session():
+    """Закрывает общую сессию SoilGrids (вызывать при остановке бота)"""
+    global _session, _session_loop
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    _session_loop = None
+
+
+# Пул соединений БД привязан к общему циклу (src.database.get_loop), а
+# fetch_soilgrids_data могут вызвать из любого цикла — обращения к кэшу
+# переносятся на общий цикл.
+@on_shared_loop
+async def _load_cached_profile(lat_key, lon_key):
+    """Профиль из кэша в БД или None (промах, БД не инициализирована или недоступна)"""
+    db = get_db()
+    if db is None:
+        return None
+    try:
+        async with db.get_session() as session:
+            return await get_soil_cache(session, lat_key, lon_key, SOIL_CACHE_MAX_AGE)
+    except Exception as e:
+        logger.warning("Ошибка чтения кэша SoilGrids: %s", e)
+        return None
+
+
+@on_shared_loop
+async def _store_cached_profile(lat_key, lon_key, soil_profile):
+    """Сохраняет профиль в кэш; ошибки записи не критичны"""
+    db = get_db()
+    if db is None:
+        return
+    try:
+        async with db.get_session() as session:
+            await save_soil_cache(session, lat_key, lon_key, soil_profile)
+    except Exception as e:
+        logger.warning("Ошибка записи кэша SoilGrids: %s", e)
 
 
 async def fetch_soilgrids_data(lat, lon):
@@ -35,35 +135,106 @@ async def fetch_soilgrids_data(lat, lon):
         'value': 'mean'
     }
 
+    lat_key = round(lat, SOIL_CACHE_PRECISION)
+    lon_key = round(lon, SOIL_CACHE_PRECISION)
+    cached = await _load_cached_profile(lat_key, lon_key)
+    if cached is not None:
+        return cached
+
     try:
-        async with aiohttp.ClientSession() as session:
-            # Формирование запроса
-            property_list = ','.join(params['property'])
-            depth_list = ','.join(params['depth'])
+        session = await _get_session()
 
-            url = f"{base_url}?lon={lon}&lat={lat}&property={property_list}&depth={depth_list}&value=mean"
+        # Формирование запроса
+        property_list = ','.join(params['property'])
+        depth_list = ','.join(params['depth'])
 
-            print(f"Запрос почвенных данных для координат {lat}, {lon}...")
+        url = f"{base_url}?lon={lon}&lat={lat}&property={property_list}&depth={depth_list}&value=mean"
 
-            async with session.get(url) as response:
-                if response.status != 200:
-                    print(f"Ошибка запроса SoilGrids: HTTP {response.status}")
-                    return None
+        logger.debug("Запрос почвенных данных для координат %s, %s...", lat, lon)
 
-                data = await response.json()
+        async with session.get(url) as response:
+            if response.status != 200:
+                logger.warning("Ошибка запроса SoilGrids: HTTP %s", response.status)
+                return None
 
-                # Обработка данных
-                soil_profile = process_soilgrids_response(data)
+            # Разбор тела одним вызовом orjson (stdlib json — если orjson не установлен)
+            raw = await response.read()
+            data = orjson.loads(raw) if orjson else json.loads(raw)
 
-                return soil_profile
+        # Обработка данных
+        soil_profile = process_soilgrids_response(data)
 
-    except Exception as e:
-        print(f"Ошибка при получении данных SoilGrids: {e}")
-        import traceback
-        traceback.print_exc()
+        if soil_profile is not None:
+            await _store_cached_profile(lat_key, lon_key, soil_profile)
+
+        return soil_profile
+
+    except Exception:
+        logger.exception("Ошибка при получении данных SoilGrids")
         return None
 
 
+async def fetch_soilgrids_batch(coords):
+    """
+    Почвенные профили для нескольких точек параллельно через общую сессию
+
+    Одновременно выполняется не больше SOILGRIDS_MAX_CONCURRENCY запросов.
+
+    Args:
+        coords: список пар (широта, долгота)
+
+    Returns:
+        Список профилей в порядке coords (None для точек с ошибкой)
+    """
+    semaphore = asyncio.Semaphore(SOILGRIDS_MAX_CONCURRENCY)
+
+    async def _fetch_one(lat, lon):
+        async with semaphore:
+            return await fetch_soilgrids_data(lat, lon)
+
+    return await asyncio.gather(*(_fetch_one(lat, lon) for lat, lon in coords))
+
+
+# Слои SoilGrids и их толщина (см) — веса для среднего по корнеобитаемому слою;
+# 100-200 см не учитывается по умолчанию
+_DEPTHS = ('0-5cm', '5-15cm', '15-30cm', '30-60cm', '60-100cm', '100-200cm')
+_WEIGHTS = (5, 10, 15, 30, 40, 0)
+_WEIGHTS_ARRAY = np.array(_WEIGHTS, dtype=np.float64)
+_DEPTH_INDEX = {depth: i for i, depth in enumerate(_DEPTHS)}
+
+# Свойства SoilGrids (строки матрицы значений) и делители перевода в итоговые единицы
+_PROPERTIES = ('clay', 'sand', 'silt', 'soc', 'nitrogen', 'phh2o', 'bdod')
+_PROPERTY_INDEX = {name: i for i, name in enumerate(_PROPERTIES)}
+_UNIT_DIVISORS = np.array([10.0, 10.0, 10.0, 10.0, 100.0, 10.0, 100.0])
+
+
+# ── Вычислительное ядро ─────────────────────────────────────────────────────
+# Взвешенные средние по строкам матрицы (свойство × глубина), NaN — нет слоя.
+# С numba — один компилируемый проход по матрице; без numba — эквивалент на NumPy.
+if njit is not None:
+    @njit(cache=True)
+    def _weighted_means_kernel(values, weights):
+        n_rows, n_cols = values.shape
+        out = np.empty(n_rows, dtype=np.float64)
+        for i in range(n_rows):
+            weighted_sum = 0.0
+            total_weight = 0.0
+            for j in range(n_cols):
+                v = values[i, j]
+                if not np.isnan(v):
+                    weighted_sum += v * weights[j]
+                    total_weight += weights[j]
+            out[i] = weighted_sum / total_weight if total_weight > 0 else np.nan
+        return out
+else:
+    def _weighted_means_kernel(values, weights):
+        present = ~np.isnan(values)
+        weighted_sum = np.where(present, values, 0.0) @ weights
+        total_weight = present @ weights
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(total_weight > 0, weighted_sum / total_weight, np.nan)
+
+
 def process_soilgrids_response(data):
     """
     Обработка ответа от SoilGrids API
@@ -77,13 +248,15 @@ def process_soilgrids_response(data):
     try:
         properties = data.get('properties', {}).get('layers', [])
 
-        # Словарь для хранения результатов
+        # Словарь для хранения результатов и матрица (свойство × глубина) для средних
         soil_params = {}
+        values = np.full((len(_PROPERTIES), len(_DEPTHS)), np.nan)
 
         # Обработка каждого параметра
         for prop in properties:
             prop_name = prop.get('name')
             depths = prop.get('depths', [])
+            row = _PROPERTY_INDEX.get(prop_name)
 
             values_by_depth = []
 
@@ -96,36 +269,21 @@ def process_soilgrids_response(data):
                         'depth': depth_label,
                         'value': value
                     })
+                    col = _DEPTH_INDEX.get(depth_label)
+                    if row is not None and col is not None:
+                        values[row, col] = value
 
             # Сохранение по слоям
             soil_params[prop_name] = values_by_depth
 
-        # Расчет средних значений для корнеобитаемого слоя 0-100 см
-        clay_0_100 = calculate_weighted_mean(soil_params.get('clay', []), max_depth='100-200cm')
-        sand_0_100 = calculate_weighted_mean(soil_params.get('sand', []), max_depth='100-200cm')
-        silt_0_100 = calculate_weighted_mean(soil_params.get('silt', []), max_depth='100-200cm')
-        soc_0_100 = calculate_weighted_mean(soil_params.get('soc', []), max_depth='100-200cm')
-        nitrogen_0_100 = calculate_weighted_mean(soil_params.get('nitrogen', []), max_depth='100-200cm')
-        ph_0_100 = calculate_weighted_mean(soil_params.get('phh2o', []), max_depth='100-200cm')
-        bdod_0_100 = calculate_weighted_mean(soil_params.get('bdod', []), max_depth='100-200cm')
-
-        # Конвертация единиц
-        # Clay, sand, silt: g/kg → %
-        clay_pct = clay_0_100 / 10 if clay_0_100 else None
-        sand_pct = sand_0_100 / 10 if sand_0_100 else None
-        silt_pct = silt_0_100 / 10 if silt_0_100 else None
+        # Средние для корнеобитаемого слоя 0-100 см по всем свойствам сразу
+        # и перевод единиц одним делением (g/kg → %, dg/kg → %, cg/kg → %, pH×10 → pH, cg/cm³ → g/cm³)
+        means = _weighted_means_kernel(values, _WEIGHTS_ARRAY) / _UNIT_DIVISORS
 
-        # SOC: dg/kg → %
-        soc_pct = soc_0_100 / 10 if soc_0_100 else None
-
-        # Nitrogen: cg/kg → %
-        nitrogen_pct = nitrogen_0_100 / 100 if nitrogen_0_100 else None
-
-        # pH: pH×10 → pH
-        ph = ph_0_100 / 10 if ph_0_100 else None
-
-        # Bulk density: cg/cm³ → g/cm³
-        bulk_density = bdod_0_100 / 100 if bdod_0_100 else None
+        # Отсутствующие (и нулевые, как и раньше) значения → None
+        clay_pct, sand_pct, silt_pct, soc_pct, nitrogen_pct, ph, bulk_density = (
+            float(m) if m and not np.isnan(m) else None for m in means
+        )
 
         # Классификация текстуры
         texture_class = classify_texture(clay_pct, sand_pct, silt_pct)
@@ -154,10 +312,8 @@ def process_soilgrids_response(data):
 
         return result
 
-    except Exception as e:
-        print(f"Ошибка обработки данных SoilGrids: {e}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("Ошибка обработки данных SoilGrids")
         return None
 
 
@@ -175,49 +331,19 @@ def calculate_weighted_mean(values_list, max_depth='100-200cm'):
     if not values_list:
         return None
 
-    # Веса для разных глубин (в см)
-    depth_weights = {
-        '0-5cm': 5,
-        '5-15cm': 10,
-        '15-30cm': 15,
-        '30-60cm': 30,
-        '60-100cm': 40,
-        '100-200cm': 0  # Не учитываем по умолчанию
-    }
-
-    total_weight = 0
-    weighted_sum = 0
-
-    for item in values_list:
-        depth = item['depth']
-        value = item['value']
-
-        if depth in depth_weights and value is not None:
-            weight = depth_weights[depth]
-            weighted_sum += value * weight
-            total_weight += weight
+    by_depth = {item['depth']: item['value'] for item in values_list}
+    values = [by_depth.get(depth) for depth in _DEPTHS]
 
+    total_weight = sum(w for v, w in zip(values, _WEIGHTS) if v is not None)
     if total_weight == 0:
         return None
 
+    weighted_sum = sumprod((v if v is not None else 0 for v in values), _WEIGHTS)
     return weighted_sum / total_weight
 
 
-def classify_texture(clay, sand, silt):
-    """
-    Классификация механического состава почвы по USDA
-
-    Args:
-        clay: содержание глины (%)
-        sand: содержание песка (%)
-        silt: содержание ила (%)
-
-    Returns:
-        Класс текстуры
-    """
-    if clay is None or sand is None or silt is None:
-        return 'unknown'
-
+def _classify_texture_rules(clay, sand, silt):
+    """Исходные правила упрощенной классификации USDA (используются для построения таблицы)"""
     # Упрощенная классификация USDA
     if clay >= 40:
         return 'heavy_clay'
@@ -248,29 +374,128 @@ def classify_texture(clay, sand, silt):
         return 'loam'
 
 
+# Пороговые значения правил по каждой фракции (%). Правила сравнивают фракции
+# только с этими порогами, поэтому класс однозначно определяется номерами
+# интервалов — таблица на 5×5×4 ячеек строится один раз при импорте
+_CLAY_BOUNDS = (18, 27, 35, 40)
+_SAND_BOUNDS = (45, 52, 70, 85)
+_SILT_BOUNDS = (15, 50, 80)
+
+
+def _bin_lower_edges(bounds):
+    """Нижние границы интервалов: 0 и каждый порог"""
+    return (0,) + bounds
+
+
+_TEXTURE_LUT = {
+    (i, j, k): _classify_texture_rules(c, s, t)
+    for i, c in enumerate(_bin_lower_edges(_CLAY_BOUNDS))
+    for j, s in enumerate(_bin_lower_edges(_SAND_BOUNDS))
+    for k, t in enumerate(_bin_lower_edges(_SILT_BOUNDS))
+}
+
+
+def classify_texture(clay, sand, silt):
+    """
+    Классификация механического состава почвы по USDA
+
+    Табличная: номер интервала каждой фракции (bisect по порогам) → класс.
+
+    Args:
+        clay: содержание глины (%)
+        sand: содержание песка (%)
+        silt: содержание ила (%)
+
+    Returns:
+        Класс текстуры
+    """
+    if clay is None or sand is None or silt is None:
+        return 'unknown'
+
+    key = (
+        bisect_right(_CLAY_BOUNDS, clay),
+        bisect_right(_SAND_BOUNDS, sand),
+        bisect_right(_SILT_BOUNDS, silt),
+    )
+    return _TEXTURE_LUT[key]
+
+
+# Русские названия классов текстуры
+_TEXTURE_NAMES_RU = {
+    'sand': 'Песок',
+    'loamy_sand': 'Супесь',
+    'sandy_loam': 'Легкий суглинок',
+    'sandy_clay_loam': 'Суглинок',
+    'loam': 'Средний суглинок',
+    'silt_loam': 'Пылеватый суглинок',
+    'silt': 'Пыль',
+    'clay_loam': 'Тяжелый суглинок',
+    'silty_clay_loam': 'Пылевато-глинистый суглинок',
+    'clay': 'Глина',
+    'heavy_clay': 'Тяжелая глина',
+    'unknown': 'Неопределено'
+}
+
+# Шкала pH: границы интервалов и (уровень, рекомендация) для каждого интервала
+_PH_BOUNDS = (5.5, 6.5, 7.5, 8.5)
+_PH_LEVELS = (
+    ('сильнокислая', 'Требуется известкование'),
+    ('слабокислая', 'Подходит для большинства культур'),
+    ('нейтральная', 'Оптимально'),
+    ('слабощелочная', 'Возможны проблемы с усвоением микроэлементов'),
+    ('сильнощелочная', 'Требуется гипсование'),
+)
+
+# Шкала гумуса (%): границы интервалов и (плодородие, рекомендация)
+_HUMUS_BOUNDS = (2, 4, 6)
+_FERTILITY_LEVELS = (
+    ('низкая', 'Необходимо внесение органических удобрений'),
+    ('средняя', 'Поддерживающее внесение органики'),
+    ('повышенная', 'Хорошая плодородность'),
+    ('высокая', 'Отличная плодородность'),
+)
+
+# Агрономическая оценка текстуры
+_TEXTURE_SUITABILITY = {
+    'sand': 'Легкая, требует частых поливов и подкормок',
+    'loamy_sand': 'Довольно легкая, хорошая аэрация',
+    'sandy_loam': 'Хорошая для большинства культур',
+    'loam': 'Оптимальная для земледелия',
+    'silt_loam': 'Хорошая влагоемкость',
+    'clay_loam': 'Хорошая, но может быть тяжелой в обработке',
+    'clay': 'Тяжелая, высокая влагоемкость',
+    'heavy_clay': 'Очень тяжелая, требует улучшения структуры'
+}
+
+
 def get_texture_name_ru(texture_class):
     """Получение русского названия текстуры"""
-    names = {
-        'sand': 'Песок',
-        'loamy_sand': 'Супесь',
-        'sandy_loam': 'Легкий суглинок',
-        'sandy_clay_loam': 'Суглинок',
-        'loam': 'Средний суглинок',
-        'silt_loam': 'Пылеватый суглинок',
-        'silt': 'Пыль',
-        'clay_loam': 'Тяжелый суглинок',
-        'silty_clay_loam': 'Пылевато-глинистый суглинок',
-        'clay': 'Глина',
-        'heavy_clay': 'Тяжелая глина',
-        'unknown': 'Неопределено'
-    }
-    return names.get(texture_class, texture_class)
+    return _TEXTURE_NAMES_RU.get(texture_class, texture_class)
+
+
+@lru_cache(maxsize=256)
+def _interpretation(ph_level, fertility_level, texture_class):
+    """Интерпретация по номерам интервалов pH/гумуса (None — нет данных) и классу текстуры"""
+    interpretation = {}
+
+    if ph_level is not None:
+        interpretation['ph_level'], interpretation['ph_recommendation'] = _PH_LEVELS[ph_level]
+
+    if fertility_level is not None:
+        interpretation['fertility'], interpretation['fertility_recommendation'] = _FERTILITY_LEVELS[fertility_level]
+
+    interpretation['texture_note'] = _TEXTURE_SUITABILITY.get(texture_class, 'Информация недоступна')
+
+    return interpretation
 
 
 def interpret_soil_properties(ph, soc, texture_class):
     """
     Интерпретация почвенных характеристик для агрономии
 
+    Результат зависит только от интервалов pH и гумуса, поэтому кэшируется
+    по номерам интервалов; вызывающему возвращается копия.
+
     Args:
         ph: кислотность почвы
         soc: содержание органического углерода (%)
@@ -279,58 +504,10 @@ def interpret_soil_properties(ph, soc, texture_class):
     Returns:
         Словарь с интерпретацией
     """
-    interpretation = {}
-
-    # Оценка pH
-    if ph is not None:
-        if ph < 5.5:
-            interpretation['ph_level'] = 'сильнокислая'
-            interpretation['ph_recommendation'] = 'Требуется известкование'
-        elif ph < 6.5:
-            interpretation['ph_level'] = 'слабокислая'
-            interpretation['ph_recommendation'] = 'Подходит для большинства культур'
-        elif ph < 7.5:
-            interpretation['ph_level'] = 'нейтральная'
-            interpretation['ph_recommendation'] = 'Оптимально'
-        elif ph < 8.5:
-            interpretation['ph_level'] = 'слабощелочная'
-            interpretation['ph_recommendation'] = 'Возможны проблемы с усвоением микроэлементов'
-        else:
-            interpretation['ph_level'] = 'сильнощелочная'
-            interpretation['ph_recommendation'] = 'Требуется гипсование'
-
-    # Оценка гумуса (органического вещества)
-    if soc is not None:
-        # Конвертация SOC в гумус (примерно ×1.724)
-        humus = soc * 1.724
-        if humus < 2:
-            interpretation['fertility'] = 'низкая'
-            interpretation['fertility_recommendation'] = 'Необходимо внесение органических удобрений'
-        elif humus < 4:
-            interpretation['fertility'] = 'средняя'
-            interpretation['fertility_recommendation'] = 'Поддерживающее внесение органики'
-        elif humus < 6:
-            interpretation['fertility'] = 'повышенная'
-            interpretation['fertility_recommendation'] = 'Хорошая плодородность'
-        else:
-            interpretation['fertility'] = 'высокая'
-            interpretation['fertility_recommendation'] = 'Отличная плодородность'
-
-    # Оценка текстуры
-    texture_suitability = {
-        'sand': 'Легкая, требует частых поливов и подкормок',
-        'loamy_sand': 'Довольно легкая, хорошая аэрация',
-        'sandy_loam': 'Хорошая для большинства культур',
-        'loam': 'Оптимальная для земледелия',
-        'silt_loam': 'Хорошая влагоемкость',
-        'clay_loam': 'Хорошая, но может быть тяжелой в обработке',
-        'clay': 'Тяжелая, высокая влагоемкость',
-        'heavy_clay': 'Очень тяжелая, требует улучшения структуры'
-    }
-
-    interpretation['texture_note'] = texture_suitability.get(texture_class, 'Информация недоступна')
-
-    return interpretation
+    ph_level = bisect_right(_PH_BOUNDS, ph) if ph is not None else None
+    # Конвертация SOC в гумус (примерно ×1.724)
+    fertility_level = bisect_right(_HUMUS_BOUNDS, soc * 1.724) if soc is not None else None
+    return dict(_interpretation(ph_level, fertility_level, texture_class))
 
 
 async def get_soil_nutrients_estimate(lat, lon, texture_data):
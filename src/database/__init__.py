@@ -1,22 +1,48 @@
+import asyncio
+import functools
+import threading
+from typing import Any, Coroutine, Optional
+
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
-from sqlalchemy.pool import NullPool
 
+from .migrations import migrate_coordinates_to_e6
 from .models import Base
 
+# All DB work runs on the single shared loop (see get_loop), so pooled asyncpg
+# connections are never used across event loops and can be kept alive between
+# calls instead of reconnecting (TCP + auth handshake) on every query.
+POOL_SIZE = 5
+POOL_MAX_OVERFLOW = 5
+POOL_RECYCLE_SECONDS = 1800
+
 
 class Database:
     def __init__(self, db_url: str):
-        self.engine = create_async_engine(db_url, poolclass=NullPool, echo=False)
+        self.engine = create_async_engine(
+            db_url,
+            pool_size=POOL_SIZE,
+            max_overflow=POOL_MAX_OVERFLOW,
+            pool_pre_ping=True,
+            pool_recycle=POOL_RECYCLE_SECONDS,
+            echo=False
+        )
         self.session_maker = async_sessionmaker(
             self.engine,
             class_=AsyncSession,
             expire_on_commit=False
         )
 
-    async def create_tables(self):
-        """Create all tables"""
+    async def create_tables(self) -> bool:
+        """
+        Create all tables, first upgrading a legacy users table in place.
+
+        Returns:
+            True if the legacy coordinate columns were migrated
+        """
         async with self.engine.begin() as conn:
+            migrated = await migrate_coordinates_to_e6(conn)
             await conn.run_sync(Base.metadata.create_all)
+        return migrated
 
     async def drop_tables(self):
         """Drop all tables"""
@@ -42,3 +68,44 @@ def init_db(db_url: str) -> Database:
     global db
     db = Database(db_url)
     return db
+
+
+# Shared event loop for all DB work, running in a background daemon thread.
+# telebot handlers run in worker threads, so coroutines are submitted with
+# run_coroutine_threadsafe instead of each caller creating its own loop.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Get the shared database event loop, starting it on first use"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="db-event-loop", daemon=True).start()
+            _loop = loop
+    return _loop
+
+
+def run_sync(coro: Coroutine[Any, Any, Any]) -> Any:
+    """Run a coroutine on the shared loop from synchronous code and wait for the result"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+
+def on_shared_loop(func):
+    """
+    Decorate a coroutine function so its body always runs on the shared loop.
+
+    Callers on any other event loop await the result via wrap_future, so
+    loop-bound resources (pooled asyncpg connections, aiohttp sessions) are
+    only ever touched from get_loop().
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = get_loop()
+        coro = func(*args, **kwargs)
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+    return wrapper
@@ -1,9 +1,54 @@
-from datetime import datetime
-from typing import Optional, Tuple
-from sqlalchemy import select
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import DateTime, func, select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .models import User
+from .models import SoilCache, User, from_e6, to_e6
+
+# Short-lived read-through cache of users by telegram_id: get_user/load_coordinates
+# run on every message, while rows change only through the writers below, which
+# refresh or drop the entry. TTL bounds staleness for writes from other processes.
+# All DB coroutines run on the single shared loop and the cache is never touched
+# across an await, so no lock is needed.
+USER_CACHE_TTL = 60
+USER_CACHE_MAXSIZE = 10000
+
+_user_cache: "OrderedDict[int, Tuple[float, Optional[User]]]" = OrderedDict()
+
+
+def _user_cache_get(telegram_id: int):
+    """Return (True, user) on a fresh hit (user may be None), (False, None) otherwise."""
+    entry = _user_cache.get(telegram_id)
+    if entry is None:
+        return False, None
+    if entry[0] <= time.monotonic():
+        del _user_cache[telegram_id]
+        return False, None
+    _user_cache.move_to_end(telegram_id)
+    return True, entry[1]
+
+
+def _user_cache_put(telegram_id: int, user: Optional[User]) -> None:
+    _user_cache[telegram_id] = (time.monotonic() + USER_CACHE_TTL, user)
+    _user_cache.move_to_end(telegram_id)
+    if len(_user_cache) > USER_CACHE_MAXSIZE:
+        _user_cache.popitem(last=False)
+
+
+def invalidate_user_cache(telegram_id: Optional[int] = None) -> None:
+    """Drop one cached user (or all of them when telegram_id is None)."""
+    if telegram_id is None:
+        _user_cache.clear()
+    else:
+        _user_cache.pop(telegram_id, None)
+
+
+def _db_utc_now():
+    """SQL expression for the current UTC time on the database clock."""
+    return func.timezone('utc', func.now(), type_=DateTime)
 
 
 async def get_or_create_user(
@@ -37,7 +82,6 @@ async def get_or_create_user(
         )
         session.add(user)
         await session.commit()
-        await session.refresh(user)
     else:
         # Update username and first_name if changed
         needs_update = False
@@ -52,8 +96,8 @@ async def get_or_create_user(
 
         if needs_update:
             await session.commit()
-            await session.refresh(user)
 
+    _user_cache_put(telegram_id, user)
     return user
 
 
@@ -68,6 +112,10 @@ async def save_coordinates(
     """
     Save or update user coordinates.
 
+    Issues a single INSERT ... ON CONFLICT (telegram_id) DO UPDATE ... RETURNING
+    instead of a SELECT (get_or_create_user) followed by an UPDATE. Username and
+    first name are only overwritten when a new non-empty value is provided.
+
     Args:
         session: Database session
         telegram_id: Telegram user ID
@@ -79,20 +127,80 @@ async def save_coordinates(
     Returns:
         Updated User object
     """
-    # Get or create user
-    user = await get_or_create_user(session, telegram_id, username, first_name)
-
-    # Update coordinates
-    user.latitude = latitude
-    user.longitude = longitude
-    user.updated_at = datetime.utcnow()
+    stmt = insert(User).values(
+        telegram_id=telegram_id,
+        username=username,
+        first_name=first_name,
+        latitude_e6=to_e6(latitude),
+        longitude_e6=to_e6(longitude),
+        updated_at=_db_utc_now()
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.telegram_id],
+        set_={
+            "latitude_e6": stmt.excluded.latitude_e6,
+            "longitude_e6": stmt.excluded.longitude_e6,
+            "updated_at": _db_utc_now(),
+            "username": func.coalesce(func.nullif(stmt.excluded.username, ''), User.username),
+            "first_name": func.coalesce(func.nullif(stmt.excluded.first_name, ''), User.first_name),
+        }
+    ).returning(User)
 
+    result = await session.execute(stmt, execution_options={"populate_existing": True})
+    user = result.scalar_one()
     await session.commit()
-    await session.refresh(user)
+    _user_cache_put(telegram_id, user)
 
     return user
 
 
+async def bulk_save_coordinates(
+    session: AsyncSession,
+    rows: List[Dict]
+) -> int:
+    """
+    Save or update coordinates for many users in one statement.
+
+    Issues one executemany INSERT ... ON CONFLICT (telegram_id) DO UPDATE
+    (batched by SQLAlchemy's insertmanyvalues) and commits once, instead of a
+    SELECT + UPDATE round-trip per user.
+
+    Args:
+        session: Database session
+        rows: List of dicts with keys telegram_id, latitude, longitude
+
+    Returns:
+        Number of rows written
+    """
+    if not rows:
+        return 0
+
+    # Timestamps come from the database clock, rendered inline for every row
+    stmt = insert(User).values(created_at=_db_utc_now(), updated_at=_db_utc_now())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.telegram_id],
+        set_={
+            "latitude_e6": stmt.excluded.latitude_e6,
+            "longitude_e6": stmt.excluded.longitude_e6,
+            "updated_at": _db_utc_now(),
+        }
+    )
+    params = [
+        {
+            "telegram_id": row["telegram_id"],
+            "latitude_e6": to_e6(row["latitude"]),
+            "longitude_e6": to_e6(row["longitude"]),
+        }
+        for row in rows
+    ]
+    await session.execute(stmt, params)
+    await session.commit()
+    for row in rows:
+        invalidate_user_cache(row["telegram_id"])
+
+    return len(rows)
+
+
 async def load_coordinates(
     session: AsyncSession,
     telegram_id: int
@@ -107,13 +215,20 @@ async def load_coordinates(
     Returns:
         Tuple of (latitude, longitude) or None if not found
     """
+    hit, user = _user_cache_get(telegram_id)
+    if hit:
+        if user and user.latitude is not None and user.longitude is not None:
+            return (user.latitude, user.longitude)
+        return None
+
+    # Two-column Core SELECT: no full-row fetch and no ORM object hydration
     result = await session.execute(
-        select(User).where(User.telegram_id == telegram_id)
+        select(User.latitude_e6, User.longitude_e6).where(User.telegram_id == telegram_id)
     )
-    user = result.scalar_one_or_none()
+    row = result.first()
 
-    if user and user.latitude is not None and user.longitude is not None:
-        return (user.latitude, user.longitude)
+    if row and row.latitude_e6 is not None and row.longitude_e6 is not None:
+        return (from_e6(row.latitude_e6), from_e6(row.longitude_e6))
 
     return None
 
@@ -130,9 +245,69 @@ async def get_user(
         telegram_id: Telegram user ID
 
     Returns:
-        User object or None if not found
+        User object or None if not found (served from the TTL cache when fresh)
     """
+    hit, user = _user_cache_get(telegram_id)
+    if hit:
+        return user
+
     result = await session.execute(
         select(User).where(User.telegram_id == telegram_id)
     )
+    user = result.scalar_one_or_none()
+    _user_cache_put(telegram_id, user)
+    return user
+
+
+async def get_soil_cache(
+    session: AsyncSession,
+    lat_key: float,
+    lon_key: float,
+    max_age: timedelta
+) -> Optional[Dict]:
+    """
+    Get a cached SoilGrids payload if it is younger than max_age.
+
+    Args:
+        session: Database session
+        lat_key: Latitude rounded to the cache grid
+        lon_key: Longitude rounded to the cache grid
+        max_age: Maximum age of the cached entry
+
+    Returns:
+        Cached payload dict or None if missing/stale
+    """
+    result = await session.execute(
+        select(SoilCache.payload).where(
+            SoilCache.lat_key == lat_key,
+            SoilCache.lon_key == lon_key,
+            SoilCache.fetched_at > _db_utc_now() - max_age,
+        )
+    )
     return result.scalar_one_or_none()
+
+
+async def save_soil_cache(
+    session: AsyncSession,
+    lat_key: float,
+    lon_key: float,
+    payload: Dict
+) -> None:
+    """
+    Insert or refresh a cached SoilGrids payload in one statement.
+
+    Args:
+        session: Database session
+        lat_key: Latitude rounded to the cache grid
+        lon_key: Longitude rounded to the cache grid
+        payload: JSON-serializable soil profile
+    """
+    stmt = insert(SoilCache).values(
+        lat_key=lat_key, lon_key=lon_key, payload=payload, fetched_at=_db_utc_now()
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SoilCache.lat_key, SoilCache.lon_key],
+        set_={"payload": stmt.excluded.payload, "fetched_at": stmt.excluded.fetched_at}
+    )
+    await session.execute(stmt)
+    await session.commit()
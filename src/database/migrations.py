@@ -0,0 +1,45 @@
+"""
+Idempotent schema upgrades applied at startup before create_all.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .models import COORD_SCALE
+
+# users.latitude/longitude (double precision) -> users.latitude_e6/longitude_e6
+COORDINATES_E6_STATEMENTS = (
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS latitude_e6 INTEGER",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS longitude_e6 INTEGER",
+    f"UPDATE users SET latitude_e6 = round(latitude * {COORD_SCALE}), "
+    f"longitude_e6 = round(longitude * {COORD_SCALE}) "
+    "WHERE latitude IS NOT NULL OR longitude IS NOT NULL",
+    "ALTER TABLE users DROP COLUMN latitude",
+    "ALTER TABLE users DROP COLUMN longitude",
+)
+
+
+async def has_legacy_coordinate_columns(conn: AsyncConnection) -> bool:
+    """True if users still has the float latitude/longitude columns"""
+    result = await conn.execute(text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = 'users' "
+        "AND column_name IN ('latitude', 'longitude')"
+    ))
+    return bool(result.fetchall())
+
+
+async def migrate_coordinates_to_e6(conn: AsyncConnection) -> bool:
+    """
+    Convert legacy float coordinate columns to integer micro-degrees.
+
+    Runs inside the caller's transaction; a table that is already migrated
+    (or does not exist yet) is left untouched.
+
+    Returns:
+        True if the migration was applied
+    """
+    if not await has_legacy_coordinate_columns(conn):
+        return False
+    for statement in COORDINATES_E6_STATEMENTS:
+        await conn.execute(text(statement))
+    return True
@@ -1,8 +1,22 @@
 from datetime import datetime
-from sqlalchemy import BigInteger, DateTime, Float, Integer, String
+from sqlalchemy import JSON, BigInteger, DateTime, Float, Index, Integer, String, func
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 from typing import Optional
 
+# Coordinates are stored as integers in units of 1e-6 degree
+COORD_SCALE = 1_000_000
+
+
+def to_e6(degrees: Optional[float]) -> Optional[int]:
+    """Degrees -> integer micro-degrees (None stays None)"""
+    return None if degrees is None else round(degrees * COORD_SCALE)
+
+
+def from_e6(micro_degrees: Optional[int]) -> Optional[float]:
+    """Integer micro-degrees -> degrees (None stays None)"""
+    return None if micro_degrees is None else micro_degrees / COORD_SCALE
+
 
 class Base(DeclarativeBase):
     pass
@@ -11,19 +25,76 @@ class Base(DeclarativeBase):
 class User(Base):
     """User model for storing user information and coordinates"""
     __tablename__ = "users"
+    __table_args__ = (
+        # Unique lookup index that also carries the coordinates, so
+        # load_coordinates is answered by an index-only scan (PostgreSQL INCLUDE)
+        Index(
+            "ix_users_telegram_id_coords", "telegram_id",
+            unique=True,
+            postgresql_include=["latitude_e6", "longitude_e6"]
+        ),
+    )
+    # Fetch server-generated columns (id, updated_at) with RETURNING on flush,
+    # so objects need no refresh() round-trip after commit
+    __mapper_args__ = {"eager_defaults": True}
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    telegram_id: Mapped[int] = mapped_column(BigInteger, unique=True, nullable=False, index=True)
+    telegram_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
     username: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     first_name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
 
-    # Coordinates
-    latitude: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
-    longitude: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    # Coordinates stored as integer micro-degrees (4 bytes, ~11 cm precision);
+    # use the latitude/longitude properties for degrees
+    latitude_e6: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    longitude_e6: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
     # Timestamps
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Timestamp is taken from the database clock (UTC), not computed in Python
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime,
+        server_default=func.timezone('utc', func.now()),
+        onupdate=func.timezone('utc', func.now())
+    )
+
+    @hybrid_property
+    def latitude(self) -> Optional[float]:
+        return from_e6(self.latitude_e6)
+
+    @latitude.inplace.setter
+    def _latitude_setter(self, value: Optional[float]) -> None:
+        self.latitude_e6 = to_e6(value)
+
+    @latitude.inplace.expression
+    @classmethod
+    def _latitude_expression(cls):
+        return cls.latitude_e6 / float(COORD_SCALE)
+
+    @hybrid_property
+    def longitude(self) -> Optional[float]:
+        return from_e6(self.longitude_e6)
+
+    @longitude.inplace.setter
+    def _longitude_setter(self, value: Optional[float]) -> None:
+        self.longitude_e6 = to_e6(value)
+
+    @longitude.inplace.expression
+    @classmethod
+    def _longitude_expression(cls):
+        return cls.longitude_e6 / float(COORD_SCALE)
 
     def __repr__(self):
         return f"<User(id={self.id}, telegram_id={self.telegram_id}, username={self.username})>"
+
+
+class SoilCache(Base):
+    """Cached SoilGrids profile for a ~110 m grid cell (coordinates rounded to 3 decimals)"""
+    __tablename__ = "soil_cache"
+
+    lat_key: Mapped[float] = mapped_column(Float, primary_key=True)
+    lon_key: Mapped[float] = mapped_column(Float, primary_key=True)
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False)
+    fetched_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<SoilCache(lat_key={self.lat_key}, lon_key={self.lon_key}, fetched_at={self.fetched_at})>"
@@ -2,9 +2,21 @@
 Модуль для расчета пригодности культур
 Включает матрицу зависимостей и алгоритм расчета рейтинга
 """
+import math
+from dataclasses import dataclass
+from functools import lru_cache
+from heapq import nlargest
+from operator import itemgetter
+from types import MappingProxyType
+
 import numpy as np
 import pandas as pd
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 
 # Матрица параметров культур (15 параметров)
 CROP_PARAMETERS = {
@@ -178,188 +190,516 @@ CROP_PARAMETERS = {
     }
 }
 
+# Параметры культур неизменяемы: frozenset дает O(1) проверку типа почвы,
+# read-only словари безопасно разделять между потоками и закэшированными результатами
+for _crop_name, _params in CROP_PARAMETERS.items():
+    _params['soil_type_pref'] = frozenset(_params['soil_type_pref'])
+    _params['T_opt_range'] = tuple(_params['T_opt_range'])
+    _params['gtk_opt_range'] = tuple(_params['gtk_opt_range'])
+    CROP_PARAMETERS[_crop_name] = MappingProxyType(_params)
+del _crop_name, _params
+
+
+# Struct-of-Arrays представление CROP_PARAMETERS: по одному массиву на параметр,
+# индекс в массиве — номер культуры в CROP_NAMES. Строится один раз при импорте
+CROP_NAMES = tuple(CROP_PARAMETERS)
+CROP_INDEX = {name: i for i, name in enumerate(CROP_NAMES)}
+
+
+def _param_array(key, pos=None):
+    """Массив float64 значений параметра key по всем культурам"""
+    values = [CROP_PARAMETERS[name][key] for name in CROP_NAMES]
+    if pos is not None:
+        values = [value[pos] for value in values]
+    return np.array(values, dtype=np.float64)
+
+
+T_OPT_MIN = _param_array('T_opt_range', 0)
+T_OPT_MAX = _param_array('T_opt_range', 1)
+PRECIP_MIN = _param_array('precip_min')
+PRECIP_OPT = _param_array('precip_opt')
+RADIATION_MIN = _param_array('radiation_min')
+SOIL_MOISTURE_MIN = _param_array('soil_moisture_min')
+GDD_REQ = _param_array('gdd_requirement')
+FROST_TOL = _param_array('frost_tolerance')
+
+# Маска предпочтительных типов почвы: тип -> bool[n_crops]
+SOIL_PREF_MASK = {
+    soil_type: np.array([soil_type in CROP_PARAMETERS[name]['soil_type_pref'] for name in CROP_NAMES])
+    for soil_type in sorted({s for params in CROP_PARAMETERS.values() for s in params['soil_type_pref']})
+}
+_NO_SOIL_PREF = np.zeros(len(CROP_NAMES), dtype=bool)
+
+# Веса для разных категорий параметров (порядок суммирования как в исходной формуле)
+SCORE_WEIGHTS = {
+    'temperature': 0.20,
+    'precipitation': 0.20,
+    'soil': 0.15,
+    'gdd': 0.15,
+    'moisture': 0.10,
+    'radiation': 0.10,
+    'frost': 0.10
+}
+SCORE_WEIGHTS_VEC = np.fromiter(SCORE_WEIGHTS.values(), dtype=np.float64, count=len(SCORE_WEIGHTS))
 
-def calculate_suitability_score(region_data, crop_name):
-    """
-    Расчет рейтинга пригодности культуры (0-100%)
 
-    Использует метод взвешенной оценки по 15 параметрам
+def _region_scalars(region_data):
+    """Скаляры региона, используемые в оценке (None — нет данных)"""
+    if 'precipitation_annual' in region_data or 'precipitation_sum' in region_data:
+        precipitation = region_data.get('precipitation_annual', region_data.get('precipitation_sum', 0))
+    else:
+        precipitation = None
+
+    return {
+        'temperature': region_data['temperature_avg'] if 'temperature_avg' in region_data else None,
+        'precipitation': precipitation,
+        'soil': region_data['soil_type'] if 'soil_type' in region_data else None,
+        'gdd': region_data['gdd'] if 'gdd' in region_data else None,
+        'moisture': region_data['soil_moisture'] if 'soil_moisture' in region_data else None,
+        'radiation': region_data['radiation_sum'] if 'radiation_sum' in region_data else None,
+        'frost': region_data['temperature_min_winter'] if 'temperature_min_winter' in region_data else None,
+    }
+
+
+# Шаги квантования признаков региона для ключа кэша: мелкий шум float
+# (0.49 vs 0.51 мм) не должен давать промах
+_REGION_QUANT_STEPS = {
+    'temperature': 0.5,
+    'precipitation': 10,
+    'soil': None,
+    'gdd': 50,
+    'moisture': 0.01,
+    'radiation': 10,
+    'frost': 0.5,
+}
+
+
+def _quantize(value, step):
+    """Округление значения до шага step (None и NaN не трогаем)"""
+    if value is None or step is None:
+        return value
+    value = float(value)
+    if not math.isfinite(value):
+        return value
+    return round(value / step) * step
+
+
+def _region_key(region_data):
+    """Хэшируемый ключ кэша из квантованных признаков региона"""
+    region = _region_scalars(region_data)
+    return tuple(_quantize(region[k], step) for k, step in _REGION_QUANT_STEPS.items())
+
+
+# Обратная ширина гауссианы осадков 1 / (0.3 * P_opt) — константа культуры
+_PRECIP_INV_SIGMA = 1.0 / (0.3 * PRECIP_OPT)
+
+# Таблица параметров культур для ядра оценки (строка — параметр, столбец — культура)
+_CROP_SOA = np.vstack([
+    T_OPT_MIN, T_OPT_MAX, PRECIP_MIN, PRECIP_OPT, GDD_REQ, SOIL_MOISTURE_MIN, RADIATION_MIN, FROST_TOL,
+    _PRECIP_INV_SIGMA
+])
+# Значения категорий при отсутствии данных
+_SCORE_DEFAULTS = np.array([0.5, 0.5, 0.5, 0.5, 0.7, 0.7, 0.8])
+
+
+def _score_batch(values, present, soil_pref, crops, defaults):
+    """
+    Оценки категорий для R регионов и всех культур (NumPy-трансляция)
 
     Args:
-        region_data: словарь с данными региона
-        crop_name: название культуры
+        values: значения признаков (7, R) в порядке SCORE_WEIGHTS
+        present: признак наличия данных (7, R)
+        soil_pref: подходит ли тип почвы региона культуре (R, n_crops)
+        crops: таблица параметров культур _CROP_SOA
+        defaults: оценки при отсутствии данных _SCORE_DEFAULTS
 
     Returns:
-        Словарь с оценкой пригодности и детализацией
+        Массив (7, R, n_crops)
     """
-    if crop_name not in CROP_PARAMETERS:
-        return None
+    t_opt_min, t_opt_max, p_min, p_opt, gdd_req, w_min, q_min, frost_tol, p_inv_sigma = crops[:, None, :]
+    values = values[:, :, None]
+    scores = np.empty((7,) + soil_pref.shape)
+
+    # 1. Температура: отклонение — выход за оптимальный диапазон (0 внутри)
+    T = values[0]
+    deviation = np.maximum(0, np.maximum(t_opt_min - T, T - t_opt_max))
+    scores[0] = np.fmax(0, 1 - deviation / 10)
+
+    # 2. Осадки: гауссова функция с пиком в P_opt, ниже минимума — линейно до 0.5
+    P = values[1]
+    z = (P - p_opt) * p_inv_sigma
+    scores[1] = np.where(P >= p_min, np.exp(-z * z), P / p_min * 0.5)
+
+    # 3. Тип почвы
+    scores[2] = np.where(soil_pref, 1.0, 0.5)
+
+    # 4. GDD
+    scores[3] = np.where(values[3] >= gdd_req, 1.0, values[3] / gdd_req)
+
+    # 5. Влага в почве
+    scores[4] = np.fmin(1.0, values[4] / w_min)
+
+    # 6. Радиация
+    scores[5] = np.where(values[5] >= q_min, 1.0, values[5] / q_min)
+
+    # 7. Морозостойкость
+    deviation = np.maximum(0, frost_tol - values[6])
+    scores[6] = np.fmax(0, 1 - deviation / 10)
+
+    return np.where(present[:, :, None], scores, defaults[:, None, None])
+
+
+# ── Вычислительное ядро ─────────────────────────────────────────────────────
+# values/present — скаляры региона в порядке SCORE_WEIGHTS и признак наличия данных,
+# soil_pref — подходит ли тип почвы каждой культуре. С numba — один цикл по
+# культурам без fastmath (NaN должен давать те же оценки, что max/min Python);
+# без numba — эквивалент на NumPy.
+if njit is not None:
+    @njit(cache=True)
+    def _score_kernel(values, present, soil_pref, crops, defaults):
+        n = crops.shape[1]
+        out = np.empty((7, n), dtype=np.float64)
+        for j in range(n):
+            for k in range(7):
+                out[k, j] = defaults[k]
+
+            # 1. Температура: отклонение — выход за оптимальный диапазон (0 внутри)
+            if present[0]:
+                T = values[0]
+                deviation = crops[0, j] - T
+                if T - crops[1, j] > deviation:
+                    deviation = T - crops[1, j]
+                if deviation < 0.0:
+                    deviation = 0.0
+                score = 1.0 - deviation / 10
+                out[0, j] = score if score > 0.0 else 0.0
+
+            # 2. Осадки: гауссова функция с пиком в P_opt, ниже минимума — линейно до 0.5
+            if present[1]:
+                P = values[1]
+                if P >= crops[2, j]:
+                    z = (P - crops[3, j]) * crops[8, j]
+                    out[1, j] = np.exp(-z * z)
+                else:
+                    out[1, j] = P / crops[2, j] * 0.5
+
+            # 3. Тип почвы
+            if present[2]:
+                out[2, j] = 1.0 if soil_pref[j] else 0.5
+
+            # 4. GDD
+            if present[3]:
+                out[3, j] = 1.0 if values[3] >= crops[4, j] else values[3] / crops[4, j]
+
+            # 5. Влага в почве
+            if present[4]:
+                ratio = values[4] / crops[5, j]
+                out[4, j] = ratio if ratio < 1.0 else 1.0
+
+            # 6. Радиация
+            if present[5]:
+                out[5, j] = 1.0 if values[5] >= crops[6, j] else values[5] / crops[6, j]
+
+            # 7. Морозостойкость
+            if present[6]:
+                deviation = crops[7, j] - values[6]
+                if deviation < 0.0:
+                    deviation = 0.0
+                score = 1.0 - deviation / 10
+                out[6, j] = score if score > 0.0 else 0.0
+        return out
+else:
+    def _score_kernel(values, present, soil_pref, crops, defaults):
+        return _score_batch(values[:, None], present[:, None], soil_pref[None, :], crops, defaults)[:, 0]
+
+
+def _score_matrix(region):
+    """
+    Оценки всех 7 категорий сразу для всех культур
 
-    crop_params = CROP_PARAMETERS[crop_name]
+    Returns:
+        Массив float64 формы (7, n_crops), строки в порядке SCORE_WEIGHTS
+    """
+    present = np.array([region[k] is not None for k in SCORE_WEIGHTS])
+    values = np.array([
+        float(region[k]) if region[k] is not None and k != 'soil' else 0.0
+        for k in SCORE_WEIGHTS
+    ])
+    soil_pref = SOIL_PREF_MASK.get(region['soil'], _NO_SOIL_PREF)
+    return _score_kernel(values, present, soil_pref, _CROP_SOA, _SCORE_DEFAULTS)
 
-    # Веса для разных категорий параметров
-    weights = {
-        'temperature': 0.20,
-        'precipitation': 0.20,
-        'soil': 0.15,
-        'gdd': 0.15,
-        'moisture': 0.10,
-        'radiation': 0.10,
-        'frost': 0.10
-    }
 
-    scores = {}
+def _final_scores(scores):
+    """Взвешенная сумма категорий в процентах для всех культур"""
+    return (SCORE_WEIGHTS_VEC @ scores) * 100
+
+
+def _score_details(region, crop_params):
+    """Текстовая детализация оценки одной культуры"""
     details = {}
 
-    # 1. Оценка температуры
-    if 'temperature_avg' in region_data:
-        T_avg = region_data['temperature_avg']
+    T = region['temperature']
+    if T is not None:
         T_opt_min, T_opt_max = crop_params['T_opt_range']
-
-        if T_opt_min <= T_avg <= T_opt_max:
-            scores['temperature'] = 1.0
-            details['temperature'] = f"Оптимальная ({T_avg:.1f}°C)"
+        deviation = max(T_opt_min - T, T - T_opt_max)
+        if deviation <= 0:
+            details['temperature'] = f"Оптимальная ({T:.1f}°C)"
         else:
-            deviation = min(abs(T_avg - T_opt_min), abs(T_avg - T_opt_max))
-            scores['temperature'] = max(0, 1 - deviation / 10)
             details['temperature'] = f"Отклонение от оптимума: {deviation:.1f}°C"
     else:
-        scores['temperature'] = 0.5
         details['temperature'] = "Нет данных"
 
-    # 2. Оценка осадков
-    if 'precipitation_annual' in region_data or 'precipitation_sum' in region_data:
-        P = region_data.get('precipitation_annual', region_data.get('precipitation_sum', 0))
-        P_opt = crop_params['precip_opt']
-        P_min = crop_params['precip_min']
-
-        if P >= P_min:
-            # Гауссова функция с пиком в P_opt
-            scores['precipitation'] = np.exp(-((P - P_opt) / (0.3 * P_opt))**2)
-            if P < P_min:
-                details['precipitation'] = f"Недостаточно ({P:.0f} < {P_min} мм)"
-            else:
-                details['precipitation'] = f"Подходит ({P:.0f} мм)"
+    P = region['precipitation']
+    if P is not None:
+        if P >= crop_params['precip_min']:
+            details['precipitation'] = f"Подходит ({P:.0f} мм)"
         else:
-            scores['precipitation'] = P / P_min * 0.5
             details['precipitation'] = f"Очень мало ({P:.0f} мм)"
     else:
-        scores['precipitation'] = 0.5
         details['precipitation'] = "Нет данных"
 
-    # 3. Оценка почвы
-    if 'soil_type' in region_data:
-        soil_type = region_data['soil_type']
+    soil_type = region['soil']
+    if soil_type is not None:
         if soil_type in crop_params['soil_type_pref']:
-            scores['soil'] = 1.0
             details['soil'] = f"Подходящий тип ({soil_type})"
         else:
-            scores['soil'] = 0.5
             details['soil'] = f"Не оптимальный тип ({soil_type})"
     else:
-        scores['soil'] = 0.5
         details['soil'] = "Нет данных"
 
-    # 4. Оценка GDD
-    if 'gdd' in region_data:
-        gdd_actual = region_data['gdd']
+    gdd = region['gdd']
+    if gdd is not None:
         gdd_required = crop_params['gdd_requirement']
-
-        if gdd_actual >= gdd_required:
-            scores['gdd'] = 1.0
-            details['gdd'] = f"Достаточно ({gdd_actual:.0f} >= {gdd_required})"
+        if gdd >= gdd_required:
+            details['gdd'] = f"Достаточно ({gdd:.0f} >= {gdd_required})"
         else:
-            scores['gdd'] = gdd_actual / gdd_required
-            details['gdd'] = f"Недостаточно ({gdd_actual:.0f} / {gdd_required})"
+            details['gdd'] = f"Недостаточно ({gdd:.0f} / {gdd_required})"
     else:
-        scores['gdd'] = 0.5
         details['gdd'] = "Нет данных"
 
-    # 5. Оценка влаги в почве
-    if 'soil_moisture' in region_data:
-        W = region_data['soil_moisture']
-        W_min = crop_params['soil_moisture_min']
-        scores['moisture'] = min(1.0, W / W_min)
-        details['moisture'] = f"Влага: {W:.2f} (мин: {W_min})"
+    W = region['moisture']
+    if W is not None:
+        details['moisture'] = f"Влага: {W:.2f} (мин: {crop_params['soil_moisture_min']})"
     else:
-        scores['moisture'] = 0.7  # Предполагаем среднее
         details['moisture'] = "Нет данных (принято 0.7)"
 
-    # 6. Оценка радиации
-    if 'radiation_sum' in region_data:
-        Q = region_data['radiation_sum']
+    Q = region['radiation']
+    if Q is not None:
         Q_min = crop_params['radiation_min']
         if Q >= Q_min:
-            scores['radiation'] = 1.0
             details['radiation'] = f"Достаточно ({Q:.0f} МДж/м²)"
         else:
-            scores['radiation'] = Q / Q_min
             details['radiation'] = f"Недостаточно ({Q:.0f} / {Q_min})"
     else:
-        scores['radiation'] = 0.7  # Предполагаем среднее
         details['radiation'] = "Нет данных"
 
-    # 7. Оценка морозостойкости
-    if 'temperature_min_winter' in region_data:
-        T_min = region_data['temperature_min_winter']
+    T_min = region['frost']
+    if T_min is not None:
         frost_tol = crop_params['frost_tolerance']
-
         if T_min >= frost_tol:
-            scores['frost'] = 1.0
             details['frost'] = f"Морозы не опасны ({T_min:.1f}°C >= {frost_tol}°C)"
         else:
-            deviation = abs(frost_tol - T_min)
-            scores['frost'] = max(0, 1 - deviation / 10)
             details['frost'] = f"Риск вымерзания ({T_min:.1f}°C < {frost_tol}°C)"
     else:
-        scores['frost'] = 0.8  # Предполагаем низкий риск
         details['frost'] = "Нет данных"
 
-    # Взвешенная сумма
-    final_score = sum(scores[k] * weights[k] for k in weights.keys())
-    final_score_percent = final_score * 100
-
-    # Интерпретация
-    if final_score_percent >= 80:
-        interpretation = "Высокая пригодность"
-    elif final_score_percent >= 60:
-        interpretation = "Хорошая пригодность"
-    elif final_score_percent >= 40:
-        interpretation = "Умеренная пригодность"
-    else:
-        interpretation = "Низкая пригодность"
+    return details
+
+
+def _interpret_score(score_percent):
+    """Словесная интерпретация рейтинга"""
+    if score_percent >= 80:
+        return "Высокая пригодность"
+    elif score_percent >= 60:
+        return "Хорошая пригодность"
+    elif score_percent >= 40:
+        return "Умеренная пригодность"
+    return "Низкая пригодность"
+
+
+@dataclass(frozen=True, slots=True)
+class SuitabilityResult:
+    """Неизменяемый результат оценки культуры — компактная форма для кэша"""
+    crop: str
+    crop_name_ru: str
+    suitability_score: float
+    interpretation: str
+    scores_breakdown: tuple  # ((категория, %), ...) в порядке SCORE_WEIGHTS
+    details: tuple  # ((категория, текст), ...)
+
+    def to_dict(self):
+        """Словарь в формате calculate_suitability_score (новый при каждом вызове)"""
+        return {
+            'crop': self.crop,
+            'crop_name_ru': self.crop_name_ru,
+            'suitability_score': self.suitability_score,
+            'interpretation': self.interpretation,
+            'scores_breakdown': dict(self.scores_breakdown),
+            'details': dict(self.details)
+        }
+
+
+def _suitability_result(i, region, scores, final_percent):
+    """SuitabilityResult для культуры с индексом i"""
+    crop_name = CROP_NAMES[i]
+    crop_params = CROP_PARAMETERS[crop_name]
+    return SuitabilityResult(
+        crop=crop_name,
+        crop_name_ru=crop_params['name_ru'],
+        suitability_score=round(float(final_percent[i]), 1),
+        interpretation=_interpret_score(final_percent[i]),
+        scores_breakdown=tuple((k, round(float(v) * 100, 1)) for k, v in zip(SCORE_WEIGHTS, scores[:, i])),
+        details=tuple(_score_details(region, crop_params).items())
+    )
 
-    return {
-        'crop': crop_name,
-        'crop_name_ru': crop_params['name_ru'],
-        'suitability_score': round(final_score_percent, 1),
-        'interpretation': interpretation,
-        'scores_breakdown': {k: round(v * 100, 1) for k, v in scores.items()},
-        'details': details
-    }
 
+def build_suitability_result(i, region, scores, final_percent):
+    """Словарь результата для культуры с индексом i (формат calculate_suitability_score)"""
+    return _suitability_result(i, region, scores, final_percent).to_dict()
+
+
+def score_all_crops(region_data):
+    """
+    Векторная оценка пригодности всех культур по квантованным признакам региона
+
+    Args:
+        region_data: словарь с данными региона
+
+    Returns:
+        Кортеж (region, scores, final_percent): скаляры региона, матрица оценок
+        (7, n_crops) по категориям SCORE_WEIGHTS и итоговые проценты по CROP_NAMES
+    """
+    region = dict(zip(_REGION_QUANT_STEPS, _region_key(region_data)))
+    scores = _score_matrix(region)
+    return region, scores, _final_scores(scores)
+
+
+def calculate_suitability_score(region_data, crop_name):
+    """
+    Расчет рейтинга пригодности культуры (0-100%)
+
+    Использует метод взвешенной оценки по 15 параметрам
+
+    Args:
+        region_data: словарь с данными региона
+        crop_name: название культуры
+
+    Returns:
+        Словарь с оценкой пригодности и детализацией
+    """
+    if crop_name not in CROP_INDEX:
+        return None
+
+    for result in _rank_crops_cached(_region_key(region_data), None):
+        if result.crop == crop_name:
+            return result.to_dict()
+
+
+@lru_cache(maxsize=4096)
+def _rank_crops_cached(key, n):
+    """Ранжирование по квантованному ключу региона (кортеж SuitabilityResult)"""
+    region = dict(zip(_REGION_QUANT_STEPS, key))
+    scores = _score_matrix(region)
+    final_percent = _final_scores(scores)
+
+    # Сортировка по убыванию округленного рейтинга; stable сохраняет порядок равных
+    rounded = np.array([round(float(score), 1) for score in final_percent])
+    order = np.argsort(-rounded, kind='stable')
+    if n is not None:
+        order = order[:n]
+
+    return tuple(_suitability_result(i, region, scores, final_percent) for i in order)
 
-def rank_crops(region_data):
+
+def rank_crops(region_data, n=None):
     """
     Ранжирование всех культур по пригодности
 
+    Оценки считаются векторно сразу для всех культур; словари результата
+    собираются только для возвращаемых культур. Результат кэшируется по
+    квантованным признакам региона (температура до 0.5°C, осадки до 10 мм,
+    GDD до 50 и т.д.), вызывающий получает независимую копию.
+
     Args:
         region_data: словарь с данными региона
+        n: количество лучших культур (None — все)
 
     Returns:
         Список культур, отсортированный по убыванию пригодности
     """
-    results = []
+    return [result.to_dict() for result in _rank_crops_cached(_region_key(region_data), n)]
+
+
+def clear_suitability_cache():
+    """Сброс кэша рейтингов пригодности"""
+    _rank_crops_cached.cache_clear()
 
-    for crop_name in CROP_PARAMETERS.keys():
-        suitability = calculate_suitability_score(region_data, crop_name)
-        if suitability:
-            results.append(suitability)
 
-    # Сортировка по убыванию рейтинга
-    results.sort(key=lambda x: x['suitability_score'], reverse=True)
+def cache_info():
+    """Статистика кэша рейтингов пригодности (hits, misses, maxsize, currsize)"""
+    return _rank_crops_cached.cache_info()
+
+
+# Столбцы таблицы регионов для rank_crops_batch (осадки — см. _region_scalars)
+_BATCH_COLUMNS = {
+    'temperature': 'temperature_avg',
+    'soil': 'soil_type',
+    'gdd': 'gdd',
+    'moisture': 'soil_moisture',
+    'radiation': 'radiation_sum',
+    'frost': 'temperature_min_winter',
+}
 
-    return results
+
+def _batch_column(region_df, column):
+    """Столбец как float64-массив; отсутствующий столбец — все NaN"""
+    if column not in region_df:
+        return np.full(len(region_df), np.nan)
+    return region_df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def rank_crops_batch(region_df):
+    """
+    Пригодность всех культур сразу для многих регионов
+
+    Каждый столбец таблицы — признак региона (как ключи region_data), строка —
+    регион; NaN означает отсутствие данных. Признаки квантуются так же, как в
+    rank_crops, поэтому строки результата — это suitability_score до округления.
+
+    Args:
+        region_df: pd.DataFrame с признаками регионов
+
+    Returns:
+        np.ndarray (R, n_crops) пригодности в % (столбцы — CROP_NAMES);
+        топ-N по региону: np.argsort(-result, axis=1, kind='stable')[:, :N]
+    """
+    n_regions = len(region_df)
+    values = np.zeros((len(SCORE_WEIGHTS), n_regions))
+    present = np.zeros((len(SCORE_WEIGHTS), n_regions), dtype=bool)
+
+    for row, (key, step) in enumerate(_REGION_QUANT_STEPS.items()):
+        if key == 'soil':
+            continue
+        if key == 'precipitation':
+            column = _batch_column(region_df, 'precipitation_annual')
+            column = np.where(np.isnan(column), _batch_column(region_df, 'precipitation_sum'), column)
+        else:
+            column = _batch_column(region_df, _BATCH_COLUMNS[key])
+        present[row] = ~np.isnan(column)
+        values[row] = np.where(present[row], np.round(column / step) * step, 0.0)
+
+    # Тип почвы: маски уникальных значений, код -1 (нет данных) попадает на _NO_SOIL_PREF
+    soil_row = list(SCORE_WEIGHTS).index('soil')
+    if 'soil_type' in region_df:
+        codes, uniques = pd.factorize(region_df['soil_type'])
+        masks = np.array([SOIL_PREF_MASK.get(soil, _NO_SOIL_PREF) for soil in uniques] + [_NO_SOIL_PREF])
+        soil_pref = masks[codes]
+        present[soil_row] = codes >= 0
+    else:
+        soil_pref = np.zeros((n_regions, len(CROP_NAMES)), dtype=bool)
+
+    scores = _score_batch(values, present, soil_pref, _CROP_SOA, _SCORE_DEFAULTS)
+    return np.tensordot(SCORE_WEIGHTS_VEC, scores, axes=1) * 100
 
 
 def get_top_n_crops(region_data, n=3):
@@ -373,8 +713,19 @@ def get_top_n_crops(region_data, n=3):
     Returns:
         Список топ-N культур
     """
-    ranked = rank_crops(region_data)
-    return ranked[:n]
+    return rank_crops(region_data, n)
+
+
+def _mean(values, default=np.nan):
+    """Среднее без накладных расходов NumPy для пустых и коротких последовательностей"""
+    n = len(values)
+    if n == 0:
+        return default
+    if n == 1:
+        return float(values[0])
+    if n == 2:
+        return (float(values[0]) + float(values[1])) / 2
+    return float(np.mean(values))
 
 
 def prepare_region_features(climate_data, soil_data, indices):
@@ -393,7 +744,7 @@ def prepare_region_features(climate_data, soil_data, indices):
 
     # Климатические параметры
     if climate_data:
-        region_data['temperature_avg'] = np.mean(climate_data.get('temperature_avg', []))
+        region_data['temperature_avg'] = _mean(climate_data.get('temperature_avg', []))
         region_data['temperature_max'] = climate_data.get('temperature_max', 30)
         region_data['temperature_min'] = climate_data.get('temperature_min', -20)
         region_data['temperature_min_winter'] = climate_data.get('temperature_min', -10)
@@ -444,23 +795,36 @@ def format_suitability_report(top_crops):
     """
     Форматирование отчета по пригодности культур
 
+    Отчет кэшируется по выводимым полям культур, повторные запросы того же
+    региона не пересобирают строку.
+
     Args:
         top_crops: список топ-культур
 
     Returns:
         Строка с форматированным отчетом
     """
+    key = tuple(
+        (crop['crop_name_ru'], crop['suitability_score'], crop['interpretation'],
+         tuple(crop['scores_breakdown'].items()))
+        for crop in top_crops
+    )
+    return _format_suitability_report_cached(key)
+
+
+@lru_cache(maxsize=1024)
+def _format_suitability_report_cached(key):
+    """Сборка отчета по кортежу (name_ru, score, interpretation, breakdown_items) на культуру"""
     report = []
 
     report.append("🌾 РЕЙТИНГ ПРИГОДНОСТИ КУЛЬТУР:\n")
 
-    for i, crop in enumerate(top_crops, 1):
-        report.append(f"{i}. {crop['crop_name_ru']}")
-        report.append(f"   📊 Пригодность: {crop['suitability_score']:.1f}% - {crop['interpretation']}")
+    for i, (crop_name_ru, suitability_score, interpretation, breakdown) in enumerate(key, 1):
+        report.append(f"{i}. {crop_name_ru}")
+        report.append(f"   📊 Пригодность: {suitability_score:.1f}% - {interpretation}")
 
         # Ключевые параметры
-        breakdown = crop['scores_breakdown']
-        top_params = sorted(breakdown.items(), key=lambda x: x[1], reverse=True)[:3]
+        top_params = nlargest(3, breakdown, key=itemgetter(1))
 
         report.append("   ✓ Сильные стороны:")
         for param, score in top_params:
@@ -2,6 +2,18 @@
 Модуль для расчета экономики и рисков выращивания культур
 """
 import numpy as np
+from functools import lru_cache
+from operator import mul
+from types import MappingProxyType
+
+from .crop_suitability import CROP_NAMES, CROP_PARAMETERS, FROST_TOL, build_suitability_result, score_all_crops
+from .indices import CROP_GDD_REQUIREMENTS
+
+try:
+    from math import sumprod  # Python 3.12+
+except ImportError:
+    def sumprod(p, q):
+        return sum(map(mul, p, q))
 
 
 # Региональные затраты на выращивание культур (₽/га)
@@ -108,6 +120,95 @@ AVERAGE_YIELDS = {
 }
 
 
+# Суммарные затраты по культурам — считаются один раз при импорте
+TOTAL_COSTS = {crop: sum(costs.values()) for crop, costs in REGIONAL_COSTS.items()}
+
+# Округленная структура затрат для отчета: общий read-only словарь на культуру
+_ROUNDED_COSTS = {
+    crop: MappingProxyType({k: round(v, 0) for k, v in costs.items()})
+    for crop, costs in REGIONAL_COSTS.items()
+}
+
+# Выровненные массивы показателей (индекс культуры — CROP_INDEX) для пакетных расчетов
+CROP_INDEX = {name: i for i, name in enumerate(REGIONAL_COSTS)}
+PRICES_ARR = np.array([MARKET_PRICES[crop] for crop in CROP_INDEX], dtype=np.float32)
+YIELDS_ARR = np.array([AVERAGE_YIELDS[crop] for crop in CROP_INDEX], dtype=np.float32)
+TOTAL_COSTS_ARR = np.array([TOTAL_COSTS[crop] for crop in CROP_INDEX], dtype=np.float32)
+
+
+# Ступенчатые шкалы: значение VALUES[np.searchsorted(THR, x, side)].
+# side='right' — граница относится к верхней ступени (x < thr -> нижняя),
+# nextafter переносит нестрогую границу (x <= thr) в ту же форму
+_GTK_FACTOR_THR = np.array([0.7, 1.0, np.nextafter(1.5, np.inf), np.nextafter(1.8, np.inf)])
+_GTK_FACTOR = np.array([0.8, 1.0, 1.1, 1.0, 0.9])  # засуха / норма / оптимум / норма / переувлажнение
+
+_GDD_FACTOR_THR = np.array([0.8, 0.9, 1.0])
+_GDD_FACTOR = np.array([0.7, 0.85, 0.95, 1.0])
+
+_SPI_FACTOR_THR = np.array([-1.5, -1.0, np.nextafter(1.5, np.inf)])
+_SPI_FACTOR = np.array([0.75, 0.9, 1.0, 0.95])  # сильная / умеренная засуха / норма / переувлажнение
+
+_SPI_THR = np.array([-2.0, -1.5, -1.0])
+_SPI_RISK = np.array([90, 60, 30, 10])
+
+# Порог заморозков задается смещением T_min относительно frost_tolerance культуры
+_FROST_OFFSET_THR = np.array([-5.0, 0.0, 2.0])
+_FROST_RISK = np.array([80, 50, 20, 5])
+
+_GTK_EXCESS_THR = np.array([1.6, 2.0])
+_GTK_EXCESS_RISK = np.array([10, 40, 70])  # side='left': gtk > порога
+
+_GDD_DEFICIT_THR = np.array([0.75, 0.9, 1.0])
+_GDD_DEFICIT_RISK = np.array([80, 50, 20, 5])
+
+
+def _step_lookup(thresholds, values, x, side='right'):
+    """Значение ступенчатой шкалы для x (скаляр или массив)"""
+    return values[np.searchsorted(thresholds, x, side=side)]
+
+
+def frost_risk(T_min, frost_tolerance):
+    """
+    Риск заморозков по минимальной температуре
+
+    Args:
+        T_min: минимальная температура (°C)
+        frost_tolerance: морозостойкость культуры (скаляр или массив по культурам)
+
+    Returns:
+        Оценка риска (0-100) той же формы, что frost_tolerance
+    """
+    return _step_lookup(_FROST_OFFSET_THR, _FROST_RISK, np.subtract(T_min, frost_tolerance))
+
+
+# Требования культур для пакетной оценки рисков, выровненные по CROP_NAMES
+# (NaN в GDD_REQ_ARR — для культуры нет требований по GDD)
+FROST_TOL_ARR = FROST_TOL
+GDD_REQ_ARR = np.array([
+    CROP_GDD_REQUIREMENTS[name]['total'] if name in CROP_GDD_REQUIREMENTS else np.nan
+    for name in CROP_NAMES
+])
+_GDD_REQ_KNOWN = ~np.isnan(GDD_REQ_ARR)
+
+
+def _index_values(indices):
+    """ГТК, накопленные GDD и последний SPI из индексов (None — нет данных)"""
+    gtk_data = indices.get('gtk')
+    gdd_data = indices.get('gdd')
+    spi_data = indices.get('spi')
+    gtk = gtk_data.get('gtk', 1.0) if gtk_data else None
+    total_gdd = gdd_data.get('total_gdd', 0) if gdd_data else None
+    spi = spi_data.get('latest_spi') if spi_data else None
+    return gtk, total_gdd, spi
+
+
+def _gdd_ratio_arr(total_gdd):
+    """Отношение накопленных GDD к требованию по всем культурам (None — нет данных)"""
+    if total_gdd is None:
+        return None
+    return total_gdd / np.where(_GDD_REQ_KNOWN, GDD_REQ_ARR, 1.0)
+
+
 def estimate_yield(crop_name, suitability_score, indices):
     """
     Оценка потенциальной урожайности на основе пригодности
@@ -124,49 +225,26 @@ def estimate_yield(crop_name, suitability_score, indices):
         return None
 
     base_yield = AVERAGE_YIELDS[crop_name]
+    gtk, actual_gdd, spi = _index_values(indices)
 
     # Коэффициент пригодности (0.5 - 1.2)
     suitability_factor = 0.5 + (suitability_score / 100) * 0.7
 
     # Корректировка по ГТК (увлажнение)
     gtk_factor = 1.0
-    if indices.get('gtk'):
-        gtk = indices['gtk'].get('gtk', 1.0)
-        if 1.0 <= gtk <= 1.5:
-            gtk_factor = 1.1  # Оптимальное увлажнение, +10%
-        elif gtk < 0.7:
-            gtk_factor = 0.8  # Засуха, -20%
-        elif gtk > 1.8:
-            gtk_factor = 0.9  # Переувлажнение, -10%
+    if gtk is not None:
+        gtk_factor = float(_step_lookup(_GTK_FACTOR_THR, _GTK_FACTOR, gtk))
 
     # Корректировка по GDD
     gdd_factor = 1.0
-    if indices.get('gdd'):
-        from .indices import CROP_GDD_REQUIREMENTS
-        if crop_name in CROP_GDD_REQUIREMENTS:
-            required_gdd = CROP_GDD_REQUIREMENTS[crop_name]['total']
-            actual_gdd = indices['gdd'].get('total_gdd', 0)
-            gdd_ratio = actual_gdd / required_gdd
-
-            if gdd_ratio >= 1.0:
-                gdd_factor = 1.0
-            elif gdd_ratio >= 0.9:
-                gdd_factor = 0.95
-            elif gdd_ratio >= 0.8:
-                gdd_factor = 0.85
-            else:
-                gdd_factor = 0.7
+    if actual_gdd is not None and crop_name in CROP_GDD_REQUIREMENTS:
+        gdd_ratio = actual_gdd / CROP_GDD_REQUIREMENTS[crop_name]['total']
+        gdd_factor = float(_step_lookup(_GDD_FACTOR_THR, _GDD_FACTOR, gdd_ratio))
 
     # Корректировка по SPI (засуха)
     spi_factor = 1.0
-    if indices.get('spi') and indices['spi'].get('latest_spi') is not None:
-        spi = indices['spi']['latest_spi']
-        if spi < -1.5:
-            spi_factor = 0.75  # Сильная засуха, -25%
-        elif spi < -1.0:
-            spi_factor = 0.9  # Умеренная засуха, -10%
-        elif spi > 1.5:
-            spi_factor = 0.95  # Переувлажнение, -5%
+    if spi is not None:
+        spi_factor = float(_step_lookup(_SPI_FACTOR_THR, _SPI_FACTOR, spi))
 
     # Итоговая урожайность
     estimated_yield = base_yield * suitability_factor * gtk_factor * gdd_factor * spi_factor
@@ -190,8 +268,7 @@ def calculate_profitability(crop_name, yield_forecast, region='default'):
         return None
 
     # Затраты
-    costs = REGIONAL_COSTS[crop_name]
-    total_costs = sum(costs.values())
+    total_costs = TOTAL_COSTS[crop_name]
 
     # Цена реализации
     price_per_ton = MARKET_PRICES[crop_name]
@@ -215,7 +292,7 @@ def calculate_profitability(crop_name, yield_forecast, region='default'):
     return {
         'costs': {
             'total': round(total_costs, 0),
-            'breakdown': {k: round(v, 0) for k, v in costs.items()}
+            'breakdown': _ROUNDED_COSTS[crop_name]
         },
         'revenue': round(revenue, 0),
         'profit': round(profit, 0),
@@ -227,6 +304,53 @@ def calculate_profitability(crop_name, yield_forecast, region='default'):
     }
 
 
+def calculate_profitability_batch(yields):
+    """
+    Векторный расчет выручки, прибыли и ROI сразу для всех культур
+
+    Args:
+        yields: урожайности (ц/га), выровненные по CROP_INDEX
+
+    Returns:
+        Словарь массивов 'revenue', 'profit', 'roi_percent' (порядок CROP_INDEX);
+        точность float32, для float64-урожайностей — float64
+    """
+    yields = np.asarray(yields, dtype=np.result_type(yields, np.float32))
+    revenue = yields / 10 * PRICES_ARR
+    profit = revenue - TOTAL_COSTS_ARR
+    roi = profit / TOTAL_COSTS_ARR * 100
+    return {
+        'revenue': revenue,
+        'profit': profit,
+        'roi_percent': roi
+    }
+
+
+_RISK_WEIGHTS = {
+    'drought': 0.35,
+    'frost': 0.25,
+    'excess_moisture': 0.20,
+    'heat_deficit': 0.20
+}
+_RISK_WEIGHTS_VEC = np.fromiter(_RISK_WEIGHTS.values(), dtype=np.float64, count=len(_RISK_WEIGHTS))
+
+
+def _interpret_risk(total_risk):
+    """Интерпретация и рекомендация по суммарному риску"""
+    if total_risk < 20:
+        return "Низкий риск", "Условия благоприятные для выращивания"
+    elif total_risk < 40:
+        return "Умеренный риск", "Рекомендуется стандартная агротехника"
+    elif total_risk < 60:
+        return "Повышенный риск", "Требуются дополнительные меры защиты"
+    return "Высокий риск", "Рекомендуется рассмотреть альтернативные культуры"
+
+
+def _round_each(values):
+    """Поэлементный round(x, 1) как в скалярных функциях (без расхождений np.round)"""
+    return np.array([round(float(value), 1) for value in values])
+
+
 def assess_climate_risks(climate_data, indices, crop_name):
     """
     Оценка климатических рисков (0-100, где 100 = максимальный риск)
@@ -240,100 +364,47 @@ def assess_climate_risks(climate_data, indices, crop_name):
         Словарь с оценкой рисков
     """
     risk_scores = {}
+    gtk, actual_gdd, spi = _index_values(indices)
 
     # 1. Риск засухи (на основе SPI)
-    if indices.get('spi') and indices['spi'].get('latest_spi') is not None:
-        spi = indices['spi']['latest_spi']
-        if spi < -2.0:
-            risk_scores['drought'] = 90
-        elif spi < -1.5:
-            risk_scores['drought'] = 60
-        elif spi < -1.0:
-            risk_scores['drought'] = 30
-        else:
-            risk_scores['drought'] = 10
+    if spi is not None:
+        risk_scores['drought'] = int(_step_lookup(_SPI_THR, _SPI_RISK, spi))
     else:
         risk_scores['drought'] = 20  # Умеренный риск по умолчанию
 
     # 2. Риск заморозков
     if climate_data and 'temperature_min' in climate_data:
-        from .crop_suitability import CROP_PARAMETERS
-
         T_min = climate_data['temperature_min']
 
         if crop_name in CROP_PARAMETERS:
             frost_tolerance = CROP_PARAMETERS[crop_name]['frost_tolerance']
-
-            if T_min < frost_tolerance - 5:
-                risk_scores['frost'] = 80
-            elif T_min < frost_tolerance:
-                risk_scores['frost'] = 50
-            elif T_min < frost_tolerance + 2:
-                risk_scores['frost'] = 20
-            else:
-                risk_scores['frost'] = 5
+            risk_scores['frost'] = int(frost_risk(T_min, frost_tolerance))
         else:
             risk_scores['frost'] = 20
     else:
         risk_scores['frost'] = 15
 
     # 3. Риск переувлажнения
-    if indices.get('gtk'):
-        gtk = indices['gtk'].get('gtk', 1.0)
-        if gtk > 2.0:
-            risk_scores['excess_moisture'] = 70
-        elif gtk > 1.6:
-            risk_scores['excess_moisture'] = 40
-        else:
-            risk_scores['excess_moisture'] = 10
+    if gtk is not None:
+        risk_scores['excess_moisture'] = int(_step_lookup(_GTK_EXCESS_THR, _GTK_EXCESS_RISK, gtk, side='left'))
     else:
         risk_scores['excess_moisture'] = 15
 
     # 4. Риск недостатка тепла (GDD)
-    if indices.get('gdd'):
-        from .indices import CROP_GDD_REQUIREMENTS
-
+    if actual_gdd is not None:
         if crop_name in CROP_GDD_REQUIREMENTS:
-            required_gdd = CROP_GDD_REQUIREMENTS[crop_name]['total']
-            actual_gdd = indices['gdd'].get('total_gdd', 0)
-            ratio = actual_gdd / required_gdd
-
-            if ratio < 0.75:
-                risk_scores['heat_deficit'] = 80
-            elif ratio < 0.9:
-                risk_scores['heat_deficit'] = 50
-            elif ratio < 1.0:
-                risk_scores['heat_deficit'] = 20
-            else:
-                risk_scores['heat_deficit'] = 5
+            ratio = actual_gdd / CROP_GDD_REQUIREMENTS[crop_name]['total']
+            risk_scores['heat_deficit'] = int(_step_lookup(_GDD_DEFICIT_THR, _GDD_DEFICIT_RISK, ratio))
         else:
             risk_scores['heat_deficit'] = 20
     else:
         risk_scores['heat_deficit'] = 25
 
     # Взвешенная сумма рисков
-    weights = {
-        'drought': 0.35,
-        'frost': 0.25,
-        'excess_moisture': 0.20,
-        'heat_deficit': 0.20
-    }
-
-    total_risk = sum(risk_scores[k] * weights[k] for k in weights.keys())
+    total_risk = sumprod([risk_scores[k] for k in _RISK_WEIGHTS], _RISK_WEIGHTS.values())
 
     # Интерпретация
-    if total_risk < 20:
-        interpretation = "Низкий риск"
-        recommendation = "Условия благоприятные для выращивания"
-    elif total_risk < 40:
-        interpretation = "Умеренный риск"
-        recommendation = "Рекомендуется стандартная агротехника"
-    elif total_risk < 60:
-        interpretation = "Повышенный риск"
-        recommendation = "Требуются дополнительные меры защиты"
-    else:
-        interpretation = "Высокий риск"
-        recommendation = "Рекомендуется рассмотреть альтернативные культуры"
+    interpretation, recommendation = _interpret_risk(total_risk)
 
     return {
         'total_risk': round(total_risk, 1),
@@ -343,6 +414,45 @@ def assess_climate_risks(climate_data, indices, crop_name):
     }
 
 
+def assess_climate_risks_batch(climate_data, indices):
+    """
+    Векторная версия assess_climate_risks сразу для всех культур
+
+    Args:
+        climate_data: климатические данные
+        indices: агрономические индексы
+
+    Returns:
+        Словарь массивов по CROP_NAMES: 'drought', 'frost', 'excess_moisture',
+        'heat_deficit' и 'total_risk' (округлен до 0.1)
+    """
+    n_crops = len(CROP_NAMES)
+    gtk, total_gdd, spi = _index_values(indices)
+
+    risks = {'drought': np.full(n_crops, 20)}
+    if spi is not None:
+        risks['drought'] = np.full(n_crops, _step_lookup(_SPI_THR, _SPI_RISK, spi))
+
+    risks['frost'] = np.full(n_crops, 15)
+    if climate_data and 'temperature_min' in climate_data:
+        risks['frost'] = frost_risk(climate_data['temperature_min'], FROST_TOL_ARR)
+
+    risks['excess_moisture'] = np.full(n_crops, 15)
+    if gtk is not None:
+        risks['excess_moisture'] = np.full(n_crops, _step_lookup(_GTK_EXCESS_THR, _GTK_EXCESS_RISK, gtk, side='left'))
+
+    risks['heat_deficit'] = np.full(n_crops, 25)
+    gdd_ratio = _gdd_ratio_arr(total_gdd)
+    if gdd_ratio is not None:
+        risks['heat_deficit'] = np.where(
+            _GDD_REQ_KNOWN, _step_lookup(_GDD_DEFICIT_THR, _GDD_DEFICIT_RISK, gdd_ratio), 20
+        )
+
+    total_risk = _RISK_WEIGHTS_VEC @ np.vstack([risks[key] for key in _RISK_WEIGHTS])
+    risks['total_risk'] = _round_each(total_risk)
+    return risks
+
+
 def calculate_final_rating(suitability_score, profitability, risk_assessment):
     """
     Расчет финального рейтинга культуры (0-100)
@@ -376,10 +486,141 @@ def calculate_final_rating(suitability_score, profitability, risk_assessment):
     return round(rating, 1)
 
 
+# Struct-of-arrays для ранжирования нескольких культур одним векторным проходом
+RATING_DTYPE = np.dtype([
+    ('idx', 'i4'),
+    ('suit', 'f4'),
+    ('yld', 'f4'),
+    ('profit', 'f4'),
+    ('roi', 'f4'),
+    ('risk', 'f4'),
+    ('rating', 'f4'),
+])
+
+
+def calculate_final_ratings(suitability, roi, risk):
+    """
+    Векторная версия calculate_final_rating для массивов показателей
+
+    Args:
+        suitability: оценки пригодности (0-100)
+        roi: ROI в процентах
+        risk: суммарный риск (0-100)
+
+    Returns:
+        np.ndarray финальных рейтингов (округлены до 0.1)
+    """
+    profit_score = np.clip(50 + np.asarray(roi, dtype=np.float64), 0, 100)
+    risk_score = 100 - np.asarray(risk, dtype=np.float64)
+    rating = 0.4 * np.asarray(suitability, dtype=np.float64) + 0.4 * profit_score + 0.2 * risk_score
+    return np.round(rating, 1)
+
+
+def build_rating_table(suitability_scores, yield_forecasts, profitabilities, risk_assessments):
+    """
+    Сводная таблица рейтинга культур (структурированный массив RATING_DTYPE)
+
+    Args:
+        suitability_scores: оценки пригодности по культурам
+        yield_forecasts: прогнозы урожайности (ц/га)
+        profitabilities: словари calculate_profitability (None — нет данных)
+        risk_assessments: словари assess_climate_risks
+
+    Returns:
+        Массив, отсортированный по убыванию рейтинга; поле idx — позиция культуры во входных списках
+    """
+    n = len(suitability_scores)
+    table = np.zeros(n, dtype=RATING_DTYPE)
+    table['idx'] = np.arange(n)
+    table['suit'] = suitability_scores
+    table['yld'] = yield_forecasts
+    table['profit'] = [p['profit'] if p else 0 for p in profitabilities]
+    table['roi'] = [p.get('roi_percent', 0) if p else 0 for p in profitabilities]
+    table['risk'] = [r.get('total_risk', 50) for r in risk_assessments]
+    table['rating'] = calculate_final_ratings(table['suit'], table['roi'], table['risk'])
+
+    # Стабильная сортировка: при равном рейтинге сохраняется порядок по пригодности
+    return table[np.argsort(-table['rating'], kind='stable')]
+
+
+def score_region_full(region_data, climate_data, indices, n=3, region='default'):
+    """
+    Пригодность, урожайность, экономика, риски и финальный рейтинг всех культур
+    одним векторным проходом
+
+    Формулы те же, что в rank_crops, estimate_yield, calculate_profitability,
+    assess_climate_risks и calculate_final_rating; словари результата
+    собираются только для топ-N культур по финальному рейтингу.
+
+    Args:
+        region_data: словарь с данными региона (prepare_region_features)
+        climate_data: климатические данные региона
+        indices: агрономические индексы
+        n: количество культур в результате (None — все)
+        region: регион (для корректировки затрат)
+
+    Returns:
+        Список словарей результата rank_crops, дополненных ключами
+        'yield_forecast', 'profitability', 'risks', 'final_rating';
+        отсортирован по убыванию финального рейтинга
+    """
+    crop_region, scores, final_percent = score_all_crops(region_data)
+    suit = _round_each(final_percent)
+
+    # Урожайность: скалярные поправки по ГТК и SPI общие для всех культур
+    gtk, total_gdd, spi = _index_values(indices)
+    gtk_factor = float(_step_lookup(_GTK_FACTOR_THR, _GTK_FACTOR, gtk)) if gtk is not None else 1.0
+    spi_factor = float(_step_lookup(_SPI_FACTOR_THR, _SPI_FACTOR, spi)) if spi is not None else 1.0
+    gdd_factor = np.ones(len(CROP_NAMES))
+    gdd_ratio = _gdd_ratio_arr(total_gdd)
+    if gdd_ratio is not None:
+        gdd_factor = np.where(_GDD_REQ_KNOWN, _step_lookup(_GDD_FACTOR_THR, _GDD_FACTOR, gdd_ratio), 1.0)
+
+    base_yield = np.array([AVERAGE_YIELDS[name] for name in CROP_NAMES], dtype=np.float64)
+    suitability_factor = 0.5 + (suit / 100) * 0.7
+    yields = _round_each(base_yield * suitability_factor * gtk_factor * gdd_factor * spi_factor)
+
+    # Экономика: пакетный расчет идет в порядке CROP_INDEX
+    econ_idx = [CROP_INDEX[name] for name in CROP_NAMES]
+    yields_econ = np.zeros(len(CROP_INDEX))
+    yields_econ[econ_idx] = yields
+    roi = _round_each(calculate_profitability_batch(yields_econ)['roi_percent'][econ_idx])
+
+    risks = assess_climate_risks_batch(climate_data, indices)
+    total_risk = risks.pop('total_risk')
+
+    rating = calculate_final_ratings(suit, roi, total_risk)
+
+    order = np.argsort(-rating, kind='stable')
+    if n is not None:
+        order = order[:n]
+
+    results = []
+    for i in order:
+        crop_name = CROP_NAMES[i]
+        interpretation, recommendation = _interpret_risk(total_risk[i])
+        result = build_suitability_result(i, crop_region, scores, final_percent)
+        result['yield_forecast'] = float(yields[i])
+        result['profitability'] = calculate_profitability(crop_name, float(yields[i]), region)
+        result['risks'] = {
+            'total_risk': float(total_risk[i]),
+            'interpretation': interpretation,
+            'recommendation': recommendation,
+            'risk_breakdown': {k: int(v[i]) for k, v in risks.items()}
+        }
+        result['final_rating'] = float(rating[i])
+        results.append(result)
+
+    return results
+
+
 def format_economics_report(crop_name, profitability, risk_assessment):
     """
     Форматирование экономического отчета
 
+    Отчет кэшируется по выводимым показателям, повторные запросы того же
+    региона не пересобирают строку.
+
     Args:
         crop_name: название культуры
         profitability: экономические показатели
@@ -388,7 +629,30 @@ def format_economics_report(crop_name, profitability, risk_assessment):
     Returns:
         Форматированный отчет
     """
-    from .crop_suitability import CROP_PARAMETERS
+    costs = profitability['costs']
+    breakdown = risk_assessment['risk_breakdown']
+    key = (
+        crop_name,
+        costs['total'],
+        tuple(costs['breakdown'][k] for k in ('seeds', 'fertilizers', 'fuel', 'pesticides')),
+        profitability['revenue'],
+        profitability['profit'],
+        profitability['roi_percent'],
+        profitability['breakeven_yield_cwt_per_ha'],
+        risk_assessment['interpretation'],
+        risk_assessment['total_risk'],
+        tuple(breakdown.get(k, 0) for k in ('drought', 'frost', 'excess_moisture')),
+        risk_assessment['recommendation'],
+    )
+    return _format_economics_report_cached(key)
+
+
+@lru_cache(maxsize=1024)
+def _format_economics_report_cached(key):
+    """Сборка экономического отчета по кортежу выводимых показателей"""
+    (crop_name, total_costs, (seeds, fertilizers, fuel, pesticides), revenue, profit, roi,
+     breakeven_yield, risk_interpretation, total_risk, (drought, frost, excess_moisture),
+     recommendation) = key
 
     crop_name_ru = CROP_PARAMETERS.get(crop_name, {}).get('name_ru', crop_name)
 
@@ -397,39 +661,36 @@ def format_economics_report(crop_name, profitability, risk_assessment):
     lines.append(f"💰 ЭКОНОМИКА: {crop_name_ru}\n")
 
     # Затраты
-    costs = profitability['costs']
-    lines.append(f"Затраты: {costs['total']:,.0f} ₽/га")
-    lines.append(f"  • Семена: {costs['breakdown']['seeds']:,.0f} ₽")
-    lines.append(f"  • Удобрения: {costs['breakdown']['fertilizers']:,.0f} ₽")
-    lines.append(f"  • ГСМ: {costs['breakdown']['fuel']:,.0f} ₽")
-    lines.append(f"  • СЗР: {costs['breakdown']['pesticides']:,.0f} ₽")
+    lines.append(f"Затраты: {total_costs:,.0f} ₽/га")
+    lines.append(f"  • Семена: {seeds:,.0f} ₽")
+    lines.append(f"  • Удобрения: {fertilizers:,.0f} ₽")
+    lines.append(f"  • ГСМ: {fuel:,.0f} ₽")
+    lines.append(f"  • СЗР: {pesticides:,.0f} ₽")
 
     # Выручка и прибыль
-    lines.append(f"\nВыручка: {profitability['revenue']:,.0f} ₽/га")
-    lines.append(f"Прибыль: {profitability['profit']:,.0f} ₽/га")
+    lines.append(f"\nВыручка: {revenue:,.0f} ₽/га")
+    lines.append(f"Прибыль: {profit:,.0f} ₽/га")
 
     # ROI
-    roi = profitability['roi_percent']
     if roi > 0:
         lines.append(f"ROI: {roi:.1f}% ✅")
     else:
         lines.append(f"ROI: {roi:.1f}% ⚠️")
 
     # Точка безубыточности
-    lines.append(f"\nТочка безубыточности: {profitability['breakeven_yield_cwt_per_ha']:.1f} ц/га")
+    lines.append(f"\nТочка безубыточности: {breakeven_yield:.1f} ц/га")
 
     # Риски
-    lines.append(f"\n⚠️ РИСКИ: {risk_assessment['interpretation']}")
-    lines.append(f"Общий риск: {risk_assessment['total_risk']:.0f}/100")
+    lines.append(f"\n⚠️ РИСКИ: {risk_interpretation}")
+    lines.append(f"Общий риск: {total_risk:.0f}/100")
 
-    breakdown = risk_assessment['risk_breakdown']
-    if breakdown.get('drought', 0) > 30:
-        lines.append(f"  • Засуха: {breakdown['drought']:.0f}")
-    if breakdown.get('frost', 0) > 30:
-        lines.append(f"  • Заморозки: {breakdown['frost']:.0f}")
-    if breakdown.get('excess_moisture', 0) > 30:
-        lines.append(f"  • Переувлажнение: {breakdown['excess_moisture']:.0f}")
-
-    lines.append(f"\n{risk_assessment['recommendation']}")
+    if drought > 30:
+        lines.append(f"  • Засуха: {drought:.0f}")
+    if frost > 30:
+        lines.append(f"  • Заморозки: {frost:.0f}")
+    if excess_moisture > 30:
+        lines.append(f"  • Переувлажнение: {excess_moisture:.0f}")
+
+    lines.append(f"\n{recommendation}")
 
     return "\n".join(lines)
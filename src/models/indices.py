@@ -2,13 +2,97 @@
 Модуль для расчета агрономических индексов
 Включает GDD, SPI, ГТК, LAI
 """
+import math
+from bisect import bisect_right
+from functools import lru_cache
+
 import numpy as np
-import pandas as pd
 from scipy import stats as scipy_stats
-from scipy.stats import gamma, norm
-
-
-def calculate_gdd(T_avg, T_base=10, T_upper=30):
+from scipy.special import ndtri
+from scipy.stats import gamma
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+# ── Вычислительные ядра ─────────────────────────────────────────────────────
+# С numba — один компилируемый цикл по непрерывному буферу (cache=True сохраняет
+# скомпилированный код между запусками бота); без numba — эквивалент на NumPy.
+if njit is not None:
+    @njit(fastmath=True, cache=True)
+    def _gdd_kernel(temps, t_base, t_upper, t_active):
+        # Заодно копит сумму активных температур выше t_active (для ГТК)
+        n = temps.shape[0]
+        daily = np.empty(n, dtype=np.float64)
+        cumulative = np.empty(n, dtype=np.float64)
+        limit = t_upper - t_base
+        total = 0.0
+        active = 0.0
+        for i in range(n):
+            t = temps[i]
+            value = t - t_base
+            if value < 0.0:
+                value = 0.0
+            elif value > limit:
+                value = limit
+            daily[i] = value
+            total += value
+            cumulative[i] = total
+            if t > t_active:
+                active += t - t_active
+        return daily, cumulative, total, active
+
+    # Без fastmath: пропуски (NaN) должны обрабатываться предсказуемо.
+    # Окно с пропуском дает NaN, остальные окна — точную сумму (как rolling().sum())
+    @njit(cache=True)
+    def _rolling_sum(values, window):
+        n = values.shape[0] - window + 1
+        if n <= 0:
+            return np.empty(0, dtype=np.float64)
+        out = np.empty(n, dtype=np.float64)
+        acc = 0.0
+        missing = 0
+        for i in range(values.shape[0]):
+            v = values[i]
+            if np.isnan(v):
+                missing += 1
+            else:
+                acc += v
+            if i >= window:
+                old = values[i - window]
+                if np.isnan(old):
+                    missing -= 1
+                else:
+                    acc -= old
+            if i >= window - 1:
+                out[i - window + 1] = np.nan if missing > 0 else acc
+        return out
+else:
+    def _gdd_kernel(temps, t_base, t_upper, t_active):
+        # Один буфер на дневные GDD: вычитание сразу в float64, клиппинг на месте
+        daily = np.subtract(temps, t_base, dtype=np.float64)
+        np.clip(daily, 0.0, t_upper - t_base, out=daily)
+        cumulative = np.cumsum(daily)
+        total = float(cumulative[-1]) if cumulative.shape[0] else 0.0
+        excess = np.subtract(temps, t_active, dtype=np.float64)
+        active = float(np.maximum(excess, 0.0, out=excess).sum())
+        return daily, cumulative, total, active
+
+    def _rolling_sum(values, window):
+        if values.shape[0] < window:
+            return np.empty(0, dtype=np.float64)
+        missing = np.isnan(values)
+        csum = np.cumsum(np.where(missing, 0.0, values), dtype=np.float64)
+        sums = csum[window - 1:] - np.concatenate(([0.0], csum[:-window]))
+        cmiss = np.cumsum(missing)
+        window_missing = cmiss[window - 1:] - np.concatenate(([0], cmiss[:-window]))
+        sums[window_missing > 0] = np.nan
+        return sums
+
+
+def calculate_gdd(T_avg, T_base=10, T_upper=30, as_lists=True):
     """
     Расчет GDD (Growing Degree Days) - суммы эффективных температур
 
@@ -18,22 +102,29 @@ def calculate_gdd(T_avg, T_base=10, T_upper=30):
         T_avg: массив или список среднесуточных температур (°C)
         T_base: биологический минимум (°C), по умолчанию 10°C
         T_upper: верхний порог (°C), по умолчанию 30°C
+        as_lists: вернуть ряды списками (для JSON); False — оставить ndarray
 
     Returns:
-        dict с daily_gdd и cumulative_gdd
+        dict с daily_gdd, cumulative_gdd и total_gdd
     """
-    T_avg = np.array(T_avg)
+    T_avg = np.ascontiguousarray(T_avg, dtype=np.float32)
 
-    # Расчет дневных GDD
-    gdd_daily = np.clip(T_avg - T_base, 0, T_upper - T_base)
+    # Дневные GDD, кумулятивная сумма и итог за один проход
+    gdd_daily, gdd_cumulative, total, _ = _gdd_kernel(
+        T_avg, float(T_base), float(T_upper), float(T_base)
+    )
+    return _gdd_result(gdd_daily, gdd_cumulative, total, as_lists)
 
-    # Кумулятивная сумма
-    gdd_cumulative = np.cumsum(gdd_daily)
+
+def _gdd_result(gdd_daily, gdd_cumulative, total, as_lists=True):
+    """Словарь результата GDD из выхода _gdd_kernel"""
+    if as_lists:
+        gdd_daily, gdd_cumulative = gdd_daily.tolist(), gdd_cumulative.tolist()
 
     return {
-        'daily_gdd': gdd_daily.tolist(),
-        'cumulative_gdd': gdd_cumulative.tolist(),
-        'total_gdd': float(gdd_cumulative[-1]) if len(gdd_cumulative) > 0 else 0
+        'daily_gdd': gdd_daily,
+        'cumulative_gdd': gdd_cumulative,
+        'total_gdd': float(total)
     }
 
 
@@ -89,6 +180,48 @@ CROP_GDD_REQUIREMENTS = {
     }
 }
 
+# Пороги всех культур столбцами — для расчета GDD сразу по всем культурам
+GDD_CROP_NAMES = tuple(CROP_GDD_REQUIREMENTS)
+_GDD_BASES = np.array([CROP_GDD_REQUIREMENTS[name]['base'] for name in GDD_CROP_NAMES], dtype=np.float64)
+_GDD_LIMITS = np.array(
+    [CROP_GDD_REQUIREMENTS[name]['upper'] for name in GDD_CROP_NAMES], dtype=np.float64
+) - _GDD_BASES
+
+
+def calculate_gdd_by_crop(T_avg):
+    """
+    Сумма эффективных температур для всех культур из CROP_GDD_REQUIREMENTS
+
+    Ряд температур транслируется на пары (T_base, T_upper) всех культур:
+    одна матрица (дни × культуры) вместо отдельного прохода на каждую культуру.
+
+    Args:
+        T_avg: массив или список среднесуточных температур (°C)
+
+    Returns:
+        dict {культура: total_gdd}
+    """
+    T_avg = np.asarray(T_avg, dtype=np.float64)
+    daily = T_avg[:, None] - _GDD_BASES
+    np.clip(daily, 0.0, _GDD_LIMITS, out=daily)
+    return dict(zip(GDD_CROP_NAMES, daily.sum(axis=0).tolist()))
+
+
+# Уровни обеспеченности теплом по доле от требуемой GDD: (пригодность, текст)
+_GDD_RATIO_BOUNDS = (0.75, 0.9, 1.0)
+_GDD_LEVELS = (
+    ('низкая', 'GDD недостаточно'),
+    ('удовлетворительная', 'GDD ниже оптимального'),
+    ('хорошая', 'GDD близко к требуемому'),
+    ('высокая', 'GDD достаточно для полного цикла'),
+)
+
+
+@lru_cache(maxsize=4096)
+def _gdd_message(level, gdd_text, required_gdd):
+    """Текст оценки GDD; gdd_text — уже округленная сумма (как в f'{x:.0f}')"""
+    return f'{_GDD_LEVELS[level][1]} ({gdd_text} / {required_gdd})'
+
 
 def check_gdd_requirements(total_gdd, crop_name):
     """
@@ -106,72 +239,125 @@ def check_gdd_requirements(total_gdd, crop_name):
 
     required_gdd = CROP_GDD_REQUIREMENTS[crop_name]['total']
     ratio = total_gdd / required_gdd
-
-    if ratio >= 1.0:
-        suitability = 'высокая'
-        message = f'GDD достаточно для полного цикла ({total_gdd:.0f} / {required_gdd})'
-    elif ratio >= 0.9:
-        suitability = 'хорошая'
-        message = f'GDD близко к требуемому ({total_gdd:.0f} / {required_gdd})'
-    elif ratio >= 0.75:
-        suitability = 'удовлетворительная'
-        message = f'GDD ниже оптимального ({total_gdd:.0f} / {required_gdd})'
-    else:
-        suitability = 'низкая'
-        message = f'GDD недостаточно ({total_gdd:.0f} / {required_gdd})'
+    level = bisect_right(_GDD_RATIO_BOUNDS, ratio)
 
     return {
-        'suitable': suitability,
-        'message': message,
+        'suitable': _GDD_LEVELS[level][0],
+        'message': _gdd_message(level, f'{total_gdd:.0f}', required_gdd),
         'ratio': ratio,
         'required_gdd': required_gdd,
         'actual_gdd': total_gdd
     }
 
 
-def calculate_spi(precipitation_series, timescale=3):
+def _gamma_thom(y):
     """
-    Расчет SPI (Standardized Precipitation Index) для оценки засухи
+    Параметры гамма-распределения (loc=0) по оценке Тома
+
+    Замкнутая формула метода моментов для логарифмов вместо итеративного MLE:
+    A = ln(mean(y)) - mean(ln(y)), shape = (1 + sqrt(1 + 4A/3)) / (4A)
+
+    Returns:
+        Кортеж (shape, scale)
+    """
+    mean_y = y.mean()
+    A = np.log(mean_y) - np.log(y).mean()
+    if not A > 0:
+        raise ValueError("вырожденная выборка осадков (все значения равны)")
+    shape = (1 + np.sqrt(1 + 4 * A / 3)) / (4 * A)
+    return shape, mean_y / shape
 
-    SPI использует гамма-распределение для стандартизации осадков
+
+def _rolling_precip(precipitation_series, timescale):
+    """Скользящие суммы осадков за timescale месяцев (окна с пропусками отбрасываются)"""
+    precip = np.ascontiguousarray(precipitation_series, dtype=np.float64)
+    if timescale > 1:
+        rolling_precip = _rolling_sum(precip, timescale)
+        return rolling_precip[~np.isnan(rolling_precip)]
+    return precip
+
+
+def fit_spi_params(precipitation_series, timescale=3):
+    """
+    Калибровка SPI: параметры гамма-распределения и доля нулевых сумм
 
     Args:
-        precipitation_series: массив месячных осадков (мм) за длительный период (мин. 30 лет)
+        precipitation_series: массив месячных осадков (мм) за период калибровки
         timescale: временная шкала (1, 3, 6, 12 месяцев)
 
     Returns:
-        dict с SPI значениями и интерпретацией
+        Кортеж (shape, scale, zero_prob) или None, если ненулевых сумм меньше 10
     """
-    precip = np.array(precipitation_series)
-
-    # Скользящее суммирование
-    if timescale > 1:
-        rolling_precip = pd.Series(precip).rolling(window=timescale).sum().dropna()
-    else:
-        rolling_precip = pd.Series(precip)
+    rolling_precip = _rolling_precip(precipitation_series, timescale)
 
-    # Удаление нулевых значений для подбора распределения
+    # Подбор распределения только по ненулевым суммам
     non_zero = rolling_precip[rolling_precip > 0]
-
     if len(non_zero) < 10:
-        return {
-            'spi_values': None,
-            'latest_spi': None,
-            'interpretation': 'Недостаточно данных для расчета SPI'
-        }
+        return None
+
+    shape, scale = _gamma_thom(non_zero)
+    # Доля нулевых сумм — среди известных (пропуски при timescale=1 не считаются)
+    zero_prob = 1.0 - len(non_zero) / np.count_nonzero(~np.isnan(rolling_precip))
+    return float(shape), float(scale), zero_prob
+
+
+@lru_cache(maxsize=256)
+def _fit_spi_params_cached(precip_bytes, timescale):
+    return fit_spi_params(np.frombuffer(precip_bytes, dtype=np.float64), timescale)
+
+
+def get_or_fit_spi_params(precipitation_series, timescale=3):
+    """
+    Параметры SPI с кэшем: повторные запросы по тому же ряду (та же точка,
+    тот же период калибровки) не пересчитывают подгонку
+
+    Ключ кэша — сами данные ряда и timescale, поэтому совпадение ключа
+    гарантирует совпадение параметров.
+    """
+    precip = np.ascontiguousarray(precipitation_series, dtype=np.float64)
+    return _fit_spi_params_cached(precip.tobytes(), timescale)
+
+
+def calculate_spi(precipitation_series, timescale=3, cached_params=None):
+    """
+    Расчет SPI (Standardized Precipitation Index) для оценки засухи
+
+    SPI использует гамма-распределение для стандартизации осадков;
+    нулевые суммы учитываются смешанным распределением G = q + (1 - q)·F
+
+    Args:
+        precipitation_series: массив месячных осадков (мм) за длительный период (мин. 30 лет)
+        timescale: временная шкала (1, 3, 6, 12 месяцев)
+        cached_params: готовые (shape, scale, zero_prob) из fit_spi_params —
+            подгонка пропускается
+
+    Returns:
+        dict с SPI значениями и интерпретацией
+    """
+    rolling_precip = _rolling_precip(precipitation_series, timescale)
 
     try:
-        # Подбор параметров гамма-распределения
-        shape, loc, scale = gamma.fit(non_zero, floc=0)
+        # Подбор параметров гамма-распределения (оценка Тома, loc=0)
+        params = cached_params if cached_params is not None else fit_spi_params(rolling_precip, 1)
+        if params is None:
+            return {
+                'spi_values': None,
+                'latest_spi': None,
+                'interpretation': 'Недостаточно данных для расчета SPI'
+            }
+        shape, scale, zero_prob = params
 
-        # Кумулятивная вероятность
-        cdf = gamma.cdf(rolling_precip, shape, loc, scale)
+        # Кумулятивная вероятность с поправкой на нулевые осадки: G = q для нулевых
+        # сумм, гамма-CDF считается только по положительным (NaN остаются NaN)
+        cdf = np.where(np.isnan(rolling_precip), np.nan, zero_prob)
+        positive = rolling_precip > 0
+        cdf[positive] += (1.0 - zero_prob) * gamma.cdf(rolling_precip[positive], shape, 0.0, scale)
 
         # Обработка краевых случаев
         cdf = np.clip(cdf, 0.001, 0.999)
 
         # Преобразование в стандартное нормальное распределение
-        spi_values = norm.ppf(cdf)
+        spi_values = ndtri(cdf)
 
         # Замена NaN на 0
         spi_values = np.nan_to_num(spi_values, nan=0.0)
@@ -194,24 +380,79 @@ def calculate_spi(precipitation_series, timescale=3):
         }
 
 
+def calculate_spi_batch(precip_matrix, timescale=3):
+    """
+    Расчет SPI сразу для многих рядов (станций, узлов сетки)
+
+    Скользящие суммы, оценка Тома, гамма-CDF и обратное нормальное
+    преобразование выполняются векторно по оси рядов.
+
+    Args:
+        precip_matrix: месячные осадки (мм), форма (n_series, n_months)
+        timescale: временная шкала (1, 3, 6, 12 месяцев)
+
+    Returns:
+        np.ndarray (n_series, n_months - timescale + 1) значений SPI;
+        строки с менее чем 10 ненулевыми суммами и окна с пропусками (NaN)
+        заполнены NaN
+    """
+    precip = np.atleast_2d(np.asarray(precip_matrix, dtype=np.float64))
+    missing = np.isnan(precip)
+
+    # Скользящее суммирование; окно с пропущенным месяцем — NaN
+    if timescale > 1:
+        csum = np.cumsum(np.where(missing, 0.0, precip), axis=1)
+        cmiss = np.cumsum(missing, axis=1)
+        rolling_precip = csum[:, timescale - 1:] - np.pad(csum, ((0, 0), (1, 0)))[:, :-timescale]
+        window_missing = cmiss[:, timescale - 1:] - np.pad(cmiss, ((0, 0), (1, 0)))[:, :-timescale]
+        rolling_precip[window_missing > 0] = np.nan
+    else:
+        rolling_precip = precip
+    known = ~np.isnan(rolling_precip)
+
+    # Оценка Тома по ненулевым суммам каждого ряда
+    positive = rolling_precip > 0
+    count = positive.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_y = np.where(positive, rolling_precip, 0.0).sum(axis=1, keepdims=True) / count
+        mean_log_y = np.log(np.where(positive, rolling_precip, 1.0)).sum(axis=1, keepdims=True) / count
+        A = np.log(mean_y) - mean_log_y
+        valid = (count >= 10) & (A > 0)
+        shape = np.where(valid, (1 + np.sqrt(1 + 4 * A / 3)) / (4 * A), np.nan)
+        scale = mean_y / shape
+
+    # Кумулятивная вероятность с поправкой на нулевые осадки и
+    # преобразование в стандартное нормальное распределение
+    with np.errstate(divide='ignore', invalid='ignore'):
+        zero_prob = 1.0 - count / known.sum(axis=1, keepdims=True)
+    cdf = zero_prob + (1.0 - zero_prob) * gamma.cdf(rolling_precip, shape, scale=scale)
+    cdf = np.clip(cdf, 0.001, 0.999)
+    spi_values = ndtri(cdf)
+
+    return np.where(valid & known, np.nan_to_num(spi_values, nan=0.0), np.nan)
+
+
+# Шкала SPI: границы интервалов (значение >= границы попадает в интервал выше)
+_SPI_BOUNDS = (-2.0, -1.5, -1.0, 1.0, 1.5, 2.0)
+_SPI_LABELS = (
+    "Экстремальная засуха",
+    "Сильная засуха",
+    "Умеренная засуха",
+    "Норма",
+    "Умеренно влажно",
+    "Очень влажно",
+    "Экстремально влажно",
+)
+_SPI_LABELS_ARR = np.array(_SPI_LABELS, dtype=object)
+
+
 def interpret_spi(spi_value):
-    """Интерпретация значения SPI"""
+    """Интерпретация значения SPI (скаляр или ndarray — тогда массив подписей)"""
     if spi_value is None:
         return "Нет данных"
-    elif spi_value >= 2.0:
-        return "Экстремально влажно"
-    elif spi_value >= 1.5:
-        return "Очень влажно"
-    elif spi_value >= 1.0:
-        return "Умеренно влажно"
-    elif spi_value >= -1.0:
-        return "Норма"
-    elif spi_value >= -1.5:
-        return "Умеренная засуха"
-    elif spi_value >= -2.0:
-        return "Сильная засуха"
-    else:
-        return "Экстремальная засуха"
+    if isinstance(spi_value, np.ndarray):
+        return _SPI_LABELS_ARR[np.searchsorted(_SPI_BOUNDS, spi_value, side='right')]
+    return _SPI_LABELS[bisect_right(_SPI_BOUNDS, spi_value)]
 
 
 def calculate_gtk(precipitation_sum, temperature_sum_above_10):
@@ -249,22 +490,27 @@ def calculate_gtk(precipitation_sum, temperature_sum_above_10):
     }
 
 
+# Шкала ГТК: верхний класс — строго > 1.6, поэтому последняя граница сдвинута
+# на один ulp вверх, остальные — «значение >= границы»
+_GTK_BOUNDS = (0.5, 0.7, 1.0, 1.3, math.nextafter(1.6, math.inf))
+_GTK_LABELS = (
+    "Сильная засуха",
+    "Засушливые условия",
+    "Недостаточное увлажнение",
+    "Оптимальное увлажнение",
+    "Повышенное увлажнение",
+    "Избыточное увлажнение",
+)
+_GTK_LABELS_ARR = np.array(_GTK_LABELS, dtype=object)
+
+
 def interpret_gtk(gtk_value):
-    """Интерпретация значения ГТК"""
+    """Интерпретация значения ГТК (скаляр или ndarray — тогда массив подписей)"""
     if gtk_value is None:
         return "Нет данных"
-    elif gtk_value > 1.6:
-        return "Избыточное увлажнение"
-    elif gtk_value >= 1.3:
-        return "Повышенное увлажнение"
-    elif gtk_value >= 1.0:
-        return "Оптимальное увлажнение"
-    elif gtk_value >= 0.7:
-        return "Недостаточное увлажнение"
-    elif gtk_value >= 0.5:
-        return "Засушливые условия"
-    else:
-        return "Сильная засуха"
+    if isinstance(gtk_value, np.ndarray):
+        return _GTK_LABELS_ARR[np.searchsorted(_GTK_BOUNDS, gtk_value, side='right')]
+    return _GTK_LABELS[bisect_right(_GTK_BOUNDS, gtk_value)]
 
 
 def estimate_lai_from_ndvi(ndvi):
@@ -280,7 +526,13 @@ def estimate_lai_from_ndvi(ndvi):
     Returns:
         Значение или массив LAI
     """
-    ndvi = np.array(ndvi)
+    # Скаляр (среднее NDVI в calculate_all_indices) — без создания массивов
+    if np.isscalar(ndvi):
+        ndvi_clipped = min(max(ndvi, -0.2), 0.68)
+        ratio = max((0.69 - ndvi_clipped) / 0.59, 0.001)
+        return min(max(-math.log(ratio) / 0.91, 0.0), 8.0)
+
+    ndvi = np.asarray(ndvi)
 
     # Формула Baret
     # Защита от выхода за пределы
@@ -314,7 +566,10 @@ def calculate_par_absorption(lai):
         FPAR (доля поглощенной ФАР, 0-1)
     """
     k = 0.5  # Коэффициент экстинкции
-    fpar = 1 - np.exp(-k * np.array(lai))
+    if np.isscalar(lai):
+        return 1 - math.exp(-k * lai)
+
+    fpar = 1 - np.exp(-k * np.asarray(lai))
 
     return fpar
 
@@ -334,14 +589,14 @@ def calculate_all_indices(climate_data, ndvi_data=None):
 
     # 1. GDD
     if 'temperature_avg' in climate_data:
-        temps = climate_data['temperature_avg']
-        gdd_result = calculate_gdd(temps, T_base=10, T_upper=30)
-        results['gdd'] = gdd_result
-
-        # Расчет суммы активных температур >10°C для ГТК
-        temps_array = np.array(temps)
-        active_temps = temps_array[temps_array > 10]
-        temp_sum_above_10 = float(np.sum(active_temps - 10))
+        temps = np.ascontiguousarray(climate_data['temperature_avg'], dtype=np.float32)
+        # GDD и сумма активных температур >10°C для ГТК — за один проход по ряду.
+        # Ряды остаются ndarray — дальше по конвейеру нужен только total_gdd
+        gdd_daily, gdd_cumulative, gdd_total, temp_sum_above_10 = _gdd_kernel(
+            temps, 10.0, 30.0, 10.0
+        )
+        results['gdd'] = _gdd_result(gdd_daily, gdd_cumulative, gdd_total, as_lists=False)
+        temp_sum_above_10 = float(temp_sum_above_10)
     else:
         results['gdd'] = None
         temp_sum_above_10 = 0
@@ -358,7 +613,12 @@ def calculate_all_indices(climate_data, ndvi_data=None):
     if 'precipitation' in climate_data:
         precip_series = climate_data['precipitation']
         if len(precip_series) >= 12:  # Минимум год данных
-            spi_result = calculate_spi(precip_series, timescale=3)
+            # Калибровка кэшируется: повторный запрос по той же точке её пропускает
+            try:
+                spi_params = get_or_fit_spi_params(precip_series, timescale=3)
+            except ValueError:
+                spi_params = None  # вырожденный ряд — calculate_spi сообщит об ошибке
+            spi_result = calculate_spi(precip_series, timescale=3, cached_params=spi_params)
             results['spi'] = spi_result
         else:
             results['spi'] = {'interpretation': 'Недостаточно данных (нужен год+)'}
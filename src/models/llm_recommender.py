@@ -1,11 +1,148 @@
 """
 Модуль для генерации текстовых рекомендаций через OpenRouter LLM
 """
+import asyncio
+import functools
+import json
+from collections import defaultdict
 import aiohttp
 import os
+from typing import AsyncIterator, Optional
 from config.settings import OPENROUTER_API_KEY
+from src.database import on_shared_loop
 
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to stdlib json
+    orjson = None
 
+# Сериализация тел запросов/ответов: orjson, если установлен (stdlib json — иначе)
+if orjson is not None:
+    def _json_dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    _json_loads = orjson.loads
+else:
+    _json_dumps = json.dumps
+    _json_loads = json.loads
+
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+# Одна сессия на процесс: пул соединений с keep-alive, TLS-контекст и DNS-кэш
+# переиспользуются между запросами. Сессия привязана к event loop, поэтому все
+# обращения к OpenRouter выполняются на общем долгоживущем цикле (src.database.get_loop),
+# из какого бы цикла их ни вызвали.
+_session: Optional[aiohttp.ClientSession] = None
+
+
+_STREAM_END = object()
+
+
+async def _anext_or_end(agen):
+    """Следующий элемент асинхронного генератора или _STREAM_END"""
+    try:
+        return await agen.__anext__()
+    except StopAsyncIteration:
+        return _STREAM_END
+
+
+async def _aclose(agen):
+    await agen.aclose()
+
+
+def _stream_on_shared_loop(func):
+    """Декоратор асинхронного генератора: каждый шаг выполняется на общем цикле"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        agen = func(*args, **kwargs)
+        try:
+            while True:
+                item = await on_shared_loop(_anext_or_end)(agen)
+                if item is _STREAM_END:
+                    return
+                yield item
+        finally:
+            await on_shared_loop(_aclose)(agen)
+    return wrapper
+
+
+async def _get_session() -> aiohttp.ClientSession:
+    """Возвращает общую ClientSession для OpenRouter (вызывается на общем цикле)"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            headers={
+                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+                "HTTP-Referer": "https://crop-forecast-bot.com",
+                "X-Title": "Crop Forecast Bot",
+                "Content-Type": "application/json"
+            },
+            connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=300),
+            json_serialize=_json_dumps
+        )
+    return _session
+
+
+@on_shared_loop
+async def close_session():
+    """Закрывает общую сессию (при остановке бота)"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+# Таймауты: обычный запрос ограничен целиком; потоковый — паузой между
+# фрагментами, т.к. полная генерация может идти дольше 30 с
+OPENROUTER_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=5)
+OPENROUTER_STREAM_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=5, sock_read=30)
+
+# Повторы при сетевых ошибках и временных отказах (экспоненциальная пауза)
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF = 0.5
+RETRY_AFTER_MAX = 10.0
+
+
+def _retry_delay(response, attempt):
+    """Пауза перед повтором: Retry-After (в секундах), иначе экспоненциальная"""
+    retry_after = response.headers.get('Retry-After')
+    if retry_after is not None:
+        try:
+            return min(max(float(retry_after), 0.0), RETRY_AFTER_MAX)
+        except ValueError:
+            pass  # формат HTTP-date не разбираем
+    return RETRY_BACKOFF * 2 ** attempt
+
+
+async def _post_with_retry(payload, timeout=OPENROUTER_TIMEOUT) -> aiohttp.ClientResponse:
+    """
+    POST в OpenRouter с повторами на 429/5xx и сетевые ошибки
+
+    Пауза — через asyncio.sleep, цикл событий не блокируется. Последняя
+    попытка возвращает ответ с любым статусом или пробрасывает исключение.
+
+    Returns:
+        ClientResponse; вызывающий освобождает его (async with)
+    """
+    session = await _get_session()
+    for attempt in range(RETRY_ATTEMPTS):
+        last_attempt = attempt == RETRY_ATTEMPTS - 1
+        try:
+            response = await session.post(OPENROUTER_URL, json=payload, timeout=timeout)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if last_attempt:
+                raise
+            delay = RETRY_BACKOFF * 2 ** attempt
+        else:
+            if last_attempt or response.status not in RETRY_STATUSES:
+                return response
+            delay = _retry_delay(response, attempt)
+            response.release()
+        await asyncio.sleep(delay)
+
+
+@on_shared_loop
 async def generate_crop_recommendation(crop_data, indices, soil_data, user_context=None):
     """
     Генерация текстовой рекомендации с помощью LLM через OpenRouter
@@ -23,41 +160,19 @@ async def generate_crop_recommendation(crop_data, indices, soil_data, user_conte
     prompt = build_prompt(crop_data, indices, soil_data, user_context)
 
     try:
-        # Вызов OpenRouter API
-        async with aiohttp.ClientSession() as session:
-            headers = {
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "HTTP-Referer": "https://crop-forecast-bot.com",
-                "X-Title": "Crop Forecast Bot",
-                "Content-Type": "application/json"
-            }
+        # Вызов OpenRouter API через общую сессию (заголовки заданы в ней)
+        payload = _recommendation_payload(prompt)
 
-            payload = {
-                "model": "anthropic/claude-3.5-sonnet",  # Лучшая модель для анализа
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "temperature": 0.7,
-                "max_tokens": 1500
-            }
+        async with await _post_with_retry(payload) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                print(f"Ошибка OpenRouter API: {response.status} - {error_text}")
+                return None
 
-            async with session.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json=payload
-            ) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    print(f"Ошибка OpenRouter API: {response.status} - {error_text}")
-                    return None
+            result = await response.json(loads=_json_loads)
+            recommendation_text = result['choices'][0]['message']['content']
 
-                result = await response.json()
-                recommendation_text = result['choices'][0]['message']['content']
-
-                return recommendation_text
+            return recommendation_text
 
     except Exception as e:
         print(f"Ошибка генерации рекомендации: {e}")
@@ -66,45 +181,77 @@ async def generate_crop_recommendation(crop_data, indices, soil_data, user_conte
         return None
 
 
-def build_prompt(crop_data, indices, soil_data, user_context):
+@_stream_on_shared_loop
+async def stream_crop_recommendation(crop_data, indices, soil_data, user_context=None) -> AsyncIterator[str]:
     """
-    Построение промпта для LLM
+    Потоковая генерация рекомендации (SSE): фрагменты текста отдаются по мере
+    генерации, чтобы бот мог обновлять сообщение, не дожидаясь полного ответа
 
     Args:
-        crop_data: список топ-культур
+        crop_data: данные по топ-культурам
         indices: агрономические индексы
         soil_data: данные о почве
-        user_context: контекст пользователя
+        user_context: контекст пользователя (опционально)
 
-    Returns:
-        Текст промпта
+    Yields:
+        Фрагменты текста рекомендации; при ошибке поток просто завершается
     """
-    # Значения по умолчанию для контекста
-    if user_context is None:
-        user_context = {}
+    prompt = build_prompt(crop_data, indices, soil_data, user_context)
+
+    try:
+        payload = _recommendation_payload(prompt, stream=True)
+
+        # Повторяется только установка соединения; начатый поток не перезапускается
+        async with await _post_with_retry(payload, OPENROUTER_STREAM_TIMEOUT) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                print(f"Ошибка OpenRouter API: {response.status} - {error_text}")
+                return
+
+            # SSE: строки вида "data: {json}", поток завершается "data: [DONE]";
+            # строки-комментарии (": ...") служат keep-alive и пропускаются
+            async for raw_line in response.content:
+                line = raw_line.strip()
+                if not line.startswith(b'data:'):
+                    continue
+                data = line[5:].strip()
+                if data == b'[DONE]':
+                    break
+
+                chunk = _json_loads(data)
+                choices = chunk.get('choices')
+                if not choices:
+                    continue
+                content = choices[0].get('delta', {}).get('content')
+                if content:
+                    yield content
 
-    region = user_context.get('region', 'Россия')
-    area_ha = user_context.get('area_ha', 10)
-    lat = user_context.get('lat', 0)
-    lon = user_context.get('lon', 0)
+    except Exception as e:
+        print(f"Ошибка потоковой генерации рекомендации: {e}")
+        import traceback
+        traceback.print_exc()
 
-    # Извлечение данных
-    top1 = crop_data[0] if len(crop_data) > 0 else None
-    top2 = crop_data[1] if len(crop_data) > 1 else None
-    top3 = crop_data[2] if len(crop_data) > 2 else None
 
-    # Климатические условия
-    gdd = indices.get('gdd', {})
-    gtk = indices.get('gtk', {})
-    spi = indices.get('spi', {})
-    lai = indices.get('lai', {})
+def _recommendation_payload(prompt, stream=False):
+    """Тело запроса к OpenRouter для развёрнутой рекомендации"""
+    payload = {
+        "model": "anthropic/claude-3.5-sonnet",  # Лучшая модель для анализа
+        "messages": [
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        "temperature": 0.7,
+        "max_tokens": 1500
+    }
+    if stream:
+        payload["stream"] = True
+    return payload
 
-    # Почвенные данные
-    texture = soil_data.get('texture', {}) if soil_data else {}
-    chemistry = soil_data.get('chemistry', {}) if soil_data else {}
-    interpretation = soil_data.get('interpretation', {}) if soil_data else {}
 
-    prompt = f"""
+# Шаблон промпта: отсутствующие поля подставляются как 'н/д' через format_map
+_PROMPT_TEMPLATE = """
 Вы — опытный агроном-консультант для фермеров России.
 
 ДАННЫЕ ФЕРМЫ:
@@ -113,31 +260,31 @@ def build_prompt(crop_data, indices, soil_data, user_context):
 - Координаты: {lat:.4f}, {lon:.4f}
 
 КЛИМАТИЧЕСКИЕ УСЛОВИЯ:
-- GDD (сумма эффективных температур): {gdd.get('total_gdd', 'н/д')}°C·дни
-- ГТК (увлажнение): {gtk.get('gtk', 'н/д')} - {gtk.get('interpretation', 'н/д')}
-- SPI (засуха): {spi.get('latest_spi', 'н/д')} - {spi.get('interpretation', 'н/д')}
-- LAI (площадь листьев): {lai.get('lai_estimated', 'н/д')} (FPAR: {lai.get('fpar', 0)*100:.0f}%)
+- GDD (сумма эффективных температур): {total_gdd}°C·дни
+- ГТК (увлажнение): {gtk} - {gtk_interpretation}
+- SPI (засуха): {latest_spi} - {spi_interpretation}
+- LAI (площадь листьев): {lai_estimated} (FPAR: {fpar_percent:.0f}%)
 
 ПОЧВА:
-- Тип: {texture.get('texture_class_ru', 'н/д')}
-- Глина: {texture.get('clay_percent', 'н/д')}%
-- Песок: {texture.get('sand_percent', 'н/д')}%
-- Гумус: {chemistry.get('soc_percent', 'н/д')*1.724 if chemistry.get('soc_percent') else 'н/д'}%
-- pH: {chemistry.get('ph', 'н/д')}
-- Плодородность: {interpretation.get('fertility', 'н/д')}
-- Рекомендация по почве: {interpretation.get('fertility_recommendation', 'н/д')}
+- Тип: {texture_class_ru}
+- Глина: {clay_percent}%
+- Песок: {sand_percent}%
+- Гумус: {humus_percent}%
+- pH: {ph}
+- Плодородность: {fertility}
+- Рекомендация по почве: {fertility_recommendation}
 
 РЕКОМЕНДУЕМЫЕ КУЛЬТУРЫ:
 
-1. **{top1['crop_name_ru'] if top1 else 'н/д'}** (пригодность {top1['suitability_score'] if top1 else 0}%)
-   - Оценка: {top1['interpretation'] if top1 else 'н/д'}
-   - Детали: {format_details(top1['details']) if top1 else 'н/д'}
+1. **{crop1_name}** (пригодность {crop1_score}%)
+   - Оценка: {crop1_interpretation}
+   - Детали: {crop1_details}
 
-2. **{top2['crop_name_ru'] if top2 else 'н/д'}** (пригодность {top2['suitability_score'] if top2 else 0}%)
-   - Оценка: {top2['interpretation'] if top2 else 'н/д'}
+2. **{crop2_name}** (пригодность {crop2_score}%)
+   - Оценка: {crop2_interpretation}
 
-3. **{top3['crop_name_ru'] if top3 else 'н/д'}** (пригодность {top3['suitability_score'] if top3 else 0}%)
-   - Оценка: {top3['interpretation'] if top3 else 'н/д'}
+3. **{crop3_name}** (пригодность {crop3_score}%)
+   - Оценка: {crop3_interpretation}
 
 ЗАДАЧА:
 Составьте краткие практические рекомендации для фермера (4-5 абзацев):
@@ -157,7 +304,79 @@ def build_prompt(crop_data, indices, soil_data, user_context):
 - НЕ используйте эмодзи (они будут добавлены автоматически)
 """
 
-    return prompt
+# Поля шаблона по разделам входных данных: ключ источника -> имя поля
+_INDEX_FIELDS = {
+    'gdd': {'total_gdd': 'total_gdd'},
+    'gtk': {'gtk': 'gtk', 'interpretation': 'gtk_interpretation'},
+    'spi': {'latest_spi': 'latest_spi', 'interpretation': 'spi_interpretation'},
+    'lai': {'lai_estimated': 'lai_estimated'},
+}
+_SOIL_FIELDS = {
+    'texture': {'texture_class_ru': 'texture_class_ru', 'clay_percent': 'clay_percent',
+                'sand_percent': 'sand_percent'},
+    'chemistry': {'ph': 'ph'},
+    'interpretation': {'fertility': 'fertility',
+                       'fertility_recommendation': 'fertility_recommendation'},
+}
+
+# Коэффициент пересчета органического углерода в гумус (фактор ван Беммелена)
+SOC_TO_HUMUS = 1.724
+
+
+def _copy_fields(ctx, source, fields):
+    """Переносит имеющиеся в source значения в контекст шаблона"""
+    for key, field in fields.items():
+        if key in source:
+            ctx[field] = source[key]
+
+
+def build_prompt(crop_data, indices, soil_data, user_context):
+    """
+    Построение промпта для LLM
+
+    Args:
+        crop_data: список топ-культур
+        indices: агрономические индексы
+        soil_data: данные о почве
+        user_context: контекст пользователя
+
+    Returns:
+        Текст промпта
+    """
+    # Значения по умолчанию для контекста
+    if user_context is None:
+        user_context = {}
+
+    ctx = defaultdict(lambda: 'н/д')
+    ctx['region'] = user_context.get('region', 'Россия')
+    ctx['area_ha'] = user_context.get('area_ha', 10)
+    ctx['lat'] = user_context.get('lat', 0)
+    ctx['lon'] = user_context.get('lon', 0)
+
+    # Климатические условия
+    for name, fields in _INDEX_FIELDS.items():
+        _copy_fields(ctx, indices.get(name) or {}, fields)
+    ctx['fpar_percent'] = (indices.get('lai') or {}).get('fpar', 0) * 100
+
+    # Почвенные данные
+    soil_data = soil_data or {}
+    for name, fields in _SOIL_FIELDS.items():
+        _copy_fields(ctx, soil_data.get(name) or {}, fields)
+    soc_percent = (soil_data.get('chemistry') or {}).get('soc_percent')
+    if soc_percent:
+        ctx['humus_percent'] = soc_percent * SOC_TO_HUMUS
+
+    # Топ-3 культуры; для отсутствующих пригодность 0%
+    for i in range(1, 4):
+        ctx[f'crop{i}_score'] = 0
+    for i, crop in enumerate(crop_data[:3], 1):
+        ctx[f'crop{i}_name'] = crop['crop_name_ru']
+        ctx[f'crop{i}_score'] = crop['suitability_score']
+        ctx[f'crop{i}_interpretation'] = crop['interpretation']
+    if crop_data:
+        ctx['crop1_details'] = format_details(crop_data[0]['details'])
+
+    return _PROMPT_TEMPLATE.format_map(ctx)
 
 
 def format_details(details):
@@ -172,6 +391,7 @@ def format_details(details):
     return "; ".join(items[:3])  # Первые 3 детали
 
 
+@on_shared_loop
 async def generate_short_summary(crop_name, suitability_score):
     """
     Генерация краткой сводки по культуре
@@ -184,38 +404,26 @@ async def generate_short_summary(crop_name, suitability_score):
         Краткое описание (1-2 предложения)
     """
     try:
-        async with aiohttp.ClientSession() as session:
-            headers = {
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "HTTP-Referer": "https://crop-forecast-bot.com",
-                "X-Title": "Crop Forecast Bot",
-                "Content-Type": "application/json"
-            }
-
-            prompt = f"""
+        prompt = f"""
 Напишите одно предложение (до 150 символов) о том, подходит ли культура "{crop_name}"
 для выращивания, если оценка пригодности {suitability_score}%.
 
 Будьте кратки и конкретны.
 """
 
-            payload = {
-                "model": "anthropic/claude-3.5-sonnet",
-                "messages": [
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.5,
-                "max_tokens": 100
-            }
-
-            async with session.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json=payload
-            ) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    return result['choices'][0]['message']['content']
+        payload = {
+            "model": "anthropic/claude-3.5-sonnet",
+            "messages": [
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.5,
+            "max_tokens": 100
+        }
+
+        async with await _post_with_retry(payload) as response:
+            if response.status == 200:
+                result = await response.json(loads=_json_loads)
+                return result['choices'][0]['message']['content']
 
     except Exception as e:
         print(f"Ошибка генерации сводки: {e}")
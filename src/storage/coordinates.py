@@ -2,16 +2,58 @@
 Coordinates storage module.
 Provides synchronous wrapper for async database operations.
 """
-import asyncio
+from collections import OrderedDict
 from typing import Optional, Dict
 import logging
+import threading
+import time
 
-from src.database import get_db
+from src.database import get_db, run_sync
 from src.database.crud import save_coordinates as db_save_coordinates
 from src.database.crud import load_coordinates as db_load_coordinates
 
 logger = logging.getLogger(__name__)
 
+# Short-lived read cache: one interaction looks up the same user several times
+# (keyboard, handler, callbacks). Entries are refreshed on save, so TTL only
+# bounds staleness for writes made by other processes.
+COORDS_CACHE_TTL = 60
+COORDS_CACHE_MAXSIZE = 10000
+
+# LRU order: active users stay cached, the least recently seen are evicted first
+_coords_cache: "OrderedDict[int, tuple]" = OrderedDict()
+_coords_cache_lock = threading.Lock()
+
+
+def _cache_get(user_id: int):
+    """Return (True, value) on a fresh hit, (False, None) otherwise."""
+    with _coords_cache_lock:
+        entry = _coords_cache.get(user_id)
+        if entry is None:
+            return False, None
+        if entry[0] <= time.monotonic():
+            del _coords_cache[user_id]
+            return False, None
+        _coords_cache.move_to_end(user_id)
+        return True, entry[1]
+
+
+def _cache_put(user_id: int, value: Optional[Dict[str, float]]) -> None:
+    with _coords_cache_lock:
+        _coords_cache[user_id] = (time.monotonic() + COORDS_CACHE_TTL, value)
+        _coords_cache.move_to_end(user_id)
+        if len(_coords_cache) > COORDS_CACHE_MAXSIZE:
+            _coords_cache.popitem(last=False)
+
+
+def invalidate_coordinates_cache(user_id: Optional[int] = None) -> None:
+    """Drop the cached coordinates of one user (or of everyone when user_id is None)."""
+    with _coords_cache_lock:
+        if user_id is None:
+            _coords_cache.clear()
+        else:
+            _coords_cache.pop(user_id, None)
+
 
 def save_coordinates(user_id: int, latitude: float, longitude: float, username: Optional[str] = None, first_name: Optional[str] = None):
     """
@@ -41,14 +83,9 @@ def save_coordinates(user_id: int, latitude: float, longitude: float, username:
                     first_name=first_name
                 )
 
-        # Run async operation in sync context
-        # Create a new event loop for this thread (works in worker threads)
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            loop.run_until_complete(_save())
-        finally:
-            loop.close()
+        # Run async operation on the shared long-lived DB loop (no per-call loop setup/teardown)
+        run_sync(_save())
+        _cache_put(user_id, {"latitude": latitude, "longitude": longitude})
 
         logger.info(f"Координаты пользователя {user_id} сохранены: {latitude}, {longitude}")
     except Exception as e:
@@ -66,6 +103,10 @@ def load_coordinates(user_id: int) -> Optional[Dict[str, float]]:
     Returns:
         Dict с ключами 'latitude' и 'longitude' или None
     """
+    hit, cached = _cache_get(user_id)
+    if hit:
+        return cached
+
     try:
         db = get_db()
         if not db:
@@ -82,15 +123,10 @@ def load_coordinates(user_id: int) -> Optional[Dict[str, float]]:
                     }
                 return None
 
-        # Run async operation in sync context
-        # Create a new event loop for this thread (works in worker threads)
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            result = loop.run_until_complete(_load())
-            return result
-        finally:
-            loop.close()
+        # Run async operation on the shared long-lived DB loop (no per-call loop setup/teardown)
+        result = run_sync(_load())
+        _cache_put(user_id, result)
+        return result
     except Exception as e:
         logger.error(f"Ошибка при загрузке координат: {e}", exc_info=True)
         return None
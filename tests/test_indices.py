@@ -0,0 +1,29 @@
+import unittest
+
+import numpy as np
+
+from src.models.indices import _rolling_sum, calculate_spi
+
+
+class RollingSumMissingMonthTest(unittest.TestCase):
+    """Пропущенный месяц портит только окна, в которые он попадает"""
+
+    def setUp(self):
+        self.precip = np.random.default_rng(0).gamma(2.0, 20.0, 120)
+        self.precip[40] = np.nan
+
+    def test_only_windows_with_gap_are_nan(self):
+        sums = _rolling_sum(self.precip, 3)
+        self.assertEqual(sums.shape, (118,))
+        np.testing.assert_array_equal(np.flatnonzero(np.isnan(sums)), [38, 39, 40])
+        self.assertAlmostEqual(sums[41], self.precip[41:44].sum())
+        self.assertAlmostEqual(sums[37], self.precip[37:40].sum())
+
+    def test_spi_skips_windows_with_gap(self):
+        result = calculate_spi(self.precip, timescale=3)
+        self.assertIsNotNone(result['latest_spi'])
+        self.assertEqual(len(result['spi_values']), 115)
+
+
+if __name__ == '__main__':
+    unittest.main()